@@ -1,22 +1,44 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, g, has_app_context, has_request_context
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 import sqlite3
 import os
+import urllib.parse
+import gc
 import json
 from datetime import datetime, timedelta
-from functools import wraps
+from functools import wraps, lru_cache
 from dotenv import load_dotenv
+import click
 import logging
+try:
+    import fcntl  # Only used to keep gunicorn workers from backing up at the same time
+except ImportError:
+    fcntl = None
 from contextlib import contextmanager
 import random
 import string
+import threading
+import time
+import heapq
+import itertools
+import contextvars
+from collections import deque
+import queue
+import atexit
+import gzip
+import shutil
+from concurrent.futures import Future
+import traceback
+import weakref
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import markdown
 import re
+import warnings
+import numpy as np
 
 # Load environment variables from .env file
 load_dotenv()
@@ -41,6 +63,140 @@ logger = logging.getLogger(__name__)
 # This allows different configurations for development/production
 DATABASE_PATH = os.getenv('DATABASE_PATH', 'education.db')
 DATABASE_TIMEOUT = float(os.getenv('DATABASE_TIMEOUT', '30.0'))
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+
+# Connection pool settings (one pool per worker process)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10.0'))
+DB_POOL_MAX_LIFETIME = float(os.getenv('DB_POOL_MAX_LIFETIME', '3600'))
+DB_POOL_HEALTH_CHECK_INTERVAL = float(os.getenv('DB_POOL_HEALTH_CHECK_INTERVAL', '30'))
+# Read-only pool used by GET requests (mode=ro, query_only, large mmap)
+DB_READ_POOL_SIZE = int(os.getenv('DB_READ_POOL_SIZE', '20'))
+DB_READ_MMAP_SIZE = int(os.getenv('DB_READ_MMAP_SIZE', str(1024 * 1024 * 1024)))
+# Per-request SQL tracing (Server-Timing header + N+1 warnings)
+DB_TRACE_ENABLED = os.getenv('DB_TRACE_ENABLED', 'true').lower() == 'true'
+DB_N_PLUS_ONE_THRESHOLD = int(os.getenv('DB_N_PLUS_ONE_THRESHOLD', '10'))  # same statement shape per request
+DB_REQUEST_STATEMENT_LIMIT = int(os.getenv('DB_REQUEST_STATEMENT_LIMIT', '50'))  # statements per request
+DB_TRACE_SLOWEST = int(os.getenv('DB_TRACE_SLOWEST', '3'))
+# Slow-query log: statements slower than this are kept with their query plan
+DB_SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', '100'))  # 0 disables
+DB_SLOW_QUERY_LOG_SIZE = int(os.getenv('DB_SLOW_QUERY_LOG_SIZE', '200'))
+# Log connections still checked out after request teardown (with the checkout stack)
+DB_LEAK_DEBUG = os.getenv('DB_LEAK_DEBUG', 'false').lower() == 'true'
+
+# PRAGMA performance profiles. DB_PROFILE picks one; any single PRAGMA can be
+# overridden with DB_PRAGMA_<NAME>, e.g. DB_PRAGMA_CACHE_SIZE=-64000
+DB_PRAGMA_PROFILES = {
+    # WAL lets dashboard readers run while submit_quiz/handle_message write
+    'performance': {
+        'busy_timeout': 5000,        # ms to wait on a lock before failing
+        'auto_vacuum': 'INCREMENTAL',  # new databases only; must precede journal_mode
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',     # durable at checkpoints, no fsync per commit
+        'cache_size': -20000,        # negative = KiB (about 20 MB per connection)
+        'mmap_size': 268435456,      # 256 MB memory-mapped I/O
+        'temp_store': 'MEMORY'
+    },
+    'durable': {
+        'busy_timeout': 5000,
+        'auto_vacuum': 'INCREMENTAL',
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'cache_size': -20000,
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY'
+    },
+    # SQLite defaults (rollback journal)
+    'legacy': {
+        'busy_timeout': int(DATABASE_TIMEOUT * 1000),
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'cache_size': -2000,
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT'
+    }
+}
+DB_PROFILE = os.getenv('DB_PROFILE', 'performance')
+if DB_PROFILE not in DB_PRAGMA_PROFILES:
+    logger.warning(f"Unknown DB_PROFILE '{DB_PROFILE}', using 'performance'")
+    DB_PROFILE = 'performance'
+DB_PRAGMAS = dict(DB_PRAGMA_PROFILES[DB_PROFILE])
+for _pragma in DB_PRAGMAS:
+    _override = os.getenv(f'DB_PRAGMA_{_pragma.upper()}')
+    if _override:
+        DB_PRAGMAS[_pragma] = _override
+
+# Readers can't change journal_mode; they get a bigger mmap and query_only
+DB_READ_PRAGMAS = {k: v for k, v in DB_PRAGMAS.items() if k not in ('journal_mode', 'auto_vacuum')}
+DB_READ_PRAGMAS['mmap_size'] = DB_READ_MMAP_SIZE
+DB_READ_PRAGMAS['query_only'] = 1
+
+# WAL checkpointing: PASSIVE every interval, TRUNCATE once the -wal file
+# grows past the size limit
+DB_WAL_AUTOCHECKPOINT = int(os.getenv('DB_WAL_AUTOCHECKPOINT', '1000'))  # pages
+DB_WAL_CHECKPOINT_INTERVAL = float(os.getenv('DB_WAL_CHECKPOINT_INTERVAL', '300'))
+DB_WAL_TRUNCATE_BYTES = int(os.getenv('DB_WAL_TRUNCATE_BYTES', str(64 * 1024 * 1024)))
+
+# Maintenance scheduler. Heavy tasks wait for a quiet moment: fewer than
+# DB_MAINTENANCE_IDLE_RPM requests in the last minute, or inside
+# DB_MAINTENANCE_WINDOW (local hours, e.g. "2-5"); a task overdue by twice
+# its interval runs regardless
+DB_MAINTENANCE_TICK = float(os.getenv('DB_MAINTENANCE_TICK', '60'))
+DB_MAINTENANCE_IDLE_RPM = int(os.getenv('DB_MAINTENANCE_IDLE_RPM', '30'))
+DB_MAINTENANCE_WINDOW = os.getenv('DB_MAINTENANCE_WINDOW', '2-5')
+DB_OPTIMIZE_INTERVAL = float(os.getenv('DB_OPTIMIZE_INTERVAL', '3600'))
+DB_ANALYZE_INTERVAL = float(os.getenv('DB_ANALYZE_INTERVAL', '86400'))
+DB_VACUUM_INTERVAL = float(os.getenv('DB_VACUUM_INTERVAL', '86400'))
+DB_VACUUM_PAGES = int(os.getenv('DB_VACUUM_PAGES', '2000'))  # pages freed per run
+DB_OTP_PURGE_INTERVAL = float(os.getenv('DB_OTP_PURGE_INTERVAL', '3600'))
+DB_GAP_RECONCILE_INTERVAL = float(os.getenv('DB_GAP_RECONCILE_INTERVAL', '86400'))
+
+# Single-writer queue: writes arriving within the batch window share one commit
+DB_WRITER_BATCH_WINDOW_MS = float(os.getenv('DB_WRITER_BATCH_WINDOW_MS', '3'))
+DB_WRITER_MAX_BATCH = int(os.getenv('DB_WRITER_MAX_BATCH', '200'))
+DB_WRITER_QUEUE_SIZE = int(os.getenv('DB_WRITER_QUEUE_SIZE', '10000'))
+DB_WRITER_RESULT_TIMEOUT = float(os.getenv('DB_WRITER_RESULT_TIMEOUT', '10.0'))
+
+# Online backups with the SQLite backup API (0 interval disables the schedule)
+DB_BACKUP_DIR = os.getenv('DB_BACKUP_DIR', 'backups')
+DB_BACKUP_INTERVAL = float(os.getenv('DB_BACKUP_INTERVAL', str(6 * 3600)))  # seconds
+DB_BACKUP_KEEP = int(os.getenv('DB_BACKUP_KEEP', '7'))
+DB_BACKUP_PAGES_PER_STEP = int(os.getenv('DB_BACKUP_PAGES_PER_STEP', '256'))
+DB_BACKUP_STEP_SLEEP = float(os.getenv('DB_BACKUP_STEP_SLEEP', '0.02'))  # seconds between steps
+
+# Row counts and health on the status endpoints are served from a snapshot this old at most
+DB_STATS_MAX_AGE = float(os.getenv('DB_STATS_MAX_AGE', '30'))
+
+# Class mastery matrices are dropped on submission in this worker; the TTL
+# bounds how stale other workers' copies can get
+CLASS_MASTERY_CACHE_TTL = float(os.getenv('CLASS_MASTERY_CACHE_TTL', '300'))
+
+# Per-class topic -> lectures/quizzes maps; same invalidate-plus-TTL scheme
+TOPIC_CONTENT_CACHE_TTL = float(os.getenv('TOPIC_CONTENT_CACHE_TTL', '300'))
+
+# Bayesian Knowledge Tracing: batch refit of per-topic parameters (seconds; 0 disables)
+BKT_REFIT_INTERVAL = float(os.getenv('BKT_REFIT_INTERVAL', str(7 * 86400)))
+BKT_MIN_FIT_OBSERVATIONS = int(os.getenv('BKT_MIN_FIT_OBSERVATIONS', '50'))  # answers per topic
+
+# Item Response Theory (2PL) calibration and adaptive quizzes
+IRT_CALIBRATE_INTERVAL = float(os.getenv('IRT_CALIBRATE_INTERVAL', '86400'))  # 0 disables
+IRT_MIN_RESPONSES = int(os.getenv('IRT_MIN_RESPONSES', '30'))  # answers before an item is calibrated
+IRT_ITEM_BANK_TTL = float(os.getenv('IRT_ITEM_BANK_TTL', '600'))
+ADAPTIVE_QUIZ_MAX_ITEMS = int(os.getenv('ADAPTIVE_QUIZ_MAX_ITEMS', '15'))
+ADAPTIVE_QUIZ_TARGET_SE = float(os.getenv('ADAPTIVE_QUIZ_TARGET_SE', '0.4'))  # stop once this precise
+
+# Item-item collaborative filtering over quiz attempts, lecture views and
+# completed recommendations (rebuild interval in seconds; 0 disables)
+CF_REBUILD_INTERVAL = float(os.getenv('CF_REBUILD_INTERVAL', '86400'))
+CF_NEIGHBORS = int(os.getenv('CF_NEIGHBORS', '20'))  # neighbours kept per item
+CF_MIN_COOCCURRENCE = int(os.getenv('CF_MIN_COOCCURRENCE', '3'))  # students in common
+
+# Spaced-repetition reviews: how far ahead (seconds) a connecting student's
+# upcoming reviews are queued for 'review_due' Socket.IO pushes
+REVIEW_NOTIFY_HORIZON = float(os.getenv('REVIEW_NOTIFY_HORIZON', '86400'))
+
+# Teacher intervention alerts are raised by a periodic sweep (seconds; 0 disables)
+INTERVENTION_SWEEP_INTERVAL = float(os.getenv('INTERVENTION_SWEEP_INTERVAL', '3600'))
 
 app = Flask(__name__)
 # Load SECRET_KEY from environment variable (more secure)
@@ -127,43 +283,668 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 # DATABASE CONNECTION FUNCTIONS WITH ERROR HANDLING
 # ============================================================================
 
-def get_db():
+_PRAGMA_VALUE_RE = re.compile(r'^-?[A-Za-z0-9_]+$')
+
+def apply_pragma_profile(conn, pragmas):
     """
-    Connect to the SQLite database using path and timeout from env vars.
-    Returns db object and ensures proper error, logging, and constraints.
+    Apply a PRAGMA profile to a connection.
+    journal_mode is persistent in the database file; the rest are per connection.
+    auto_vacuum only takes effect on a new, empty database; existing ones need
+    a one-off `flask --app app db-maintenance vacuum` to switch over.
     """
+    for name, value in pragmas.items():
+        if not _PRAGMA_VALUE_RE.match(str(value)):
+            logger.warning(f"Ignoring invalid PRAGMA value {name}={value!r}")
+            continue
+        try:
+            conn.execute(f'PRAGMA {name} = {value}').fetchall()
+        except sqlite3.Error as e:
+            # e.g. switching journal_mode while another process holds a lock
+            logger.warning(f"Could not apply PRAGMA {name}={value}: {e}")
+    if str(pragmas.get('journal_mode', '')).upper() == 'WAL':
+        conn.execute(f'PRAGMA wal_autocheckpoint = {DB_WAL_AUTOCHECKPOINT}').fetchall()
+    # Enable foreign key constraints (SQLite doesn't enable by default)
+    conn.execute('PRAGMA foreign_keys = ON')
+
+def read_pragma_profile(conn, pragmas=None):
+    """Read back the PRAGMA values actually in effect on a connection."""
+    effective = {}
+    for name in list(pragmas or DB_PRAGMAS) + ['wal_autocheckpoint', 'foreign_keys']:
+        row = conn.execute(f'PRAGMA {name}').fetchone()
+        effective[name] = row[0] if row else None
+    return effective
+
+_SQL_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """Statement shape: whitespace collapsed, inline literals replaced by ?"""
+    return _SQL_LITERAL_RE.sub('?', ' '.join(sql.split()))
+
+
+class RequestSQLTrace:
+    """Statement count, time, slowest statements and repeated shapes for one request."""
+
+    def __init__(self, slowest=DB_TRACE_SLOWEST):
+        self.count = 0
+        self.total_time = 0.0
+        self.shapes = {}
+        self._slowest = []
+        self._keep = slowest
+
+    def record(self, sql, duration):
+        self.count += 1
+        self.total_time += duration
+        shape = normalize_sql(sql)
+        entry = self.shapes.get(shape)
+        if entry is None:
+            self.shapes[shape] = [1, duration]
+        else:
+            entry[0] += 1
+            entry[1] += duration
+        item = (duration, self.count, shape)
+        if len(self._slowest) < self._keep:
+            heapq.heappush(self._slowest, item)
+        elif duration > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, item)
+
+    def slowest(self):
+        return [
+            {'sql': shape, 'duration_ms': round(duration * 1000, 3)}
+            for duration, _, shape in sorted(self._slowest, reverse=True)
+        ]
+
+    def repeated(self, threshold):
+        """Statement shapes executed at least `threshold` times (N+1 suspects)."""
+        return sorted(
+            ((shape, count, total) for shape, (count, total) in self.shapes.items()
+             if count >= threshold),
+            key=lambda item: item[1],
+            reverse=True
+        )
+
+
+# Trace of the request running in this context (None outside traced requests)
+current_sql_trace = contextvars.ContextVar('current_sql_trace', default=None)
+
+
+def param_shape(parameters):
+    """Types of the bound parameters, never their values."""
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
     try:
-        # Create connection with timeout setting
-        db = sqlite3.connect(
-            DATABASE_PATH,
-            timeout=DATABASE_TIMEOUT,
-            check_same_thread=False  # Allow multi-threaded access
+        return [type(value).__name__ for value in parameters]
+    except TypeError:
+        return type(parameters).__name__
+
+
+class SlowQueryLog:
+    """
+    Bounded ring buffer of statements slower than threshold_ms.
+    Each record has the normalized SQL, parameter types, duration and the
+    EXPLAIN QUERY PLAN output (cached per statement shape).
+    """
+
+    _EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH')
+
+    def __init__(self, threshold_ms, size):
+        self.threshold = threshold_ms / 1000.0
+        self._entries = deque(maxlen=size)
+        self._plans = {}
+        self._lock = threading.Lock()
+        self.recorded = 0
+
+    @property
+    def enabled(self):
+        return self.threshold > 0
+
+    def _explain(self, conn, sql, shape):
+        plan = self._plans.get(shape)
+        if plan is not None:
+            return plan
+        if not shape.upper().startswith(self._EXPLAINABLE):
+            return []
+        try:
+            # The plan doesn't depend on values, so bind NULLs
+            rows = sqlite3.Connection.execute(
+                conn, f'EXPLAIN QUERY PLAN {sql}', [None] * sql.count('?')
+            ).fetchall()
+            plan = [row[3] for row in rows]
+        except sqlite3.Error as e:
+            plan = [f'unavailable: {e}']
+        if len(self._plans) < 1000:
+            self._plans[shape] = plan
+        return plan
+
+    def record(self, conn, sql, parameters, duration, many=False):
+        shape = normalize_sql(sql)
+        if many:
+            params = {'executemany': True,
+                      'rows': len(parameters) if isinstance(parameters, (list, tuple)) else None}
+        else:
+            params = param_shape(parameters)
+        entry = {
+            'sql': shape,
+            'params': params,
+            'duration_ms': round(duration * 1000, 2),
+            'plan': self._explain(conn, sql, shape),
+            'endpoint': request.path if has_request_context() else None,
+            'recorded_at': datetime.now().isoformat()
+        }
+        with self._lock:
+            self._entries.append(entry)
+            self.recorded += 1
+        logger.warning(
+            f"Slow query ({entry['duration_ms']} ms) params={params}: {shape[:200]} "
+            f"| plan: {'; '.join(entry['plan'])}"
         )
 
-        # Enable Row factory for dictionary-like access to results
-        db.row_factory = sqlite3.Row
-        # Enable foreign key constraints (SQLite doesn't enable by default)
-        db.execute('PRAGMA foreign_keys = ON')
-        logger.debug(f"Database connection established: {DATABASE_PATH}")
-        return db
+    def entries(self):
+        with self._lock:
+            return list(reversed(self._entries))
+
+    def stats(self):
+        with self._lock:
+            buffered = len(self._entries)
+        return {
+            'threshold_ms': self.threshold * 1000,
+            'recorded': self.recorded,
+            'buffered': buffered,
+            'capacity': self._entries.maxlen
+        }
+
+
+slow_query_log = SlowQueryLog(DB_SLOW_QUERY_MS, DB_SLOW_QUERY_LOG_SIZE)
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    sqlite3 connection that returns itself to its pool on close().
+    The pool decides whether the underlying handle is reused or really closed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.last_thread = None
+        self.checked_out = False
+        self.checkout_stack = None
+        self.finalizer = None
+
+    def execute(self, sql, parameters=()):
+        trace = current_sql_trace.get()
+        if trace is None and not slow_query_log.enabled:
+            return super().execute(sql, parameters)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._record(trace, sql, parameters, time.perf_counter() - started, False)
+
+    def executemany(self, sql, seq_of_parameters):
+        trace = current_sql_trace.get()
+        if trace is None and not slow_query_log.enabled:
+            return super().executemany(sql, seq_of_parameters)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._record(trace, sql, seq_of_parameters, time.perf_counter() - started, True)
+
+    def _record(self, trace, sql, parameters, duration, many):
+        if trace is not None:
+            trace.record(sql, duration)
+        if slow_query_log.enabled and duration >= slow_query_log.threshold:
+            slow_query_log.record(self, sql, parameters, duration, many)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.release(self)
+        else:
+            super().close()
+
+    def close_for_real(self):
+        sqlite3.Connection.close(self)
+
+
+class SQLiteConnectionPool:
+    """
+    Bounded, thread-aware pool of SQLite connections.
+
+    - One pool per worker process (state is reset after a fork)
+    - Threads get back the connection they used last when it is idle
+    - Idle connections are health-checked and retired after max_lifetime
+    - The PRAGMA profile is applied once when a connection is created
+    - Connections dropped without close() are detected and not counted
+      against the pool size
+    """
+
+    def __init__(self, path, timeout, max_size, acquire_timeout,
+                 max_lifetime, health_check_interval, pragmas=None,
+                 read_only=False, track_stacks=False):
+        self.path = path
+        self.pragmas = pragmas or {}
+        self.read_only = read_only
+        self.timeout = timeout
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.max_lifetime = max_lifetime
+        self.health_check_interval = health_check_interval
+        self.track_stacks = track_stacks
+        self._lock = threading.Condition(threading.RLock())
+        self._reset_state()
+
+    def _reset_state(self):
+        self._pid = os.getpid()
+        self._idle = []
+        self._size = 0
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time_seconds': 0.0,
+            'timeouts': 0,
+            'creations': 0,
+            'retired_expired': 0,
+            'retired_unhealthy': 0,
+            'leaked': 0,
+            'peak_in_use': 0
+        }
+
+    def _check_pid(self):
+        # A forked worker must never share SQLite handles with its parent
+        if self._pid != os.getpid():
+            self._reset_state()
+
+    def _connect(self):
+        conn = None
+        if self.read_only:
+            try:
+                conn = sqlite3.connect(
+                    f'file:{urllib.parse.quote(os.path.abspath(self.path))}?mode=ro',
+                    uri=True,
+                    timeout=self.timeout,
+                    check_same_thread=False,
+                    factory=PooledConnection
+                )
+                conn.execute('PRAGMA schema_version').fetchall()
+            except sqlite3.Error as e:
+                # mode=ro can't open a WAL database whose -shm file is gone;
+                # fall back to a normal handle (query_only still blocks writes)
+                logger.debug(f"Read-only open failed, falling back to query_only: {e}")
+                if conn is not None:
+                    conn.close_for_real()
+                conn = None
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path,
+                timeout=self.timeout,
+                check_same_thread=False,  # Connections move between threads via the pool
+                factory=PooledConnection
+            )
+        conn.row_factory = sqlite3.Row
+        self._apply_pragmas(conn)
+        conn.pool = self
+        self._stats['creations'] += 1
+        logger.debug(f"Pooled database connection created: {self.path}")
+        return conn
+
+    def _apply_pragmas(self, conn):
+        apply_pragma_profile(conn, self.pragmas)
+
+    def _is_expired(self, conn, now):
+        return self.max_lifetime > 0 and now - conn.created_at > self.max_lifetime
+
+    def _is_healthy(self, conn, now):
+        if now - conn.last_used < self.health_check_interval:
+            return True
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error as e:
+            logger.warning(f"Discarding unhealthy pooled connection: {e}")
+            return False
+
+    def _discard(self, conn):
+        self._size -= 1
+        try:
+            conn.close_for_real()
+        except sqlite3.Error:
+            pass
+
+    def _on_leak(self, pid, stack):
+        with self._lock:
+            if pid != self._pid:
+                return
+            self._size -= 1
+            self._stats['leaked'] += 1
+            self._lock.notify()
+        if stack:
+            logger.warning(f"Pooled database connection was garbage collected without close(). Checked out at:\n{stack}")
+        else:
+            logger.warning("Pooled database connection was garbage collected without close()")
+
+    def _pop_idle(self):
+        # Prefer the connection this thread used last (warm page cache),
+        # otherwise the most recently returned one
+        ident = threading.get_ident()
+        for i in range(len(self._idle) - 1, -1, -1):
+            if self._idle[i].last_thread == ident:
+                return self._idle.pop(i)
+        return self._idle.pop()
+
+    def acquire(self):
+        """Check out a connection, waiting up to acquire_timeout if the pool is full."""
+        with self._lock:
+            self._check_pid()
+
+            deadline = None
+            collected = False
+            conn = None
+            while conn is None:
+                now = time.monotonic()
+                while self._idle:
+                    candidate = self._pop_idle()
+                    if self._is_expired(candidate, now):
+                        self._stats['retired_expired'] += 1
+                        self._discard(candidate)
+                    elif not self._is_healthy(candidate, now):
+                        self._stats['retired_unhealthy'] += 1
+                        self._discard(candidate)
+                    else:
+                        conn = candidate
+                        break
+
+                if conn is None and self._size < self.max_size:
+                    conn = self._connect()
+                    self._size += 1
+                elif conn is None and not collected:
+                    # sqlite3 connections sit in reference cycles, so handles
+                    # dropped without close() linger until the cyclic GC runs
+                    collected = True
+                    gc.collect()
+                elif conn is None:
+                    if deadline is None:
+                        deadline = now + self.acquire_timeout
+                        self._stats['waits'] += 1
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise sqlite3.OperationalError(
+                            f"Connection pool exhausted ({self.max_size} connections in use)"
+                        )
+                    self._lock.wait(remaining)
+                    self._stats['wait_time_seconds'] += time.monotonic() - now
+
+            conn.checked_out = True
+            conn.last_thread = threading.get_ident()
+            conn.checkout_stack = ''.join(traceback.format_stack()[:-2]) if self.track_stacks else None
+            conn.finalizer = weakref.finalize(conn, self._on_leak, self._pid, conn.checkout_stack)
+            conn.finalizer.atexit = False
+            self._stats['checkouts'] += 1
+            in_use = self._size - len(self._idle)
+            if in_use > self._stats['peak_in_use']:
+                self._stats['peak_in_use'] = in_use
+            return conn
+
+    def release(self, conn):
+        """Return a connection to the pool (a second close() is a no-op)."""
+        with self._lock:
+            if not conn.checked_out:
+                return
+            conn.checked_out = False
+
+            if conn.finalizer is not None:
+                conn.finalizer.detach()
+                conn.finalizer = None
+
+            if self._pid != os.getpid():
+                # Checked out before a fork; just drop it
+                return
+
+            try:
+                # Never hand out a connection with a half-finished transaction
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error as e:
+                logger.warning(f"Rollback on release failed, discarding connection: {e}")
+                self._discard(conn)
+                self._lock.notify()
+                return
+
+            now = time.monotonic()
+            if self._is_expired(conn, now):
+                self._stats['retired_expired'] += 1
+                self._discard(conn)
+            else:
+                conn.last_used = now
+                self._idle.append(conn)
+            self._lock.notify()
+
+    def close_all(self):
+        """Close every idle connection (used on shutdown and in maintenance)."""
+        with self._lock:
+            while self._idle:
+                self._discard(self._idle.pop())
+
+    def stats(self):
+        with self._lock:
+            self._check_pid()
+            stats = dict(self._stats)
+            stats['wait_time_seconds'] = round(stats['wait_time_seconds'], 4)
+            stats.update({
+                'pid': self._pid,
+                'read_only': self.read_only,
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'max_lifetime_seconds': self.max_lifetime
+            })
+            return stats
+
+
+db_pool = SQLiteConnectionPool(
+    DATABASE_PATH,
+    timeout=DATABASE_TIMEOUT,
+    max_size=DB_POOL_SIZE,
+    acquire_timeout=DB_POOL_TIMEOUT,
+    max_lifetime=DB_POOL_MAX_LIFETIME,
+    health_check_interval=DB_POOL_HEALTH_CHECK_INTERVAL,
+    pragmas=DB_PRAGMAS,
+    track_stacks=DB_LEAK_DEBUG
+)
+
+db_read_pool = SQLiteConnectionPool(
+    DATABASE_PATH,
+    timeout=DATABASE_TIMEOUT,
+    max_size=DB_READ_POOL_SIZE,
+    acquire_timeout=DB_POOL_TIMEOUT,
+    max_lifetime=DB_POOL_MAX_LIFETIME,
+    health_check_interval=DB_POOL_HEALTH_CHECK_INTERVAL,
+    pragmas=DB_READ_PRAGMAS,
+    read_only=True,
+    track_stacks=DB_LEAK_DEBUG
+)
+
+
+class WalCheckpointer:
+    """
+    Keeps the -wal file bounded; run periodically by the maintenance scheduler.
+
+    SQLite's wal_autocheckpoint runs inside whichever commit crosses the
+    threshold (a student's quiz submission); this moves the work off the
+    request path and truncates the file after write bursts.
+    """
+
+    def __init__(self, interval, truncate_bytes):
+        self.interval = interval
+        self.truncate_bytes = truncate_bytes
+        self._lock = threading.Lock()
+        self._stats = {
+            'runs': 0,
+            'failures': 0,
+            'last_run': None,
+            'last_mode': None,
+            'last_duration_ms': None,
+            'last_result': None
+        }
+
+    def checkpoint(self, mode=None):
+        """Run PRAGMA wal_checkpoint and record the result."""
+        wal_path = DATABASE_PATH + '-wal'
+        if mode is None:
+            wal_size = os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+            mode = 'TRUNCATE' if wal_size > self.truncate_bytes else 'PASSIVE'
+        started = time.monotonic()
+        try:
+            with get_db_context() as db:
+                if db.execute('PRAGMA journal_mode').fetchone()[0].lower() != 'wal':
+                    return None
+                busy, log_frames, checkpointed = db.execute(
+                    f'PRAGMA wal_checkpoint({mode})'
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"WAL checkpoint failed: {e}")
+            with self._lock:
+                self._stats['failures'] += 1
+            return None
+
+        result = {'busy': busy, 'log_frames': log_frames, 'checkpointed_frames': checkpointed}
+        with self._lock:
+            self._stats.update({
+                'runs': self._stats['runs'] + 1,
+                'last_run': datetime.now().isoformat(),
+                'last_mode': mode,
+                'last_duration_ms': round((time.monotonic() - started) * 1000, 2),
+                'last_result': result
+            })
+        logger.debug(f"WAL checkpoint ({mode}): {result}")
+        return result
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['interval_seconds'] = self.interval
+        stats['truncate_bytes'] = self.truncate_bytes
+        return stats
+
+
+wal_checkpointer = WalCheckpointer(DB_WAL_CHECKPOINT_INTERVAL, DB_WAL_TRUNCATE_BYTES)
+
+def checkout_db(read_only=False):
+    """
+    Check out a pooled connection to the SQLite database.
+    Returns db object with Row factory and foreign keys enabled;
+    the caller must call db.close() to hand it back to the pool.
+    read_only=True draws from the query_only reader pool instead.
+    """
+    ensure_schema()
+    start_background_services()
+    try:
+        db = (db_read_pool if read_only else db_pool).acquire()
+        logger.debug(f"Database connection checked out: {DATABASE_PATH}")
     except sqlite3.Error as e:
         logger.error(f"Database connection error: {e}")
         raise
 
+    if DB_LEAK_DEBUG and has_app_context():
+        g.setdefault('db_checkouts', []).append(weakref.ref(db))
+    return db
+
+READ_ONLY_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+def get_db():
+    """
+    Return the database connection for the current request.
+    The first call in a request checks a connection out of the pool and
+    stores it on flask.g; close_db() returns it during app context teardown,
+    so routes never close it themselves.
+
+    GET routes get a read-only connection; a GET that has to write queues
+    the write on db_writer. Readers never wait on the writer lock in WAL mode.
+    """
+    if 'db' not in g:
+        read_only = (
+            has_request_context()
+            and request.endpoint is not None  # Socket.IO events have no endpoint
+            and request.method in READ_ONLY_METHODS
+        )
+        g.db = checkout_db(read_only=read_only)
+    return g.db
+
+@app.teardown_appcontext
+def close_db(exception):
+    """Return the request's connection to the pool and report leaked checkouts."""
+    db = g.pop('db', None)
+    if db is not None:
+        db.close()
+
+    if DB_LEAK_DEBUG:
+        for ref in g.pop('db_checkouts', []):
+            conn = ref()
+            if conn is not None and conn.checked_out:
+                logger.warning(
+                    f"Database connection still checked out after teardown. "
+                    f"Checked out at:\n{conn.checkout_stack}"
+                )
+
+@app.before_request
+def start_sql_trace():
+    if DB_TRACE_ENABLED:
+        g.sql_trace = RequestSQLTrace()
+        g.sql_trace_token = current_sql_trace.set(g.sql_trace)
+
+@app.after_request
+def report_sql_trace(response):
+    """Add a Server-Timing header and log requests that look like N+1 patterns."""
+    trace = g.get('sql_trace')
+    if trace is None:
+        return response
+
+    total_ms = trace.total_time * 1000
+    response.headers.add(
+        'Server-Timing', f'db;dur={total_ms:.2f};desc="{trace.count} queries"'
+    )
+
+    repeated = trace.repeated(DB_N_PLUS_ONE_THRESHOLD)
+    if repeated or trace.count > DB_REQUEST_STATEMENT_LIMIT:
+        details = '; '.join(
+            f"{count}x ({total * 1000:.1f} ms) {shape[:120]}" for shape, count, total in repeated[:3]
+        )
+        logger.warning(
+            f"Possible N+1 query pattern in {request.method} {request.path}: "
+            f"{trace.count} statements, {total_ms:.1f} ms. {details}"
+        )
+    else:
+        logger.debug(
+            f"{request.method} {request.path}: {trace.count} statements, {total_ms:.1f} ms, "
+            f"slowest: {trace.slowest()}"
+        )
+    return response
+
+@app.teardown_request
+def stop_sql_trace(exception):
+    token = g.pop('sql_trace_token', None)
+    if token is not None:
+        current_sql_trace.reset(token)
+
 @contextmanager
 def get_db_context():
     """
-    Context manager for database connections.
-    Ensures connections are properly closed even if errors occur.
+    Context manager for database connections outside the request cycle
+    (startup, health checks, background jobs).
+    Ensures connections are returned to the pool even if errors occur.
     
     Usage:
         with get_db_context() as db:
             db.execute("SELECT * FROM users")
-            # Connection automatically closed after block
+            # Connection automatically returned to the pool after block
     """
     db = None
     try:
-        db = get_db()
+        db = checkout_db()
         yield db
         db.commit()
     except sqlite3.Error as e:
@@ -174,7 +955,7 @@ def get_db_context():
     finally:
         if db:
             db.close()
-            logger.debug("Database connection closed")
+            logger.debug("Database connection returned to pool")
 
 def init_db():
     """
@@ -182,7 +963,7 @@ def init_db():
     
     This function:
     - Reads the SQL schema file
-    - Executes all CREATE TABLE statements
+    - Executes all CREATE TABLE / CREATE INDEX statements
     - Includes error handling and rollback on failure
     - Logs the initialization process
     """
@@ -190,21 +971,19 @@ def init_db():
         logger.info("Initializing database...")
         
         # Check if schema file exists
-        if not os.path.exists('schema.sql'):
+        if not os.path.exists(SCHEMA_PATH):
             logger.error("schema.sql file not found!")
             raise FileNotFoundError("schema.sql file is required for database initialization")
         
-        db = get_db()
-        
-        # Read and execute schema
-        with open('schema.sql', 'r', encoding='utf-8') as f:
-            schema_sql = f.read()
-            db.executescript(schema_sql)
-        
-        db.commit()
-        db.close()
+        with get_db_context() as db:
+            # The pooled connection already carries the PRAGMA profile;
+            # re-apply it so journal_mode is persisted in the new file
+            apply_pragma_profile(db, DB_PRAGMAS)
+            migrate_db(db)
+            journal_mode = db.execute('PRAGMA journal_mode').fetchone()[0]
         
-        logger.info(f"Database initialized successfully: {DATABASE_PATH}")
+        logger.info(f"Database initialized successfully: {DATABASE_PATH} "
+                    f"(profile: {DB_PROFILE}, journal_mode: {journal_mode})")
         
     except sqlite3.Error as e:
         logger.error(f"Database initialization failed: {e}")
@@ -213,6 +992,95 @@ def init_db():
         logger.error(f"Unexpected error during database initialization: {e}")
         raise
 
+# Columns added to tables after they first shipped. CREATE TABLE IF NOT EXISTS
+# won't add them to an existing database, so migrate_db does.
+SCHEMA_ADDED_COLUMNS = [
+    ('student_metrics', 'total_score', 'INTEGER DEFAULT 0'),
+    ('student_metrics', 'total_possible', 'INTEGER DEFAULT 0'),
+    ('student_metrics', 'total_duration', 'INTEGER DEFAULT 0'),
+    ('student_metrics', 'submission_count', 'INTEGER DEFAULT 0'),
+    ('student_metrics', 'chat_count', 'INTEGER DEFAULT 0'),
+    ('topic_mastery', 'next_review_at', 'TIMESTAMP'),
+    ('topic_mastery', 'review_interval', 'REAL DEFAULT 0'),
+    ('topic_mastery', 'ease_factor', 'REAL DEFAULT 2.5'),
+    ('topic_mastery', 'review_count', 'INTEGER DEFAULT 0'),
+]
+
+# Unique indexes added after their table shipped, with the WHERE clause of a
+# partial index. Existing databases may hold duplicates, so migrate_db keeps
+# the oldest row of each before creating them.
+SCHEMA_ADDED_UNIQUE_INDEXES = [
+    ('idx_recommendations_unique', 'recommendations',
+     ('user_id', 'content_type', 'content_id', 'is_completed'), None),
+    ('idx_learning_paths_user_class_unique', 'learning_paths', ('user_id', 'class_id'), None),
+    ('idx_teacher_interventions_open_unique', 'teacher_interventions',
+     ('student_id', 'class_id', 'alert_type'), 'is_resolved = 0'),
+]
+
+def migrate_db(db):
+    """
+    Apply schema.sql to a database.
+    Every statement is IF NOT EXISTS, so on an existing database this only
+    adds the tables and indexes it is missing. Missing columns from
+    SCHEMA_ADDED_COLUMNS are added first (and backfilled where needed), and
+    rows that would violate a new unique index are removed.
+    """
+    added_tables = set()
+    for table, column, definition in SCHEMA_ADDED_COLUMNS:
+        columns = {row[1] for row in db.execute(f'PRAGMA table_info({table})').fetchall()}
+        if columns and column not in columns:
+            db.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+            added_tables.add(table)
+            logger.info(f"Added column {table}.{column}")
+    
+    for index, table, columns, where in SCHEMA_ADDED_UNIQUE_INDEXES:
+        table_exists = db.execute(f'PRAGMA table_info({table})').fetchall()
+        index_exists = db.execute(f'PRAGMA index_info({index})').fetchall()
+        if table_exists and not index_exists:
+            where = where or '1'  # a partial index only dedups the rows it covers
+            removed = db.execute(
+                f"DELETE FROM {table} WHERE {where} AND id NOT IN "
+                f"(SELECT MIN(id) FROM {table} WHERE {where} GROUP BY {', '.join(columns)})"
+            ).rowcount
+            if removed:
+                logger.info(f"Removed {removed} duplicate rows from {table} before adding {index}")
+    
+    with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
+        db.executescript(f.read())
+    
+    if 'student_metrics' in added_tables:
+        rebuild_student_metrics(db)
+
+_schema_checked_pid = None
+_schema_lock = threading.Lock()
+
+def ensure_schema():
+    """Run migrate_db once per worker process, before its first query."""
+    global _schema_checked_pid
+    if _schema_checked_pid == os.getpid():
+        return
+    with _schema_lock:
+        if _schema_checked_pid == os.getpid():
+            return
+        if not os.path.exists(SCHEMA_PATH):
+            logger.error("schema.sql file not found, skipping schema upgrade")
+            _schema_checked_pid = os.getpid()
+            return
+        db = db_pool.acquire()
+        try:
+            migrate_db(db)
+            db.commit()
+            # Only now: after a failure (e.g. "database is locked" while a
+            # seed script holds the write lock) the next checkout retries
+            _schema_checked_pid = os.getpid()
+            logger.info(f"Database schema is up to date: {DATABASE_PATH}")
+        except sqlite3.Error as e:
+            if db.in_transaction:
+                db.rollback()
+            logger.error(f"Database schema upgrade failed, will retry: {e}")
+        finally:
+            db.close()
+
 def check_db_health():
     """
     Perform a health check on the database connection.
@@ -221,18 +1089,15 @@ def check_db_health():
         dict: Health check results with status and details
     """
     try:
-        db = get_db()
-        
-        # Try a simple query to verify connection works
-        cursor = db.execute("SELECT COUNT(*) as count FROM sqlite_master WHERE type='table'")
-        result = cursor.fetchone()
-        table_count = result['count']
+        with get_db_context() as db:
+            # Try a simple query to verify connection works
+            cursor = db.execute("SELECT COUNT(*) as count FROM sqlite_master WHERE type='table'")
+            result = cursor.fetchone()
+            table_count = result['count']
         
         # Check if database file exists and is readable
         db_size = os.path.getsize(DATABASE_PATH) if os.path.exists(DATABASE_PATH) else 0
         
-        db.close()
-        
         health_status = {
             'status': 'healthy',
             'database_path': DATABASE_PATH,
@@ -241,206 +1106,2437 @@ def check_db_health():
             'connection_timeout': DATABASE_TIMEOUT
         }
         
-        logger.info(f"Database health check passed: {table_count} tables found")
+        logger.debug(f"Database health check passed: {table_count} tables found")
+        db_stats.record_health(health_status)
         return health_status
         
     except sqlite3.Error as e:
         logger.error(f"Database health check failed: {e}")
-        return {
+        return db_stats.record_health({
             'status': 'unhealthy',
             'error': str(e),
             'database_path': DATABASE_PATH
-        }
+        })
     except Exception as e:
         logger.error(f"Unexpected error during health check: {e}")
-        return {
+        return db_stats.record_health({
             'status': 'unhealthy',
             'error': str(e),
             'database_path': DATABASE_PATH
-        }
-
-# ============================================================================
-# HELPER FUNCTIONS FOR NEW FEATURES
-# ============================================================================
+        })
 
-def generate_otp(length=4):
-    """Generate a random OTP (numeric only)"""
-    return ''.join(random.choices(string.digits, k=length))
 
-def send_otp_email(email, otp):
-    """
-    Send OTP email using Gmail SMTP
-    
-    Returns:
-        bool: True if email sent successfully, False otherwise
+class DatabaseStatsCache:
     """
-    if not GMAIL_USERNAME or not GMAIL_APP_PASSWORD:
-        logger.error("Gmail credentials not configured")
-        return False
-    
-    try:
-        # Create message
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = 'Password Reset OTP - Education Platform'
-        msg['From'] = GMAIL_USERNAME
-        msg['To'] = email
-        
-        # HTML email content
-        html_content = f"""
-        <html>
-        <body style="font-family: Arial, sans-serif; padding: 20px;">
-            <div style="max-width: 600px; margin: 0 auto; background: #f9f9f9; padding: 30px; border-radius: 10px;">
-                <h2 style="color: #667eea;">Password Reset Request</h2>
-                <p>Hello,</p>
-                <p>You requested to reset your password. Use the OTP below to continue:</p>
-                <div style="background: white; padding: 20px; border-radius: 5px; text-align: center; margin: 20px 0;">
-                    <h1 style="color: #667eea; font-size: 48px; letter-spacing: 10px; margin: 0;">{otp}</h1>
-                </div>
-                <p>This OTP will expire in 10 minutes.</p>
-                <p>If you didn't request this, please ignore this email.</p>
-                <hr style="border: none; border-top: 1px solid #ddd; margin: 20px 0;">
-                <p style="color: #666; font-size: 12px;">Education Platform - AI-Driven Adaptive Learning</p>
-            </div>
-        </body>
-        </html>
-        """
-        
-        part = MIMEText(html_content, 'html')
-        msg.attach(part)
-        
-        # Send email
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(GMAIL_USERNAME, GMAIL_APP_PASSWORD)
-        server.sendmail(GMAIL_USERNAME, email, msg.as_string())
-        server.quit()
-        
-        logger.info(f"OTP email sent successfully to {email}")
-        return True
-        
-    except Exception as e:
-        logger.error(f"Failed to send OTP email: {e}")
-        return False
+    Snapshot of row counts and the last health check, so /api/db/status and
+    the health probes don't query the database on every call.
 
-def render_markdown_with_math(text):
-    """
-    Render markdown and preserve math equations for MathJax
-    
-    Args:
-        text: Raw text with markdown and LaTeX
-        
-    Returns:
-        HTML with markdown rendered and math preserved
+    Row counts come from table_row_counts, which triggers in schema.sql keep
+    current; the snapshot is re-read at most once per max_age seconds.
     """
-    # Convert markdown to HTML
-    html = markdown.markdown(text, extensions=['extra', 'codehilite'])
-    
-    # Return HTML (MathJax will handle math rendering on frontend)
-    return html
 
-def clean_expired_otps():
-    """Clean up expired OTPs from database"""
-    try:
-        db = get_db()
-        db.execute("DELETE FROM password_reset_otp WHERE expires_at < ? OR used = 1", 
-                  (datetime.now(),))
-        db.commit()
-        db.close()
-    except Exception as e:
-        logger.error(f"Failed to clean expired OTPs: {e}")
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._counts = None
+        self._counts_at = None      # monotonic
+        self._counts_as_of = None   # wall clock, for the response
+        self._health = None
+        self._health_at = None
+
+    def _fresh(self, taken_at):
+        return taken_at is not None and time.monotonic() - taken_at < self.max_age
+
+    def table_counts(self):
+        with self._lock:
+            if self._fresh(self._counts_at):
+                return self._counts
+        db = checkout_db(read_only=True)
+        try:
+            rows = db.execute('SELECT table_name, row_count FROM table_row_counts').fetchall()
+        finally:
+            db.close()
+        counts = {row['table_name']: row['row_count'] for row in rows}
+        with self._lock:
+            self._counts = counts
+            self._counts_at = time.monotonic()
+            self._counts_as_of = datetime.now().isoformat()
+        return counts
+
+    def recount(self):
+        """Recompute the counts from the tables (corrects any drift)."""
+        with get_db_context() as db:
+            tables = [row['table_name'] for row in
+                      db.execute('SELECT table_name, row_count FROM table_row_counts').fetchall()]
+            for table in tables:
+                db.execute(
+                    f"UPDATE table_row_counts SET row_count = (SELECT COUNT(*) FROM {table}) "
+                    f"WHERE table_name = ?", (table,)
+                )
+        with self._lock:
+            self._counts_at = None
+        return {'tables': len(tables)}
+
+    def record_health(self, health):
+        with self._lock:
+            self._health = dict(health, checked_at=datetime.now().isoformat())
+            self._health_at = time.monotonic()
+        return health
+
+    def health(self, refresh=True):
+        """Last health check result; re-run it if stale and refresh is set."""
+        with self._lock:
+            if self._fresh(self._health_at) or not refresh:
+                return self._health
+        check_db_health()
+        with self._lock:
+            return self._health
+
+    def snapshot_info(self):
+        with self._lock:
+            age = None if self._counts_at is None else round(time.monotonic() - self._counts_at, 1)
+            return {'as_of': self._counts_as_of, 'age_seconds': age, 'max_age_seconds': self.max_age}
+
+
+db_stats = DatabaseStatsCache(DB_STATS_MAX_AGE)
 
 # ============================================================================
-# ADAPTIVE LEARNING ENGINE - AI-DRIVEN PERSONALIZATION
+# SINGLE-WRITER QUEUE WITH GROUP COMMIT
 # ============================================================================
 
-def analyze_knowledge_gaps(db, student_id, class_id):
+class WriteCoordinator:
     """
-    AI-powered knowledge gap detection from quiz performance.
-    Analyzes which topics student struggles with.
+    Dedicated writer thread for SQLite writes.
+
+    SQLite allows one writer at a time, so request threads hand write jobs
+    to this thread instead of fighting over the lock. Jobs that arrive within
+    the batch window run in a single transaction (one fsync for the batch);
+    each job gets its own SAVEPOINT so a failing job does not undo the others.
+
+    A job is fn(db, *args). It must not commit; its return value (or
+    exception) is delivered through the Future returned by submit().
+    """
+
+    def __init__(self, batch_window_ms, max_batch, queue_size):
+        self.batch_window = batch_window_ms / 1000.0
+        self.max_batch = max_batch
+        self.queue_size = queue_size
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._stats = {
+            'jobs': 0,
+            'failed_jobs': 0,
+            'batches': 0,
+            'failed_batches': 0,
+            'max_batch_size': 0,
+            'commit_time_seconds': 0.0
+        }
+
+    def _ensure_started(self):
+        # Threads do not survive fork, so each worker starts its own writer
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def submit(self, fn, *args):
+        """Queue a write job and return a Future for its result."""
+        self._ensure_started()
+        future = Future()
+        try:
+            # A job queueing a follow-up must not wait on its own thread's queue
+            block = threading.current_thread() is not self._thread
+            self._queue.put((fn, args, future), block=block, timeout=DB_WRITER_RESULT_TIMEOUT)
+        except queue.Full:
+            raise sqlite3.OperationalError(
+                f"Write queue full ({self.queue_size} pending writes)"
+            )
+        return future
+
+    def execute(self, sql, params=()):
+        """Queue a single statement; the Future resolves to cursor.lastrowid."""
+        return self.submit(_execute_write, sql, params)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            batch = [job]
+            stop = False
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch:
+                try:
+                    # Always take what is already queued; wait for more only
+                    # until the batch window closes
+                    remaining = deadline - time.monotonic()
+                    if remaining > 0:
+                        job = self._queue.get(timeout=remaining)
+                    else:
+                        job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stop = True
+                    break
+                batch.append(job)
+
+            self._commit_batch(batch)
+            if stop:
+                return
+
+    def _commit_batch(self, batch):
+        started = time.monotonic()
+        outcomes = []
+        db = None
+        try:
+            db = checkout_db()
+            db.execute('BEGIN IMMEDIATE')
+            for fn, args, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                db.execute('SAVEPOINT write_job')
+                try:
+                    result = fn(db, *args)
+                    db.execute('RELEASE write_job')
+                    outcomes.append((future, result, None))
+                except Exception as e:
+                    db.execute('ROLLBACK TO write_job')
+                    db.execute('RELEASE write_job')
+                    outcomes.append((future, None, e))
+            db.commit()
+        except Exception as e:
+            logger.error(f"Write batch of {len(batch)} jobs failed: {e}")
+            if db is not None and db.in_transaction:
+                db.rollback()
+            self._stats['failed_batches'] += 1
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            if db is not None:
+                db.close()
+
+        self._stats['batches'] += 1
+        self._stats['jobs'] += len(outcomes)
+        self._stats['max_batch_size'] = max(self._stats['max_batch_size'], len(batch))
+        self._stats['commit_time_seconds'] += time.monotonic() - started
+        for future, result, error in outcomes:
+            if error is not None:
+                self._stats['failed_jobs'] += 1
+                logger.error(f"Write job failed: {error}")
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def stop(self, timeout=5.0):
+        """Flush queued writes and stop the writer thread."""
+        if self._pid != os.getpid() or self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._pid = None
+
+    def stats(self):
+        stats = dict(self._stats)
+        batches = stats['batches']
+        stats['avg_batch_size'] = round(stats['jobs'] / batches, 2) if batches else 0
+        stats['commit_time_seconds'] = round(stats['commit_time_seconds'], 4)
+        stats['queue_depth'] = self._queue.qsize() if self._pid == os.getpid() else 0
+        stats['batch_window_ms'] = self.batch_window * 1000
+        return stats
+
+
+def _execute_write(db, sql, params):
+    return db.execute(sql, params).lastrowid
+
+
+db_writer = WriteCoordinator(DB_WRITER_BATCH_WINDOW_MS, DB_WRITER_MAX_BATCH, DB_WRITER_QUEUE_SIZE)
+atexit.register(db_writer.stop)
+
+def log_write_failure(future):
+    """Done-callback for fire-and-forget writes."""
+    if future.exception() is not None:
+        logger.error(f"Queued database write failed: {future.exception()}")
+
+CLASS_REFRESH_CHUNK = 50  # students per writer job in class-wide refreshes
+
+def refresh_students(db, refresh, class_id, student_ids):
+    """
+    Writer job: run refresh(db, student_id, class_id) for the first chunk of
+    student_ids and queue the rest as a new job, so class-wide refreshes
+    hold one queue slot and other writes get in between chunks. Each student
+    gets a savepoint, so one failure does not undo the chunk.
     
-    Returns: List of gaps with topic names and mastery levels
+    Returns: number of students refreshed by this job
+    """
+    done = 0
+    while student_ids:
+        chunk, student_ids = student_ids[:CLASS_REFRESH_CHUNK], student_ids[CLASS_REFRESH_CHUNK:]
+        for student_id in chunk:
+            db.execute('SAVEPOINT refresh_student')
+            try:
+                refresh(db, student_id, class_id)
+            except Exception as e:
+                db.execute('ROLLBACK TO refresh_student')
+                logger.error(f"{refresh.__name__} failed for student {student_id}: {e}")
+            db.execute('RELEASE refresh_student')
+        done += len(chunk)
+        if student_ids:
+            try:
+                db_writer.submit(refresh_students, refresh, class_id, student_ids) \
+                    .add_done_callback(log_write_failure)
+                break
+            except sqlite3.OperationalError:
+                pass  # queue full: keep going in this job
+    return done
+
+# ============================================================================
+# ONLINE BACKUPS
+# ============================================================================
+
+@contextmanager
+def process_lock(path):
+    """
+    Non-blocking lock across worker processes (flock on `path`).
+    Yields False if another process holds it. Without fcntl (Windows) it
+    always yields True; the dev server runs a single process anyway.
     """
+    lock_file = open(path, 'w')
     try:
-        # Get all quiz submissions for this student in this class
-        submissions = db.execute('''
-            SELECT qs.*, qq.id as question_id, qq.correct_option_index
-            FROM quiz_submissions qs
-            JOIN quizzes q ON qs.quiz_id = q.id
-            JOIN quiz_questions qq ON qq.quiz_id = q.id
-            WHERE qs.student_id = ? AND q.class_id = ?
-            ORDER BY qs.submitted_at DESC
-        ''', (student_id, class_id)).fetchall()
-        
-        if not submissions:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                yield False
+                return
+        yield True
+    finally:
+        lock_file.close()
+
+class BackupService:
+    """
+    Scheduled online backups through sqlite3.Connection.backup.
+
+    Pages are copied in small steps with a sleep between them, from a
+    read-only connection holding one read transaction. In WAL mode that
+    snapshot never blocks writers (quiz submissions keep committing) and
+    the backup never restarts because of them. Snapshots are gzip
+    compressed and rotated; only one worker process backs up at a time.
+    """
+
+    PREFIX = 'education-'
+
+    def __init__(self, backup_dir, interval, keep, pages_per_step, step_sleep):
+        self.backup_dir = backup_dir
+        self.interval = interval
+        self.keep = keep
+        self.pages_per_step = pages_per_step
+        self.step_sleep = step_sleep
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'runs': 0,
+            'failures': 0,
+            'skipped_locked': 0,
+            'last_backup': None,
+            'last_file': None,
+            'last_error': None,
+            'last_duration_seconds': None,
+            'last_pages': None,
+            'last_bytes': None,
+            'last_compressed_bytes': None,
+            'last_throughput_mb_s': None
+        }
+
+    def ensure_started(self):
+        """Start the scheduler thread once per worker process."""
+        if self._pid == os.getpid() or self.interval <= 0:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            thread = threading.Thread(target=self._run, name='db-backup', daemon=True)
+            thread.start()
+
+    def _run(self):
+        time.sleep(60)  # Let the worker finish starting up
+        while True:
+            latest = self.latest_snapshot_age()
+            if latest is None or latest >= self.interval:
+                self.backup()
+            time.sleep(min(self.interval, 600))
+
+    def snapshots(self):
+        if not os.path.isdir(self.backup_dir):
             return []
+        return sorted(
+            os.path.join(self.backup_dir, name)
+            for name in os.listdir(self.backup_dir)
+            if name.startswith(self.PREFIX) and name.endswith('.db.gz')
+        )
+
+    def latest_snapshot_age(self):
+        snapshots = self.snapshots()
+        if not snapshots:
+            return None
+        return time.time() - os.path.getmtime(snapshots[-1])
+
+    def _throttle(self, status, remaining, total):
+        # Called by sqlite3 after every step; give writers room between steps
+        if remaining and self.step_sleep > 0:
+            time.sleep(self.step_sleep)
+
+    def backup(self):
+        """Take one compressed snapshot. Returns its path, or None if skipped/failed."""
+        os.makedirs(self.backup_dir, exist_ok=True)
+        with process_lock(os.path.join(self.backup_dir, '.lock')) as acquired:
+            if not acquired:
+                self._stats['skipped_locked'] += 1
+                logger.info("Backup already running in another worker, skipping")
+                return None
+            return self._backup()
+
+    def _backup(self):
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        partial_path = os.path.join(self.backup_dir, f'{self.PREFIX}{stamp}.db.partial')
+        final_path = os.path.join(self.backup_dir, f'{self.PREFIX}{stamp}.db.gz')
+        started = time.monotonic()
+        source = None
+        target = None
+        try:
+            source = checkout_db(read_only=True)
+            # One read transaction = one consistent snapshot for every step
+            source.execute('BEGIN')
+            source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+            page_size = source.execute('PRAGMA page_size').fetchone()[0]
+            page_count = source.execute('PRAGMA page_count').fetchone()[0]
+
+            target = sqlite3.connect(partial_path)
+            source.backup(target, pages=self.pages_per_step, progress=self._throttle)
+            target.close()
+            target = None
+            source.rollback()
+            source.close()
+            source = None
+
+            with open(partial_path, 'rb') as raw, gzip.open(final_path, 'wb', compresslevel=6) as packed:
+                shutil.copyfileobj(raw, packed, 1024 * 1024)
+            raw_bytes = os.path.getsize(partial_path)
+            os.remove(partial_path)
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"Database backup failed: {e}")
+            self._stats['failures'] += 1
+            self._stats['last_error'] = str(e)
+            for path in (partial_path, final_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            return None
+        finally:
+            if target is not None:
+                target.close()
+            if source is not None:
+                source.close()
+
+        duration = time.monotonic() - started
+        self._stats.update({
+            'runs': self._stats['runs'] + 1,
+            'last_backup': datetime.now().isoformat(),
+            'last_file': final_path,
+            'last_error': None,
+            'last_duration_seconds': round(duration, 3),
+            'last_pages': page_count,
+            'last_bytes': raw_bytes,
+            'last_compressed_bytes': os.path.getsize(final_path),
+            'last_throughput_mb_s': round(page_count * page_size / duration / 1e6, 2) if duration else None
+        })
+        logger.info(f"Database backup written: {final_path} ({page_count} pages in {duration:.2f}s)")
+        self._rotate()
+        return final_path
+
+    def _rotate(self):
+        for path in self.snapshots()[:-self.keep] if self.keep > 0 else []:
+            try:
+                os.remove(path)
+                logger.info(f"Removed old backup: {path}")
+            except OSError as e:
+                logger.warning(f"Could not remove old backup {path}: {e}")
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats.update({
+            'backup_dir': self.backup_dir,
+            'interval_seconds': self.interval,
+            'keep': self.keep,
+            'snapshots': len(self.snapshots())
+        })
+        return stats
+
+
+backup_service = BackupService(
+    DB_BACKUP_DIR, DB_BACKUP_INTERVAL, DB_BACKUP_KEEP,
+    DB_BACKUP_PAGES_PER_STEP, DB_BACKUP_STEP_SLEEP
+)
+
+def start_background_services():
+    """Start this worker's database threads (each is a no-op once running)."""
+    maintenance_scheduler.ensure_started()
+    backup_service.ensure_started()
+    review_notifier.ensure_started()
+
+@app.cli.command('backup-db')
+def backup_db_command():
+    """Take an online backup of the database now."""
+    path = backup_service.backup()
+    print(f"Backup written to {path}" if path else "Backup skipped or failed (see log)")
+
+# ============================================================================
+# DATABASE MAINTENANCE SCHEDULER
+# ============================================================================
+
+class TrafficMeter:
+    """Requests per minute seen by this worker (cheap: two counters)."""
+
+    def __init__(self):
+        self._minute = 0
+        self._current = 0
+        self._previous = 0
+
+    def hit(self):
+        minute = int(time.time() // 60)
+        if minute != self._minute:
+            self._previous = self._current if minute == self._minute + 1 else 0
+            self._current = 0
+            self._minute = minute
+        self._current += 1
+
+    def requests_last_minute(self):
+        minute = int(time.time() // 60)
+        if minute == self._minute:
+            return self._previous
+        if minute == self._minute + 1:
+            return self._current
+        return 0
+
+
+traffic_meter = TrafficMeter()
+
+@app.before_request
+def count_request():
+    traffic_meter.hit()
+
+
+class MaintenanceScheduler:
+    """
+    Runs database housekeeping tasks on their intervals from one background
+    thread per worker. Tasks marked quiet_only wait for low traffic or the
+    maintenance window. A file lock next to the database keeps two workers
+    from running the same maintenance at once. Timings go to /api/db/status.
+    """
+
+    def __init__(self, tick, idle_rpm, window):
+        self.tick = tick
+        self.idle_rpm = idle_rpm
+        self.window = self._parse_window(window)
+        self._tasks = {}
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _parse_window(window):
+        try:
+            start, end = (int(part) for part in window.split('-'))
+            return start, end
+        except (ValueError, AttributeError):
+            return None
+
+    def add(self, name, fn, interval, quiet_only=True):
+        self._tasks[name] = {
+            'fn': fn,
+            'interval': interval,
+            'quiet_only': quiet_only,
+            'last_run': None,           # monotonic time, for scheduling
+            'runs': 0,
+            'failures': 0,
+            'skipped': 0,               # lock held elsewhere; retried next tick
+            'last_skipped_at': None,
+            'last_run_at': None,
+            'last_duration_ms': None,
+            'last_result': None,
+            'last_error': None
+        }
+
+    def ensure_started(self):
+        """Start the scheduler thread once per worker process."""
+        if self._pid == os.getpid() or self.tick <= 0:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            started = time.monotonic()
+            for task in self._tasks.values():
+                # First run one interval after startup, not during it
+                task['last_run'] = started
+            thread = threading.Thread(target=self._run, name='db-maintenance', daemon=True)
+            thread.start()
+
+    def in_window(self):
+        if self.window is None:
+            return False
+        start, end = self.window
+        hour = datetime.now().hour
+        return start <= hour < end if start <= end else hour >= start or hour < end
+
+    def is_quiet(self):
+        return self.in_window() or traffic_meter.requests_last_minute() < self.idle_rpm
+
+    def _run(self):
+        while True:
+            time.sleep(self.tick)
+            now = time.monotonic()
+            for name, task in list(self._tasks.items()):
+                if task['interval'] <= 0:
+                    continue
+                elapsed = now - task['last_run']
+                if elapsed < task['interval']:
+                    continue
+                if task['quiet_only'] and not self.is_quiet() and elapsed < 2 * task['interval']:
+                    continue
+                try:
+                    self.run_task(name)
+                except Exception as e:
+                    # Never let one task end the thread the others run on
+                    logger.error(f"Database maintenance task {name} could not run: {e}")
+
+    def run_task(self, name):
+        """Run one task now (also used by the db-maintenance CLI)."""
+        task = self._tasks[name]
+        with process_lock(f'{DATABASE_PATH}.maintenance.lock') as acquired:
+            if not acquired:
+                # Another worker or the CLI is running maintenance; leave
+                # last_run alone so the next tick tries again
+                task['skipped'] += 1
+                task['last_skipped_at'] = datetime.now().isoformat()
+                logger.debug(f"Database maintenance {name} skipped: maintenance lock is held")
+                return None
+            task['last_run'] = time.monotonic()
+            started = time.monotonic()
+            try:
+                result = task['fn']()
+            except Exception as e:  # writer timeouts and NumPy errors as well as sqlite3.Error
+                logger.error(f"Database maintenance task {name} failed: {e!r}")
+                task['failures'] += 1
+                task['last_error'] = str(e)
+                return None
+            duration_ms = round((time.monotonic() - started) * 1000, 2)
+            task.update({
+                'runs': task['runs'] + 1,
+                'last_run_at': datetime.now().isoformat(),
+                'last_duration_ms': duration_ms,
+                'last_result': result,
+                'last_error': None
+            })
+            logger.info(f"Database maintenance {name} finished in {duration_ms} ms: {result}")
+            return result
+
+    def task_names(self):
+        return list(self._tasks)
+
+    def stats(self):
+        now = time.monotonic()
+        tasks = {}
+        for name, task in self._tasks.items():
+            info = {k: v for k, v in task.items() if k not in ('fn', 'last_run')}
+            if task['last_run'] is not None and task['interval'] > 0:
+                info['next_due_in_seconds'] = round(max(0, task['interval'] - (now - task['last_run'])))
+            tasks[name] = info
+        return {
+            'requests_last_minute': traffic_meter.requests_last_minute(),
+            'idle_rpm_threshold': self.idle_rpm,
+            'window': DB_MAINTENANCE_WINDOW,
+            'quiet_now': self.is_quiet(),
+            'tasks': tasks
+        }
+
+
+def maintenance_wal_checkpoint():
+    return wal_checkpointer.checkpoint()
+
+def maintenance_optimize():
+    with get_db_context() as db:
+        db.execute('PRAGMA optimize').fetchall()
+    return 'ok'
+
+def maintenance_analyze():
+    with get_db_context() as db:
+        db.execute('ANALYZE')
+    return 'ok'
+
+def maintenance_incremental_vacuum():
+    """Hand free pages back to the filesystem, a bounded number per run."""
+    with get_db_context() as db:
+        if db.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            return 'skipped: auto_vacuum is not INCREMENTAL'
+        free_before = db.execute('PRAGMA freelist_count').fetchone()[0]
+        if free_before:
+            # execute() steps the pragma once (one page); executescript runs it to completion
+            db.executescript(f'PRAGMA incremental_vacuum({DB_VACUUM_PAGES});')
+        free_after = db.execute('PRAGMA freelist_count').fetchone()[0]
+    return {'freed_pages': free_before - free_after, 'free_pages_left': free_after}
+
+def maintenance_purge_expired_otps():
+    with get_db_context() as db:
+        deleted = db.execute(
+            'DELETE FROM password_reset_otp WHERE expires_at < ? OR used = 1',
+            (datetime.now(),)
+        ).rowcount
+    return {'deleted': deleted}
+
+def maintenance_full_vacuum():
+    """Switch to incremental auto_vacuum and rebuild the file (CLI only: blocks writers)."""
+    db = checkout_db()
+    try:
+        db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        db.execute('VACUUM')
+        size = os.path.getsize(DATABASE_PATH)
+    finally:
+        db.close()
+    return {'database_size_bytes': size}
+
+
+maintenance_scheduler = MaintenanceScheduler(
+    DB_MAINTENANCE_TICK, DB_MAINTENANCE_IDLE_RPM, DB_MAINTENANCE_WINDOW
+)
+# The PASSIVE checkpoint is cheap and keeps reads fast, so it ignores traffic
+maintenance_scheduler.add('wal_checkpoint', maintenance_wal_checkpoint,
+                          DB_WAL_CHECKPOINT_INTERVAL, quiet_only=False)
+maintenance_scheduler.add('optimize', maintenance_optimize, DB_OPTIMIZE_INTERVAL)
+maintenance_scheduler.add('analyze', maintenance_analyze, DB_ANALYZE_INTERVAL)
+maintenance_scheduler.add('incremental_vacuum', maintenance_incremental_vacuum, DB_VACUUM_INTERVAL)
+maintenance_scheduler.add('purge_expired_otps', maintenance_purge_expired_otps,
+                          DB_OTP_PURGE_INTERVAL, quiet_only=False)
+maintenance_scheduler.add('recount_tables', db_stats.recount, DB_ANALYZE_INTERVAL)
+maintenance_scheduler.add('vacuum', maintenance_full_vacuum, 0)  # manual only
+
+@app.cli.command('db-maintenance')
+@click.argument('tasks', nargs=-1)
+def db_maintenance_command(tasks):
+    """Run maintenance tasks now (default: all scheduled tasks)."""
+    names = tasks or [n for n in maintenance_scheduler.task_names() if n != 'vacuum']
+    for name in names:
+        if name not in maintenance_scheduler.task_names():
+            print(f"Unknown task '{name}'. Available: {', '.join(maintenance_scheduler.task_names())}")
+            continue
+        result = maintenance_scheduler.run_task(name)
+        print(f"{name}: {result}")
+
+# ============================================================================
+# HELPER FUNCTIONS FOR NEW FEATURES
+# ============================================================================
+
+def generate_otp(length=4):
+    """Generate a random OTP (numeric only)"""
+    return ''.join(random.choices(string.digits, k=length))
+
+def send_otp_email(email, otp):
+    """
+    Send OTP email using Gmail SMTP
+    
+    Returns:
+        bool: True if email sent successfully, False otherwise
+    """
+    if not GMAIL_USERNAME or not GMAIL_APP_PASSWORD:
+        logger.error("Gmail credentials not configured")
+        return False
+    
+    try:
+        # Create message
+        msg = MIMEMultipart('alternative')
+        msg['Subject'] = 'Password Reset OTP - Education Platform'
+        msg['From'] = GMAIL_USERNAME
+        msg['To'] = email
         
-        # Group by topics (if topics exist)
-        topic_performance = {}
-        
-        for submission in submissions:
-            # Get topics for this question
-            topics = db.execute('''
-                SELECT t.id, t.topic_name
-                FROM topics t
-                JOIN question_topics qt ON t.id = qt.topic_id
-                WHERE qt.question_id = ?
-            ''', (submission['question_id'],)).fetchall()
-            
-            for topic in topics:
-                topic_id = topic['id']
-                topic_name = topic['topic_name']
-                
-                if topic_id not in topic_performance:
-                    topic_performance[topic_id] = {
-                        'name': topic_name,
-                        'correct': 0,
-                        'total': 0
-                    }
-                
-                topic_performance[topic_id]['total'] += 1
-                # Check if student got it right (would need answer data)
-                # For now, use overall submission score as proxy
-        
-        # Calculate mastery levels and identify gaps
-        gaps = []
-        for topic_id, perf in topic_performance.items():
-            if perf['total'] > 0:
-                mastery = perf['correct'] / perf['total']
-                
-                # Update knowledge_gaps table
-                db.execute('''
-                    INSERT OR REPLACE INTO knowledge_gaps
-                    (user_id, topic_id, mastery_level, questions_attempted, questions_correct, last_assessed)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (student_id, topic_id, mastery, perf['total'], perf['correct'], datetime.now()))
-                
-                # If mastery < 60%, it's a gap
-                if mastery < 0.6:
-                    gaps.append({
-                        'topic_id': topic_id,
-                        'topic_name': perf['name'],
-                        'mastery_level': round(mastery * 100, 1),
-                        'severity': 'critical' if mastery < 0.4 else 'moderate'
-                    })
+        # HTML email content
+        html_content = f"""
+        <html>
+        <body style="font-family: Arial, sans-serif; padding: 20px;">
+            <div style="max-width: 600px; margin: 0 auto; background: #f9f9f9; padding: 30px; border-radius: 10px;">
+                <h2 style="color: #667eea;">Password Reset Request</h2>
+                <p>Hello,</p>
+                <p>You requested to reset your password. Use the OTP below to continue:</p>
+                <div style="background: white; padding: 20px; border-radius: 5px; text-align: center; margin: 20px 0;">
+                    <h1 style="color: #667eea; font-size: 48px; letter-spacing: 10px; margin: 0;">{otp}</h1>
+                </div>
+                <p>This OTP will expire in 10 minutes.</p>
+                <p>If you didn't request this, please ignore this email.</p>
+                <hr style="border: none; border-top: 1px solid #ddd; margin: 20px 0;">
+                <p style="color: #666; font-size: 12px;">Education Platform - AI-Driven Adaptive Learning</p>
+            </div>
+        </body>
+        </html>
+        """
+        
+        part = MIMEText(html_content, 'html')
+        msg.attach(part)
+        
+        # Send email
+        server = smtplib.SMTP('smtp.gmail.com', 587)
+        server.starttls()
+        server.login(GMAIL_USERNAME, GMAIL_APP_PASSWORD)
+        server.sendmail(GMAIL_USERNAME, email, msg.as_string())
+        server.quit()
         
+        logger.info(f"OTP email sent successfully to {email}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"Failed to send OTP email: {e}")
+        return False
+
+def render_markdown_with_math(text):
+    """
+    Render markdown and preserve math equations for MathJax
+    
+    Args:
+        text: Raw text with markdown and LaTeX
+        
+    Returns:
+        HTML with markdown rendered and math preserved
+    """
+    # Convert markdown to HTML
+    html = markdown.markdown(text, extensions=['extra', 'codehilite'])
+    
+    # Return HTML (MathJax will handle math rendering on frontend)
+    return html
+
+def clean_expired_otps():
+    """Clean up expired OTPs from database (uses the request's connection)"""
+    try:
+        db = get_db()
+        db.execute("DELETE FROM password_reset_otp WHERE expires_at < ? OR used = 1", 
+                  (datetime.now(),))
         db.commit()
-        return gaps
+    except Exception as e:
+        logger.error(f"Failed to clean expired OTPs: {e}")
+
+# ============================================================================
+# ADAPTIVE LEARNING ENGINE - AI-DRIVEN PERSONALIZATION
+# ============================================================================
+
+def analyze_knowledge_gaps(db, student_id, class_id, submission_id):
+    """
+    AI-powered knowledge gap detection from quiz performance.
+    Adds this submission's per-topic attempted/correct counts to the
+    student's running counters in knowledge_gaps, so the cost depends on the
+    quiz size rather than the student's history. reconcile_knowledge_gaps()
+    checks the counters against quiz_answers periodically.
+    
+    Returns: (gaps, deltas) - the gaps with topic names and mastery levels,
+    and {topic_id: (attempted, correct)} for this submission, which
+    class_mastery_cache applies once the caller has committed
+    """
+    try:
+        deltas = {row[0]: (row[1], row[2]) for row in db.execute('''
+            SELECT qt.topic_id, COUNT(*), SUM(qa.is_correct)
+            FROM quiz_answers qa
+            JOIN question_topics qt ON qt.question_id = qa.question_id
+            WHERE qa.submission_id = ?
+            GROUP BY qt.topic_id
+        ''', (submission_id,)).fetchall()}
+        now = datetime.now()
+        db.executemany('''
+            INSERT INTO knowledge_gaps
+            (user_id, topic_id, mastery_level, questions_attempted, questions_correct, last_assessed)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(user_id, topic_id) DO UPDATE SET
+                questions_attempted = questions_attempted + excluded.questions_attempted,
+                questions_correct = questions_correct + excluded.questions_correct,
+                mastery_level = CAST(questions_correct + excluded.questions_correct AS REAL)
+                                / (questions_attempted + excluded.questions_attempted),
+                last_assessed = excluded.last_assessed
+        ''', [(student_id, topic_id, correct / attempted, attempted, correct, now)
+              for topic_id, (attempted, correct) in deltas.items()])
+        
+        # If mastery < 60%, it's a gap
+        weak_topics = db.execute('''
+            SELECT kg.topic_id, t.topic_name, kg.mastery_level
+            FROM knowledge_gaps kg
+            JOIN topics t ON t.id = kg.topic_id
+            WHERE kg.user_id = ? AND kg.mastery_level < 0.6 AND t.class_id = ?
+            ORDER BY kg.mastery_level ASC
+        ''', (student_id, class_id)).fetchall()
+        
+        return [{
+            'topic_id': gap['topic_id'],
+            'topic_name': gap['topic_name'],
+            'mastery_level': round(gap['mastery_level'] * 100, 1),
+            'severity': 'critical' if gap['mastery_level'] < 0.4 else 'moderate'
+        } for gap in weak_topics], deltas
         
     except Exception as e:
         logger.error(f"Error analyzing knowledge gaps: {e}")
-        return []
+        return [], None
+
+def reconcile_knowledge_gaps():
+    """
+    Verify the knowledge_gaps counters against quiz_answers and rewrite any
+    that drifted (e.g. after question_topics changed); counters with no
+    answers left behind them are deleted. Run by the maintenance scheduler;
+    both statements share one write transaction, so they can't race a
+    submission's delta.
+    """
+    with get_db_context() as db:
+        fixed = db.execute('''
+            INSERT INTO knowledge_gaps
+            (user_id, topic_id, mastery_level, questions_attempted, questions_correct, last_assessed)
+            SELECT qa.student_id, qt.topic_id,
+                   CAST(SUM(qa.is_correct) AS REAL) / COUNT(*), COUNT(*), SUM(qa.is_correct), ?
+            FROM quiz_answers qa
+            JOIN question_topics qt ON qt.question_id = qa.question_id
+            GROUP BY qa.student_id, qt.topic_id
+            ON CONFLICT(user_id, topic_id) DO UPDATE SET
+                mastery_level = excluded.mastery_level,
+                questions_attempted = excluded.questions_attempted,
+                questions_correct = excluded.questions_correct
+            WHERE questions_attempted != excluded.questions_attempted
+               OR questions_correct != excluded.questions_correct
+        ''', (datetime.now(),)).rowcount
+        # CROSS JOIN keeps the topic's few questions as the outer loop
+        removed = db.execute('''
+            DELETE FROM knowledge_gaps WHERE id IN (
+                SELECT kg.id FROM knowledge_gaps kg
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM question_topics qt
+                    CROSS JOIN quiz_answers qa
+                        ON qa.question_id = qt.question_id AND qa.student_id = kg.user_id
+                    WHERE qt.topic_id = kg.topic_id
+                )
+            )
+        ''').rowcount
+    if fixed or removed:
+        logger.warning(f"Knowledge gap reconciliation corrected {fixed} counters "
+                       f"and removed {removed} without answers")
+        class_mastery_cache.invalidate()
+    return {'corrected': fixed, 'removed': removed}
+
+
+maintenance_scheduler.add('reconcile_knowledge_gaps', reconcile_knowledge_gaps,
+                          DB_GAP_RECONCILE_INTERVAL)
+
+STRUGGLING_MASTERY = 0.5   # below this a topic counts as weak
+STRUGGLING_WEAK_TOPICS = 3  # same rule as the knowledge_gap intervention alert
+
+def fetch_int_array(cursor, columns):
+    """Read an all-integer result set into an (n, columns) NumPy array."""
+    cursor.row_factory = None  # plain tuples, flattened straight into the array
+    rows = cursor.fetchall()
+    return np.fromiter(itertools.chain.from_iterable(rows), dtype=np.int64,
+                       count=columns * len(rows)).reshape(-1, columns)
+
+def _column_quantiles(matrix, counts, quantiles):
+    """
+    Per-column quantiles ignoring NaN, interpolated like np.nanpercentile
+    but from one sort (NaN sorts last), which is several times faster.
+    """
+    ordered = np.sort(matrix, axis=0)
+    columns = np.arange(matrix.shape[1])
+    results = []
+    for q in quantiles:
+        position = np.maximum(counts - 1, 0) * q
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        low_values = ordered[lower, columns] if len(ordered) else np.full(len(columns), np.nan)
+        high_values = ordered[upper, columns] if len(ordered) else np.full(len(columns), np.nan)
+        values = low_values + (high_values - low_values) * (position - lower)
+        results.append(np.where(counts > 0, values, np.nan))
+    return results
+
+def load_class_counters(db, class_id):
+    """
+    One bulk read of a class's knowledge_gaps counters (the per-topic totals
+    of quiz_answers) into students x topics attempted/correct matrices.
+    The reads share one snapshot, so 'watermark' (the newest submission id)
+    marks exactly which submissions the counters include.
+    
+    Returns: dict with students, topics, their id arrays, the two matrices
+    and the watermark
+    """
+    own_transaction = not db.in_transaction
+    if own_transaction:
+        db.execute('BEGIN')
+    try:
+        return _read_class_counters(db, class_id)
+    finally:
+        if own_transaction:
+            db.execute('COMMIT')
+
+def _read_class_counters(db, class_id):
+    watermark = db.execute('SELECT MAX(id) FROM quiz_submissions').fetchone()[0] or 0
+    students = db.execute('''
+        SELECT e.student_id, u.name
+        FROM enrollments e
+        JOIN users u ON u.id = e.student_id
+        WHERE e.class_id = ?
+        ORDER BY e.student_id
+    ''', (class_id,)).fetchall()
+    topics = db.execute(
+        'SELECT id, topic_name FROM topics WHERE class_id = ? ORDER BY id',
+        (class_id,)
+    ).fetchall()
+    
+    cursor = db.execute('''
+        SELECT kg.user_id, kg.topic_id, kg.questions_attempted, kg.questions_correct
+        FROM topics t
+        JOIN knowledge_gaps kg ON kg.topic_id = t.id
+        WHERE t.class_id = ?
+    ''', (class_id,))
+    counters = fetch_int_array(cursor, 4)
+    
+    student_ids = np.array([s['student_id'] for s in students], dtype=np.int64)
+    topic_ids = np.array([t['id'] for t in topics], dtype=np.int64)
+    attempted = np.zeros((len(student_ids), len(topic_ids)), dtype=np.int64)
+    correct = np.zeros_like(attempted)
+    
+    if len(student_ids) and len(topic_ids) and len(counters):
+        # Map ids to matrix positions; drop students no longer enrolled
+        rows = np.searchsorted(student_ids, counters[:, 0])
+        cols = np.searchsorted(topic_ids, counters[:, 1])
+        enrolled = rows < len(student_ids)
+        enrolled[enrolled] = student_ids[rows[enrolled]] == counters[enrolled, 0]
+        attempted[rows[enrolled], cols[enrolled]] = counters[enrolled, 2]
+        correct[rows[enrolled], cols[enrolled]] = counters[enrolled, 3]
+    
+    return {
+        'students': students,
+        'topics': topics,
+        'student_ids': student_ids,
+        'topic_ids': topic_ids,
+        'attempted': attempted,
+        'correct': correct,
+        'watermark': watermark
+    }
+
+def summarize_class_mastery(class_id, counters, started=None):
+    """
+    Mastery matrix, per-topic summaries and struggling students from
+    load_class_counters() output; vectorized NumPy, no database access.
+    
+    Returns: dict with the summaries, plus the raw arrays under '_arrays'
+    """
+    started = started or time.perf_counter()
+    students, topics = counters['students'], counters['topics']
+    student_ids, topic_ids = counters['student_ids'], counters['topic_ids']
+    attempted, correct = counters['attempted'], counters['correct']
+    
+    assessed = attempted > 0
+    mastery = np.full(attempted.shape, np.nan)
+    np.divide(correct, attempted, out=mastery, where=assessed)
+    
+    # Per-topic summaries over the students who attempted the topic
+    topic_assessed = assessed.sum(axis=0)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # topics nobody attempted
+        topic_mean = np.nanmean(mastery, axis=0)
+    topic_p25, topic_median, topic_p75 = _column_quantiles(mastery, topic_assessed, (0.25, 0.5, 0.75))
+    
+    # Struggling: low overall mastery, or several weak topics
+    total_attempted = attempted.sum(axis=1)
+    overall = np.divide(correct.sum(axis=1), total_attempted,
+                        out=np.full(len(student_ids), np.nan), where=total_attempted > 0)
+    weak_topics = (assessed & (mastery < STRUGGLING_MASTERY)).sum(axis=1)
+    struggling = (total_attempted > 0) & (
+        (overall < STRUGGLING_MASTERY) | (weak_topics >= STRUGGLING_WEAK_TOPICS)
+    )
+    struggling_idx = np.flatnonzero(struggling)
+    struggling_idx = struggling_idx[np.argsort(overall[struggling_idx], kind='stable')]
+    
+    def _pct(value):
+        return None if np.isnan(value) else round(float(value) * 100, 1)
+    
+    return {
+        'class_id': class_id,
+        'computed_at': datetime.now().isoformat(),
+        'student_count': len(student_ids),
+        'topic_count': len(topic_ids),
+        'topics': [{
+            'topic_id': topic['id'],
+            'topic_name': topic['topic_name'],
+            'students_assessed': int(topic_assessed[i]),
+            'mean_mastery': _pct(topic_mean[i]),
+            'p25_mastery': _pct(topic_p25[i]),
+            'median_mastery': _pct(topic_median[i]),
+            'p75_mastery': _pct(topic_p75[i])
+        } for i, topic in enumerate(topics)],
+        'struggling_students': [{
+            'student_id': students[i]['student_id'],
+            'name': students[i]['name'],
+            'overall_mastery': _pct(overall[i]),
+            'weak_topics': int(weak_topics[i])
+        } for i in struggling_idx],
+        'compute_ms': round((time.perf_counter() - started) * 1000, 2),
+        '_arrays': (student_ids, topic_ids, mastery)
+    }
+
+
+
+class ClassMasteryCache:
+    """
+    Per-worker cache of a class's counter matrices and their summary.
+    submit_quiz applies its per-topic deltas to the cached matrices, so the
+    next read only re-summarizes in memory; topic changes invalidate a
+    class. Entries also expire after ttl seconds so submissions handled by
+    other workers show up.
+    
+    Every change bumps the class's generation, and a load is only stored if
+    the generation didn't move while it ran, so a slow load can't overwrite
+    a submission applied meanwhile. Deltas at or below an entry's watermark
+    are already in its counters and are skipped.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}  # class_id -> (monotonic time, counters, result or None if stale)
+        self._generations = {}  # class_id -> number of changes applied or dropped
+        self._epoch = 0  # bumped by invalidate() of every class
+
+    def _generation(self, class_id):
+        return self._epoch, self._generations.get(class_id, 0)
+
+    def _bump(self, class_id):
+        self._generations[class_id] = self._generations.get(class_id, 0) + 1
+
+    def get(self, db, class_id):
+        with self._lock:
+            entry = self._entries.get(class_id)
+            generation = self._generation(class_id)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            loaded_at, counters, result = entry
+            if result is None:
+                result = summarize_class_mastery(class_id, counters)
+                with self._lock:
+                    if self._entries.get(class_id, (None, None))[1] is counters:
+                        self._entries[class_id] = (loaded_at, counters, result)
+            return result, True
+        started = time.perf_counter()
+        counters = load_class_counters(db, class_id)
+        result = summarize_class_mastery(class_id, counters, started)
+        with self._lock:
+            if self._generation(class_id) == generation:
+                self._entries[class_id] = (time.monotonic(), counters, result)
+        return result, False
+
+    def apply_submission(self, class_id, student_id, submission_id, deltas):
+        """
+        Add one committed submission's {topic_id: (attempted, correct)} to a
+        cached class. The matrices are copied, not changed in place, so a
+        summary being computed from the old ones stays consistent. Unknown
+        deltas, students or topics drop the entry instead.
+        """
+        with self._lock:
+            self._bump(class_id)
+            entry = self._entries.get(class_id)
+            if deltas is None:
+                self._entries.pop(class_id, None)
+                return
+            if entry is None or not deltas:
+                return
+            loaded_at, counters, _ = entry
+            if submission_id <= counters['watermark']:
+                return  # loaded after this submission committed
+            student_ids, topic_ids = counters['student_ids'], counters['topic_ids']
+            delta_topics = np.fromiter(deltas, dtype=np.int64, count=len(deltas))
+            if not (np.isin(student_id, student_ids) and np.isin(delta_topics, topic_ids).all()):
+                self._entries.pop(class_id, None)  # enrolled or topics added since the load
+                return
+            row = np.searchsorted(student_ids, student_id)
+            cols = np.searchsorted(topic_ids, delta_topics)
+            counters = dict(counters, attempted=counters['attempted'].copy(),
+                            correct=counters['correct'].copy())
+            counters['attempted'][row, cols] += [attempted for attempted, _ in deltas.values()]
+            counters['correct'][row, cols] += [correct for _, correct in deltas.values()]
+            self._entries[class_id] = (loaded_at, counters, None)
+
+    def invalidate(self, class_id=None):
+        with self._lock:
+            if class_id is None:
+                self._epoch += 1
+                self._entries.clear()
+            else:
+                self._bump(class_id)
+                self._entries.pop(class_id, None)
+
+
+class_mastery_cache = ClassMasteryCache(CLASS_MASTERY_CACHE_TTL)
+
+# ----------------------------------------------------------------------------
+# Bayesian Knowledge Tracing (topic_mastery)
+# ----------------------------------------------------------------------------
+
+# Used for topics that haven't been fitted yet (too few answers)
+BKT_DEFAULT_PARAMS = {'prior': 0.3, 'learn': 0.1, 'slip': 0.1, 'guess': 0.2}
+
+# Candidate (prior, learn, slip, guess) sets the batch fit chooses between
+BKT_GRID = np.array(list(itertools.product(
+    (0.1, 0.3, 0.5, 0.7),       # prior
+    (0.05, 0.1, 0.2, 0.35),     # learn
+    (0.05, 0.1, 0.2),           # slip
+    (0.1, 0.2, 0.3)             # guess
+)))
+
+def bkt_step(p_known, correct, learn, slip, guess):
+    """One BKT update: condition on the answer, then allow for learning."""
+    if correct:
+        posterior = p_known * (1 - slip) / (p_known * (1 - slip) + (1 - p_known) * guess)
+    else:
+        posterior = p_known * slip / (p_known * slip + (1 - p_known) * (1 - guess))
+    return posterior + (1 - posterior) * learn
+
+def bkt_trace(correct, mask, prior, learn, slip, guess):
+    """
+    Run BKT over many answer sequences at once.
+    
+    correct, mask: (students, steps) arrays; mask is False past each
+    student's last answer. Parameters are scalars or (sets, 1) columns, in
+    which case every parameter set is traced side by side.
+    
+    Returns: (P(known) after each student's last answer, shape (sets, students),
+              log-likelihood of the answers under each parameter set)
+    """
+    prior, learn, slip, guess = (np.asarray(v, dtype=float).reshape(-1, 1)
+                                 for v in (prior, learn, slip, guess))
+    p_known = np.broadcast_to(prior, (len(prior), correct.shape[0])).copy()
+    log_likelihood = np.zeros(len(prior))
+    for step in range(correct.shape[1]):
+        answered = mask[:, step]
+        right = correct[:, step]
+        p_right = p_known * (1 - slip) + (1 - p_known) * guess
+        log_likelihood += np.where(answered, np.log(np.where(right, p_right, 1 - p_right)), 0).sum(axis=1)
+        posterior = np.where(right, p_known * (1 - slip) / p_right,
+                             p_known * slip / (1 - p_right))
+        p_known = np.where(answered, posterior + (1 - posterior) * learn, p_known)
+    return p_known, log_likelihood
+
+def confidence_level(mastery_score):
+    if mastery_score >= 80:
+        return 'expert'
+    if mastery_score >= 60:
+        return 'advanced'
+    if mastery_score >= 40:
+        return 'intermediate'
+    return 'beginner'
+
+# SM-2 spaced repetition: each quiz touching a topic counts as a review of it
+SM2_DEFAULT_EASE = 2.5
+SM2_MIN_EASE = 1.3
+
+def sm2_review(quality, repetitions, interval, ease):
+    """
+    One SM-2 review with quality 0-5 (3+ is a pass).
+    
+    Returns: (repetitions, interval in days, ease factor)
+    """
+    if quality >= 3:
+        interval = 1 if repetitions == 0 else 6 if repetitions == 1 else interval * ease
+        repetitions += 1
+    else:
+        repetitions, interval = 0, 1
+    ease = max(SM2_MIN_EASE, ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    return repetitions, interval, ease
+
+def update_topic_mastery(db, student_id, submission_id, duration, question_count):
+    """
+    Online path: apply this submission's answers to the student's BKT
+    mastery for each topic they touch, and schedule the topic's next SM-2
+    review from the share answered correctly. One read and one upsert batch.
+    Time spent is split across topics by question count.
+    
+    Returns: {topic_id: {'mastery': P(known), 'next_review_at': datetime}}
+    """
+    answers = db.execute('''
+        SELECT qt.topic_id, qa.is_correct,
+               bp.prior, bp.learn, bp.slip, bp.guess,
+               tm.mastery_score, tm.review_count, tm.review_interval, tm.ease_factor
+        FROM quiz_answers qa
+        JOIN question_topics qt ON qt.question_id = qa.question_id
+        LEFT JOIN bkt_parameters bp ON bp.topic_id = qt.topic_id
+        LEFT JOIN topic_mastery tm ON tm.user_id = qa.student_id AND tm.topic_id = qt.topic_id
+        WHERE qa.submission_id = ?
+        ORDER BY qt.topic_id, qa.question_id
+    ''', (submission_id,)).fetchall()
+    
+    if not answers:
+        return {}
+    
+    topics = {}  # topic_id -> [p_known, answers, correct, first row]
+    for answer in answers:
+        params = BKT_DEFAULT_PARAMS if answer['prior'] is None else answer
+        state = topics.get(answer['topic_id'])
+        if state is None:
+            start = params['prior'] if answer['mastery_score'] is None else answer['mastery_score'] / 100
+            state = topics[answer['topic_id']] = [start, 0, 0, answer]
+        state[0] = bkt_step(state[0], answer['is_correct'], params['learn'], params['slip'], params['guess'])
+        state[1] += 1
+        state[2] += answer['is_correct']
+    
+    now = datetime.now()
+    rows = []
+    updated = {}
+    for topic_id, (p_known, answered, correct, current) in topics.items():
+        score = round(p_known * 100, 4)
+        time_spent = int(round((duration or 0) * answered / question_count))
+        repetitions, interval, ease = sm2_review(
+            round(5 * correct / answered),
+            current['review_count'] or 0,
+            current['review_interval'] or 0,
+            current['ease_factor'] or SM2_DEFAULT_EASE
+        )
+        next_review_at = now + timedelta(days=interval)
+        rows.append((student_id, topic_id, score, confidence_level(score), time_spent, now,
+                     next_review_at, round(interval, 3), round(ease, 3), repetitions))
+        updated[topic_id] = {'mastery': p_known, 'next_review_at': next_review_at}
+    
+    db.executemany('''
+        INSERT INTO topic_mastery
+        (user_id, topic_id, mastery_score, confidence_level, time_spent, last_practiced,
+         next_review_at, review_interval, ease_factor, review_count)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(user_id, topic_id) DO UPDATE SET
+            mastery_score = excluded.mastery_score,
+            confidence_level = excluded.confidence_level,
+            time_spent = time_spent + excluded.time_spent,
+            last_practiced = excluded.last_practiced,
+            next_review_at = excluded.next_review_at,
+            review_interval = excluded.review_interval,
+            ease_factor = excluded.ease_factor,
+            review_count = excluded.review_count
+    ''', rows)
+    return updated
+
+class ReviewNotifier:
+    """
+    Pushes 'review_due' to students' Socket.IO rooms when an SM-2 review
+    comes due. Keeps an in-process min-heap of upcoming reviews for the
+    students connected to this worker: filled from the (user_id,
+    next_review_at) index when they connect and by submissions handled
+    here. Rescheduled reviews leave stale heap entries that are skipped
+    when popped. Push and pop are O(log n).
+    """
+
+    def __init__(self, horizon):
+        self.horizon = horizon  # seconds ahead loaded when a student connects
+        self._heap = []         # (due timestamp, user_id, topic_id)
+        self._scheduled = {}    # user_id -> {topic_id: due timestamp of the live entry}
+        self._online = {}       # user_id -> open connections
+        self._cond = threading.Condition()
+        self._pid = None
+        self.sent = 0
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='review-notifier', daemon=True).start()
+
+    def _push(self, user_id, topic_id, due_at):
+        due = due_at.timestamp()
+        if due > time.time() + self.horizon:
+            return
+        self._scheduled.setdefault(user_id, {})[topic_id] = due
+        heapq.heappush(self._heap, (due, user_id, topic_id))
+        self._cond.notify()
+
+    def schedule(self, user_id, topic_id, due_at):
+        """A review was (re)scheduled; only tracked while the student is connected."""
+        with self._cond:
+            if user_id in self._online:
+                self._push(user_id, topic_id, due_at)
+
+    def connect(self, user_id):
+        db = checkout_db(read_only=True)
+        try:
+            upcoming = db.execute('''
+                SELECT topic_id, next_review_at
+                FROM topic_mastery
+                WHERE user_id = ? AND next_review_at <= ?
+            ''', (user_id, datetime.now() + timedelta(seconds=self.horizon))).fetchall()
+        finally:
+            db.close()
+        with self._cond:
+            self._online[user_id] = self._online.get(user_id, 0) + 1
+            for row in upcoming:
+                self._push(user_id, row['topic_id'], _as_datetime(row['next_review_at']))
+
+    def disconnect(self, user_id):
+        with self._cond:
+            remaining = self._online.get(user_id, 0) - 1
+            if remaining > 0:
+                self._online[user_id] = remaining
+                return
+            self._online.pop(user_id, None)
+            self._scheduled.pop(user_id, None)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.time():
+                    self._cond.wait(None if not self._heap else self._heap[0][0] - time.time())
+                due, user_id, topic_id = heapq.heappop(self._heap)
+                pending = self._scheduled.get(user_id, {})
+                if pending.get(topic_id) != due:
+                    continue  # rescheduled, or the student left
+                del pending[topic_id]
+            try:
+                self._notify(user_id, topic_id, due)
+            except Exception as e:
+                logger.error(f"Review notification failed: {e}")
+
+    def _notify(self, user_id, topic_id, due):
+        db = checkout_db(read_only=True)
+        try:
+            topic = db.execute(
+                'SELECT topic_name, class_id FROM topics WHERE id = ?', (topic_id,)
+            ).fetchone()
+        finally:
+            db.close()
+        if topic is None:
+            return
+        socketio.emit('review_due', {
+            'topic_id': topic_id,
+            'topic_name': topic['topic_name'],
+            'class_id': topic['class_id'],
+            'due_at': datetime.fromtimestamp(due).isoformat()
+        }, to=f'user_{user_id}')
+        self.sent += 1
+
+
+def _as_datetime(value):
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+
+review_notifier = ReviewNotifier(REVIEW_NOTIFY_HORIZON)
+
+BKT_WRITE_CHUNK = 5000  # topic_mastery rows per writer job
+
+def _load_bkt_sequences(db, class_id, watermark):
+    """
+    Every answer in the class up to submission `watermark`, as per-topic
+    (students x steps) arrays in the order the student gave them.
+    
+    Returns: {topic_id: (student_ids, correct, mask)}
+    """
+    answers = fetch_int_array(db.execute('''
+        SELECT qt.topic_id, qa.student_id, qa.is_correct
+        FROM topics t
+        JOIN question_topics qt ON qt.topic_id = t.id
+        JOIN quiz_answers qa ON qa.question_id = qt.question_id
+        WHERE t.class_id = ? AND qa.submission_id <= ?
+        ORDER BY qt.topic_id, qa.student_id, qa.submission_id, qa.question_id
+    ''', (class_id, watermark)), 3)
+    
+    sequences = {}
+    if not len(answers):
+        return sequences
+    topic_starts = np.flatnonzero(np.diff(answers[:, 0], prepend=-1))
+    for start, end in zip(topic_starts, np.append(topic_starts[1:], len(answers))):
+        block = answers[start:end]
+        student_ids, first, lengths = np.unique(block[:, 1], return_index=True, return_counts=True)
+        rows = np.repeat(np.arange(len(student_ids)), lengths)
+        steps = np.arange(len(block)) - np.repeat(first, lengths)
+        correct = np.zeros((len(student_ids), lengths.max()), dtype=bool)
+        mask = np.zeros_like(correct)
+        correct[rows, steps] = block[:, 2].astype(bool)
+        mask[rows, steps] = True
+        sequences[int(block[0, 0])] = (student_ids, correct, mask)
+    return sequences
+
+def _write_bkt_parameters(db, fitted):
+    db.executemany('''
+        INSERT INTO bkt_parameters (topic_id, prior, learn, slip, guess, observations, fitted_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(topic_id) DO UPDATE SET
+            prior = excluded.prior, learn = excluded.learn, slip = excluded.slip,
+            guess = excluded.guess, observations = excluded.observations,
+            fitted_at = excluded.fitted_at
+    ''', fitted)
+
+def _write_bkt_mastery(db, watermark, rows):
+    """
+    Writer job: store replayed mastery, except for student/topic pairs that
+    got answers after the replay's snapshot; the online path has already
+    folded those in, and the next refit will include them.
+    """
+    newer = {tuple(row) for row in db.execute('''
+        SELECT qa.student_id, qt.topic_id
+        FROM quiz_answers qa
+        JOIN question_topics qt ON qt.question_id = qa.question_id
+        WHERE qa.submission_id > ?
+    ''', (watermark,)).fetchall()}
+    rows = [row for row in rows if (row[0], row[1]) not in newer]
+    db.executemany('''
+        INSERT INTO topic_mastery (user_id, topic_id, mastery_score, confidence_level)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(user_id, topic_id) DO UPDATE SET
+            mastery_score = excluded.mastery_score,
+            confidence_level = excluded.confidence_level
+    ''', rows)
+    return len(rows)
+
+def refit_bkt(class_id, fit=True):
+    """
+    Batch mode: refit each topic's BKT parameters on the class's full answer
+    history (a grid search traced for all students at once), then replay the
+    history to rewrite topic_mastery for every student in the class.
+    
+    All the computation runs on a read-only snapshot; the results go through
+    the writer queue in small chunks so submissions aren't held up.
+    """
+    started = time.perf_counter()
+    
+    db = checkout_db(read_only=True)
+    try:
+        watermark = db.execute(
+            'SELECT COALESCE(MAX(submission_id), 0) as last FROM quiz_answers'
+        ).fetchone()['last']
+        sequences = _load_bkt_sequences(db, class_id, watermark)
+        params = {row['topic_id']: dict(row) for row in db.execute('''
+            SELECT bp.topic_id, bp.prior, bp.learn, bp.slip, bp.guess
+            FROM topics t
+            JOIN bkt_parameters bp ON bp.topic_id = t.id
+            WHERE t.class_id = ?
+        ''', (class_id,)).fetchall()}
+    finally:
+        db.close()
+    
+    fitted = []
+    rows = []
+    for topic_id, (student_ids, correct, mask) in sequences.items():
+        observations = int(mask.sum())
+        if fit and observations >= BKT_MIN_FIT_OBSERVATIONS:
+            _, log_likelihood = bkt_trace(correct, mask, *BKT_GRID.T)
+            prior, learn, slip, guess = BKT_GRID[int(np.argmax(log_likelihood))].tolist()
+            params[topic_id] = {'prior': prior, 'learn': learn, 'slip': slip, 'guess': guess}
+            fitted.append((topic_id, prior, learn, slip, guess, observations, datetime.now()))
+        
+        p = params.get(topic_id, BKT_DEFAULT_PARAMS)
+        p_known, _ = bkt_trace(correct, mask, p['prior'], p['learn'], p['slip'], p['guess'])
+        for student_id, known in zip(student_ids.tolist(), p_known[0].tolist()):
+            score = round(known * 100, 4)
+            rows.append((student_id, topic_id, score, confidence_level(score)))
+    
+    if fitted:
+        db_writer.submit(_write_bkt_parameters, fitted).result(timeout=DB_WRITER_RESULT_TIMEOUT)
+    written = 0
+    for start in range(0, len(rows), BKT_WRITE_CHUNK):
+        written += db_writer.submit(
+            _write_bkt_mastery, watermark, rows[start:start + BKT_WRITE_CHUNK]
+        ).result(timeout=DB_WRITER_RESULT_TIMEOUT)
+    
+    if written:
+        db = checkout_db(read_only=True)
+        try:
+            schedule_learning_path_refresh(db, class_id)
+        finally:
+            db.close()
+    
+    return {
+        'class_id': class_id,
+        'answers': sum(int(mask.sum()) for _, _, mask in sequences.values()),
+        'topics_fitted': len(fitted),
+        'mastery_rows': written,
+        'duration_ms': round((time.perf_counter() - started) * 1000, 1)
+    }
+
+def bkt_class_ids():
+    """Classes that have topics, i.e. something to trace."""
+    db = checkout_db(read_only=True)
+    try:
+        return [row['class_id'] for row in db.execute(
+            'SELECT DISTINCT class_id FROM topics'
+        ).fetchall()]
+    finally:
+        db.close()
+
+def refit_bkt_all_classes():
+    return [refit_bkt(class_id) for class_id in bkt_class_ids()]
+
+
+maintenance_scheduler.add('bkt_refit', refit_bkt_all_classes, BKT_REFIT_INTERVAL)
+
+@app.cli.command('bkt-refit')
+@click.argument('class_ids', nargs=-1, type=int)
+@click.option('--no-fit', is_flag=True, help='Replay with the stored parameters only.')
+def bkt_refit_command(class_ids, no_fit):
+    """Refit BKT parameters and rebuild topic_mastery (default: all classes)."""
+    for class_id in class_ids or bkt_class_ids():
+        print(refit_bkt(class_id, fit=not no_fit))
+
+# ----------------------------------------------------------------------------
+# Item Response Theory (item calibration and adaptive quizzes)
+# ----------------------------------------------------------------------------
+
+# Uncalibrated items: average difficulty, unit discrimination
+IRT_DEFAULT_DISCRIMINATION = 1.0
+IRT_DEFAULT_DIFFICULTY = 0.0
+IRT_THETA_GRID = np.linspace(-4, 4, 81)
+IRT_FIT_ITERATIONS = 50
+
+def _logit(p):
+    p = np.clip(p, 0.02, 0.98)
+    return np.log(p / (1 - p))
+
+def irt_probability(theta, discrimination, difficulty):
+    """2PL: probability of a correct answer. Broadcasts over all arguments."""
+    return 1 / (1 + np.exp(-discrimination * (theta - difficulty)))
+
+def calibrate_items(correct, mask):
+    """
+    Joint maximum a posteriori fit of a 2PL model to one quiz's responses.
+    correct, mask: (attempts x items) arrays. Every Newton step updates all
+    abilities, then all difficulties, then all discriminations at once.
+    Weak priors (ability ~ N(0, 1), difficulty ~ N(0, 2^2), discrimination
+    ~ N(1, 0.5^2)) keep items everyone gets right or wrong finite.
+    
+    Returns: (discrimination, difficulty) arrays, one value per item
+    """
+    answered = mask.astype(float)
+    y = correct.astype(float) * answered
+    attempts = np.maximum(answered.sum(axis=1), 1)
+    p_values = y.sum(axis=0) / np.maximum(answered.sum(axis=0), 1)
+    
+    theta = _logit(y.sum(axis=1) / attempts)
+    difficulty = -_logit(p_values)
+    discrimination = np.full(correct.shape[1], IRT_DEFAULT_DISCRIMINATION)
+    
+    for _ in range(IRT_FIT_ITERATIONS):
+        p = irt_probability(theta[:, None], discrimination, difficulty)
+        residual = (y - p) * answered
+        weight = p * (1 - p) * answered
+        theta -= ((residual * discrimination).sum(axis=1) - theta) / (
+            -(weight * discrimination ** 2).sum(axis=1) - 1)
+        theta = np.clip(theta, -4, 4)
+        
+        p = irt_probability(theta[:, None], discrimination, difficulty)
+        residual = (y - p) * answered
+        weight = p * (1 - p) * answered
+        difficulty -= (-(residual * discrimination).sum(axis=0) - difficulty / 4) / (
+            -(weight * discrimination ** 2).sum(axis=0) - 1 / 4)
+        difficulty = np.clip(difficulty, -4, 4)
+        
+        p = irt_probability(theta[:, None], discrimination, difficulty)
+        residual = (y - p) * answered
+        weight = p * (1 - p) * answered
+        spread = theta[:, None] - difficulty
+        discrimination -= ((residual * spread).sum(axis=0) - (discrimination - 1) / 0.25) / (
+            -(weight * spread ** 2).sum(axis=0) - 1 / 0.25)
+        discrimination = np.clip(discrimination, 0.2, 4)
+    
+    return discrimination, difficulty
+
+def _write_item_parameters(db, rows):
+    db.executemany('''
+        INSERT INTO item_parameters (question_id, discrimination, difficulty, responses, calibrated_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(question_id) DO UPDATE SET
+            discrimination = excluded.discrimination,
+            difficulty = excluded.difficulty,
+            responses = excluded.responses,
+            calibrated_at = excluded.calibrated_at
+    ''', rows)
+
+def calibrate_quiz(quiz_id):
+    """Batch job: calibrate a quiz's items from every recorded answer."""
+    db = checkout_db(read_only=True)
+    try:
+        answers = fetch_int_array(db.execute('''
+            SELECT qa.submission_id, qa.question_id, qa.is_correct
+            FROM quiz_questions qq
+            JOIN quiz_answers qa ON qa.question_id = qq.id
+            WHERE qq.quiz_id = ?
+        ''', (quiz_id,)), 3)
+    finally:
+        db.close()
+    
+    if not len(answers):
+        return {'quiz_id': quiz_id, 'items_calibrated': 0}
+    
+    submission_ids, rows = np.unique(answers[:, 0], return_inverse=True)
+    question_ids, cols = np.unique(answers[:, 1], return_inverse=True)
+    correct = np.zeros((len(submission_ids), len(question_ids)), dtype=bool)
+    mask = np.zeros_like(correct)
+    correct[rows, cols] = answers[:, 2].astype(bool)
+    mask[rows, cols] = True
+    
+    discrimination, difficulty = calibrate_items(correct, mask)
+    responses = mask.sum(axis=0)
+    now = datetime.now()
+    calibrated = [
+        (int(question_ids[i]), round(float(discrimination[i]), 4), round(float(difficulty[i]), 4),
+         int(responses[i]), now)
+        for i in np.flatnonzero(responses >= IRT_MIN_RESPONSES)
+    ]
+    if calibrated:
+        db_writer.submit(_write_item_parameters, calibrated).result(timeout=DB_WRITER_RESULT_TIMEOUT)
+        item_bank_cache.invalidate(quiz_id)
+    return {'quiz_id': quiz_id, 'attempts': len(submission_ids), 'items_calibrated': len(calibrated)}
+
+def irt_quiz_ids():
+    db = checkout_db(read_only=True)
+    try:
+        return [row['id'] for row in db.execute('SELECT id FROM quizzes').fetchall()]
+    finally:
+        db.close()
+
+def calibrate_all_quizzes():
+    results = [calibrate_quiz(quiz_id) for quiz_id in irt_quiz_ids()]
+    return {
+        'quizzes': len(results),
+        'items_calibrated': sum(r['items_calibrated'] for r in results)
+    }
+
+
+class ItemBank:
+    """
+    A quiz's items with their 2PL parameters and precomputed information
+    tables: for each point of IRT_THETA_GRID, the items ordered by Fisher
+    information there. Picking the next item is a binary search for the
+    ability estimate plus a walk past the few items already asked.
+    """
+
+    def __init__(self, question_ids, correct_options, discrimination, difficulty):
+        self.question_ids = question_ids
+        self.correct_options = dict(zip(question_ids, correct_options))
+        self.position = {qid: i for i, qid in enumerate(question_ids)}
+        self.discrimination = discrimination
+        self.difficulty = difficulty
+        p = irt_probability(IRT_THETA_GRID[:, None], discrimination, difficulty)
+        information = discrimination ** 2 * p * (1 - p)
+        self.ranking = np.argsort(-information, axis=1, kind='stable')
+
+    def next_item(self, theta, asked):
+        row = self.ranking[min(np.searchsorted(IRT_THETA_GRID, theta), len(IRT_THETA_GRID) - 1)]
+        for index in row:
+            if self.question_ids[index] not in asked:
+                return self.question_ids[index]
+        return None
+
+    def estimate(self, responses):
+        """EAP ability estimate and its standard error from (question_id, correct) pairs."""
+        log_posterior = -IRT_THETA_GRID ** 2 / 2  # N(0, 1) prior
+        for question_id, correct in responses:
+            i = self.position[question_id]
+            p = irt_probability(IRT_THETA_GRID, self.discrimination[i], self.difficulty[i])
+            log_posterior = log_posterior + np.log(p if correct else 1 - p)
+        posterior = np.exp(log_posterior - log_posterior.max())
+        posterior /= posterior.sum()
+        theta = float((posterior * IRT_THETA_GRID).sum())
+        se = float(np.sqrt((posterior * (IRT_THETA_GRID - theta) ** 2).sum()))
+        return theta, se
+
+
+class ItemBankCache:
+    """Per-worker ItemBanks; calibration invalidates, the TTL covers other workers."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}  # quiz_id -> (monotonic time, ItemBank)
+
+    def get(self, db, quiz_id):
+        with self._lock:
+            entry = self._entries.get(quiz_id)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+        items = db.execute('''
+            SELECT qq.id, qq.correct_option_index, ip.discrimination, ip.difficulty
+            FROM quiz_questions qq
+            LEFT JOIN item_parameters ip ON ip.question_id = qq.id
+            WHERE qq.quiz_id = ?
+            ORDER BY qq.id
+        ''', (quiz_id,)).fetchall()
+        if not items:
+            return None
+        bank = ItemBank(
+            [item['id'] for item in items],
+            [item['correct_option_index'] for item in items],
+            np.array([IRT_DEFAULT_DISCRIMINATION if item['discrimination'] is None
+                      else item['discrimination'] for item in items]),
+            np.array([IRT_DEFAULT_DIFFICULTY if item['difficulty'] is None
+                      else item['difficulty'] for item in items])
+        )
+        with self._lock:
+            self._entries[quiz_id] = (time.monotonic(), bank)
+        return bank
+
+    def invalidate(self, quiz_id=None):
+        with self._lock:
+            if quiz_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(quiz_id, None)
+
+
+item_bank_cache = ItemBankCache(IRT_ITEM_BANK_TTL)
+maintenance_scheduler.add('irt_calibrate', calibrate_all_quizzes, IRT_CALIBRATE_INTERVAL)
+
+@app.cli.command('irt-calibrate')
+@click.argument('quiz_ids', nargs=-1, type=int)
+def irt_calibrate_command(quiz_ids):
+    """Calibrate IRT item parameters (default: all quizzes)."""
+    for quiz_id in quiz_ids or irt_quiz_ids():
+        print(calibrate_quiz(quiz_id))
+
+# ----------------------------------------------------------------------------
+# Classical item analysis (p-values, point-biserials, distractors, KR-20)
+# ----------------------------------------------------------------------------
+
+ITEM_TOO_EASY = 0.9            # p-value above this: nearly everyone gets it right
+ITEM_TOO_HARD = 0.2            # p-value below this
+ITEM_LOW_DISCRIMINATION = 0.2  # corrected point-biserial below this
+
+class ItemStatistics:
+    """
+    Running classical item-analysis counters for one quiz. Submissions are
+    merged in batches, so a view only reads the answers submitted since the
+    previous one. p-values and distractor counts use every answer;
+    discrimination and KR-20 need a total score over the whole quiz, so they
+    use complete attempts only (adaptive attempts answer a subset).
+    """
+
+    def __init__(self, quiz_id, questions):
+        self.quiz_id = quiz_id
+        self.lock = threading.Lock()
+        self.question_ids = np.array([q['id'] for q in questions], dtype=np.int64)
+        self.question_texts = [q['question_text'] for q in questions]
+        self.correct_options = [q['correct_option_index'] for q in questions]
+        self.option_texts = [json.loads(q['options']) for q in questions]
+        k = len(questions)
+        self.width = max((len(options) for options in self.option_texts), default=0)
+        self.watermark = 0  # highest submission id merged
+        self.attempts = 0
+        self.presented = np.zeros(k, dtype=np.int64)
+        self.answered = np.zeros(k, dtype=np.int64)
+        self.correct = np.zeros(k, dtype=np.int64)
+        self.choices = np.zeros((k, self.width), dtype=np.int64)
+        # Complete attempts: count, sum and sum of squares of the total score,
+        # and per item the correct count and the total score summed over them
+        self.complete = 0
+        self.score_sum = 0
+        self.score_sq_sum = 0
+        self.complete_correct = np.zeros(k, dtype=np.int64)
+        self.correct_score_sum = np.zeros(k, dtype=np.int64)
+        self._report = None
+
+    def merge(self, rows, watermark):
+        """Add (submission_id, question_id, chosen_option or -1, is_correct) rows."""
+        self.watermark = watermark
+        k = len(self.question_ids)
+        cols = np.searchsorted(self.question_ids, rows[:, 1])
+        known = cols < k
+        known[known] = self.question_ids[cols[known]] == rows[known, 1]
+        rows, cols = rows[known], cols[known]
+        if not len(rows):
+            return
+        self._report = None
+        
+        submissions, attempt = np.unique(rows[:, 0], return_inverse=True)
+        chosen, is_correct = rows[:, 2], rows[:, 3]
+        self.attempts += len(submissions)
+        self.presented += np.bincount(cols, minlength=k)
+        self.answered += np.bincount(cols[chosen >= 0], minlength=k)
+        self.correct += np.bincount(cols[is_correct == 1], minlength=k)
+        listed = (chosen >= 0) & (chosen < self.width)
+        self.choices += np.bincount(
+            cols[listed] * self.width + chosen[listed], minlength=k * self.width
+        ).reshape(k, self.width)
+        
+        scores = np.bincount(attempt, weights=is_correct).astype(np.int64)
+        full = np.bincount(attempt) == k
+        self.complete += int(full.sum())
+        self.score_sum += int(scores[full].sum())
+        self.score_sq_sum += int((scores[full] ** 2).sum())
+        hits = full[attempt] & (is_correct == 1)
+        self.complete_correct += np.bincount(cols[hits], minlength=k)
+        self.correct_score_sum += np.bincount(
+            cols[hits], weights=scores[attempt[hits]], minlength=k
+        ).astype(np.int64)
+
+    def report(self):
+        """The item-analysis summary; rebuilt only after new submissions are merged."""
+        if self._report is not None:
+            return self._report
+        
+        k = len(self.question_ids)
+        n = self.complete
+        with np.errstate(divide='ignore', invalid='ignore'):
+            p_value = self.correct / self.presented
+            mean = self.score_sum / n if n else np.nan
+            variance = self.score_sq_sum / n - mean ** 2 if n else np.nan
+            # Item-total covariance from the running sums; the corrected
+            # correlation takes the item out of the total (the "rest" score)
+            p_complete = self.complete_correct / n if n else np.full(k, np.nan)
+            item_variance = p_complete * (1 - p_complete)
+            covariance = self.correct_score_sum / n - p_complete * mean if n else np.full(k, np.nan)
+            point_biserial = covariance / np.sqrt(item_variance * variance)
+            rest_variance = variance + item_variance - 2 * covariance
+            corrected = (covariance - item_variance) / np.sqrt(item_variance * rest_variance)
+            kr20 = k / (k - 1) * (1 - item_variance.sum() / variance) if k > 1 else np.nan
+        
+        def _num(value, digits=3):
+            return None if not np.isfinite(value) else round(float(value), digits)
+        
+        items = []
+        for i, question_id in enumerate(self.question_ids.tolist()):
+            flags = []
+            if self.presented[i]:
+                if p_value[i] > ITEM_TOO_EASY:
+                    flags.append('too_easy')
+                elif p_value[i] < ITEM_TOO_HARD:
+                    flags.append('too_hard')
+            if np.isfinite(corrected[i]) and corrected[i] < ITEM_LOW_DISCRIMINATION:
+                flags.append('low_discrimination')
+            items.append({
+                'question_id': question_id,
+                'question_text': self.question_texts[i],
+                'responses': int(self.presented[i]),
+                'p_value': _num(p_value[i]),
+                'point_biserial': _num(point_biserial[i]),
+                'corrected_point_biserial': _num(corrected[i]),
+                'omitted': int(self.presented[i] - self.answered[i]),
+                'options': [{
+                    'option': j,
+                    'text': text,
+                    'is_correct': j == self.correct_options[i],
+                    'count': int(self.choices[i, j]),
+                    'proportion': _num(self.choices[i, j] / self.presented[i]) if self.presented[i] else None
+                } for j, text in enumerate(self.option_texts[i])],
+                'flags': flags
+            })
+        
+        self._report = {
+            'quiz_id': self.quiz_id,
+            'computed_at': datetime.now().isoformat(),
+            'last_submission_id': self.watermark,
+            'attempts': self.attempts,
+            'complete_attempts': n,
+            'mean_score': _num(mean, 2),
+            'score_std': _num(np.sqrt(variance), 2),
+            'kr20': _num(kr20),
+            'items': items
+        }
+        return self._report
+
+
+class ItemAnalysisCache:
+    """
+    Per-worker ItemStatistics. Every view checks the newest submission id
+    (a rowid lookup) and merges only the answers past the quiz's watermark,
+    so repeat views of a busy quiz don't re-read its answers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # quiz_id -> ItemStatistics
+
+    def get(self, db, quiz_id):
+        with self._lock:
+            stats = self._entries.get(quiz_id)
+        if stats is None:
+            questions = db.execute('''
+                SELECT id, question_text, options, correct_option_index
+                FROM quiz_questions
+                WHERE quiz_id = ?
+                ORDER BY id
+            ''', (quiz_id,)).fetchall()
+            if not questions:
+                return None
+            with self._lock:
+                stats = self._entries.setdefault(quiz_id, ItemStatistics(quiz_id, questions))
+        
+        with stats.lock:
+            # Submission ids commit in order, so everything up to the newest
+            # id is visible and the watermark never skips a submission
+            latest = db.execute('SELECT MAX(id) FROM quiz_submissions').fetchone()[0] or 0
+            if latest > stats.watermark:
+                cursor = db.execute('''
+                    SELECT qa.submission_id, qa.question_id,
+                           CAST(COALESCE(qa.chosen_option, -1) AS INTEGER), qa.is_correct
+                    FROM quiz_submissions s
+                    JOIN quiz_answers qa ON qa.submission_id = s.id
+                    WHERE s.quiz_id = ? AND s.id > ? AND s.id <= ?
+                ''', (quiz_id, stats.watermark, latest))
+                stats.merge(fetch_int_array(cursor, 4), latest)
+            return stats.report()
+
+    def invalidate(self, quiz_id=None):
+        with self._lock:
+            if quiz_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(quiz_id, None)
+
+
+item_analysis_cache = ItemAnalysisCache()
+
+# ----------------------------------------------------------------------------
+# Collaborative filtering (item-item content neighbours)
+# ----------------------------------------------------------------------------
+
+CF_CHUNK_STUDENTS = 4096  # interaction-matrix rows densified at a time
+CF_PRIORITY = 50  # priority of the best neighbour; gap-driven items go up to 110
+
+def _load_cf_interactions(db, class_id):
+    """
+    A class's content and who has used it: quiz attempts, lecture views and
+    completed recommendations, as (student_id, item index) pairs. Items are
+    the class's lectures followed by its quizzes.
+    """
+    lecture_ids = np.array([row['id'] for row in db.execute(
+        'SELECT id FROM lectures WHERE class_id = ? ORDER BY id', (class_id,)
+    ).fetchall()], dtype=np.int64)
+    quiz_ids = np.array([row['id'] for row in db.execute(
+        'SELECT id FROM quizzes WHERE class_id = ? ORDER BY id', (class_id,)
+    ).fetchall()], dtype=np.int64)
+    items = [('lecture', int(i)) for i in lecture_ids] + [('quiz', int(i)) for i in quiz_ids]
+    
+    lecture_pairs = [fetch_int_array(cursor, 2) for cursor in (
+        db.execute('''
+            SELECT v.user_id, v.lecture_id
+            FROM lectures l
+            JOIN lecture_views v ON v.lecture_id = l.id
+            WHERE l.class_id = ?
+        ''', (class_id,)),
+        db.execute('''
+            SELECT r.user_id, r.content_id
+            FROM lectures l
+            JOIN recommendations r ON r.content_type = 'lecture' AND r.content_id = l.id
+            WHERE l.class_id = ? AND r.is_completed = 1
+        ''', (class_id,)),
+    )]
+    quiz_pairs = [fetch_int_array(cursor, 2) for cursor in (
+        db.execute('''
+            SELECT s.student_id, s.quiz_id
+            FROM quizzes q
+            JOIN quiz_submissions s ON s.quiz_id = q.id
+            WHERE q.class_id = ?
+        ''', (class_id,)),
+        db.execute('''
+            SELECT r.user_id, r.content_id
+            FROM quizzes q
+            JOIN recommendations r ON r.content_type = 'quiz' AND r.content_id = q.id
+            WHERE q.class_id = ? AND r.is_completed = 1
+        ''', (class_id,)),
+    )]
+    
+    lectures = np.concatenate(lecture_pairs)
+    quizzes = np.concatenate(quiz_pairs)
+    lectures[:, 1] = np.searchsorted(lecture_ids, lectures[:, 1])
+    quizzes[:, 1] = len(lecture_ids) + np.searchsorted(quiz_ids, quizzes[:, 1])
+    return items, np.concatenate([lectures, quizzes])
+
+def item_neighbors(interactions, item_count, k, min_cooccurrence):
+    """
+    Top-k cosine neighbours per item from binary (student, item) pairs.
+    The co-occurrence matrix is accumulated a chunk of students at a time,
+    so memory stays at items x items however many students there are.
+    
+    Returns: (neighbours, similarities), item_count x k, -1 / 0 padded
+    """
+    if not len(interactions):
+        return np.full((item_count, 0), -1), np.zeros((item_count, 0))
+    _, students = np.unique(interactions[:, 0], return_inverse=True)
+    keys = np.unique(students * item_count + interactions[:, 1])  # repeat uses count once
+    students, cols = keys // item_count, keys % item_count
+    
+    cooccurrence = np.zeros((item_count, item_count))
+    bounds = np.searchsorted(students, np.arange(0, students[-1] + CF_CHUNK_STUDENTS + 1, CF_CHUNK_STUDENTS))
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        if start == end:
+            continue
+        chunk = np.zeros((students[end - 1] - students[start] + 1, item_count), dtype=np.float32)
+        chunk[students[start:end] - students[start], cols[start:end]] = 1
+        cooccurrence += chunk.T @ chunk
+    
+    users = np.diag(cooccurrence).copy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        similarity = cooccurrence / np.sqrt(np.outer(users, users))
+    similarity[~np.isfinite(similarity) | (cooccurrence < min_cooccurrence)] = 0
+    np.fill_diagonal(similarity, 0)
+    
+    k = min(k, max(item_count - 1, 0))
+    order = np.argsort(-similarity, axis=1, kind='stable')[:, :k]
+    scores = np.take_along_axis(similarity, order, axis=1)
+    return np.where(scores > 0, order, -1), scores
+
+def _write_content_neighbors(db, class_id, rows):
+    db.execute('DELETE FROM content_neighbors WHERE class_id = ?', (class_id,))
+    db.executemany('''
+        INSERT INTO content_neighbors
+        (content_type, content_id, neighbor_type, neighbor_id, similarity, class_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', rows)
+
+def rebuild_content_neighbors(class_id):
+    """Batch job: recompute a class's item-item neighbour lists."""
+    db = checkout_db(read_only=True)
+    try:
+        items, interactions = _load_cf_interactions(db, class_id)
+    finally:
+        db.close()
+    
+    rows = []
+    if items and len(interactions):
+        neighbors, scores = item_neighbors(interactions, len(items), CF_NEIGHBORS, CF_MIN_COOCCURRENCE)
+        for i, j in zip(*np.nonzero(neighbors >= 0)):
+            content_type, content_id = items[i]
+            neighbor_type, neighbor_id = items[neighbors[i, j]]
+            rows.append((content_type, content_id, neighbor_type, neighbor_id,
+                         round(float(scores[i, j]), 4), class_id))
+    db_writer.submit(_write_content_neighbors, class_id, rows).result(timeout=DB_WRITER_RESULT_TIMEOUT)
+    return {
+        'class_id': class_id,
+        'items': len(items),
+        'students': len(np.unique(interactions[:, 0])),
+        'interactions': len(interactions),
+        'neighbors': len(rows)
+    }
+
+def all_class_ids():
+    db = checkout_db(read_only=True)
+    try:
+        return [row['id'] for row in db.execute('SELECT id FROM classes').fetchall()]
+    finally:
+        db.close()
+
+def rebuild_all_content_neighbors():
+    results = [rebuild_content_neighbors(class_id) for class_id in all_class_ids()]
+    return {'classes': len(results), 'neighbors': sum(r['neighbors'] for r in results)}
+
+
+maintenance_scheduler.add('cf_rebuild', rebuild_all_content_neighbors, CF_REBUILD_INTERVAL)
+
+@app.cli.command('cf-rebuild')
+@click.argument('class_ids', nargs=-1, type=int)
+def cf_rebuild_command(class_ids):
+    """Rebuild content neighbours for recommendations (default: all classes)."""
+    for class_id in class_ids or all_class_ids():
+        print(rebuild_content_neighbors(class_id))
+
+# ----------------------------------------------------------------------------
+# Topic -> content index
+# ----------------------------------------------------------------------------
+
+class TopicContentIndex:
+    """
+    Per-worker map of each class's topics to the lectures and quizzes that
+    cover them, from lecture_topics and quiz_topics in two indexed queries.
+    Tagging and new content invalidate a class; entries also expire after
+    ttl seconds so changes made through other workers show up.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}  # class_id -> (monotonic time, {topic_id: content})
+
+    def get(self, db, class_id):
+        """Returns: {topic_id: {'lectures': [...], 'quizzes': [...]}}, newest / most focused first"""
+        with self._lock:
+            entry = self._entries.get(class_id)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+        
+        content = {}
+        for row in db.execute('''
+            SELECT lt.topic_id, l.id, l.filename
+            FROM topics t
+            JOIN lecture_topics lt ON lt.topic_id = t.id
+            JOIN lectures l ON l.id = lt.lecture_id
+            WHERE t.class_id = ?
+            ORDER BY l.uploaded_at DESC, l.id DESC
+        ''', (class_id,)).fetchall():
+            content.setdefault(row['topic_id'], {'lectures': [], 'quizzes': []})['lectures'].append(
+                {'id': row['id'], 'title': row['filename']}
+            )
+        for row in db.execute('''
+            SELECT qt.topic_id, q.id, q.title, qt.question_count
+            FROM topics t
+            JOIN quiz_topics qt ON qt.topic_id = t.id
+            JOIN quizzes q ON q.id = qt.quiz_id
+            WHERE t.class_id = ?
+            ORDER BY qt.question_count DESC, q.id DESC
+        ''', (class_id,)).fetchall():
+            content.setdefault(row['topic_id'], {'lectures': [], 'quizzes': []})['quizzes'].append(
+                {'id': row['id'], 'title': row['title'], 'question_count': row['question_count']}
+            )
+        
+        with self._lock:
+            self._entries[class_id] = (time.monotonic(), content)
+        return content
+
+    def invalidate(self, class_id=None):
+        with self._lock:
+            if class_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(class_id, None)
+
+
+topic_content_index = TopicContentIndex(TOPIC_CONTENT_CACHE_TTL)
+
+def foreign_topic_ids(db, class_id, topic_ids):
+    """The ids in topic_ids that are not topics of class_id."""
+    topic_ids = set(topic_ids)
+    if not topic_ids:
+        return set()
+    placeholders = ', '.join('?' * len(topic_ids))
+    own = db.execute(
+        f'SELECT id FROM topics WHERE class_id = ? AND id IN ({placeholders})',
+        (class_id, *topic_ids)
+    ).fetchall()
+    return topic_ids - {row['id'] for row in own}
+
+# ----------------------------------------------------------------------------
+# Learning paths (topic prerequisite DAG)
+# ----------------------------------------------------------------------------
+
+LEARNING_PATH_MASTERY = 60.0  # topic_mastery score a topic needs to count as learned
+LEARNING_PATH_CONTENT = 3     # lectures / quizzes attached per step
+
+class TopicGraph:
+    """
+    A class's topic prerequisite DAG: a topological order plus the
+    transitive ancestors and descendants of every topic, so path building
+    and "what does this change affect" are set lookups.
+    """
+
+    def __init__(self, topics, edges):
+        self.names = dict(topics)  # topic_id -> topic_name
+        self.prerequisites = {topic_id: set() for topic_id in self.names}
+        self.dependents = {topic_id: set() for topic_id in self.names}
+        for topic_id, prerequisite_id in edges:
+            if topic_id in self.names and prerequisite_id in self.names:
+                self.prerequisites[topic_id].add(prerequisite_id)
+                self.dependents[prerequisite_id].add(topic_id)
+        
+        # Kahn's algorithm, lowest id first so the order is stable
+        indegree = {topic_id: len(p) for topic_id, p in self.prerequisites.items()}
+        ready = [topic_id for topic_id, count in indegree.items() if count == 0]
+        heapq.heapify(ready)
+        self.order = []
+        while ready:
+            topic_id = heapq.heappop(ready)
+            self.order.append(topic_id)
+            for dependent in self.dependents[topic_id]:
+                indegree[dependent] -= 1
+                if indegree[dependent] == 0:
+                    heapq.heappush(ready, dependent)
+        if len(self.order) < len(self.names):
+            # Edges are checked for cycles when saved, so this needs concurrent edits
+            logger.warning(f"Cycle in topic prerequisites; ordering {len(self.names) - len(self.order)} topics by id")
+            self.order += sorted(set(self.names) - set(self.order))
+        self.rank = {topic_id: i for i, topic_id in enumerate(self.order)}
+        
+        self.ancestors = {}
+        for topic_id in self.order:
+            ancestors = set()
+            for prerequisite_id in self.prerequisites[topic_id]:
+                ancestors.add(prerequisite_id)
+                ancestors |= self.ancestors.get(prerequisite_id, frozenset())
+            self.ancestors[topic_id] = frozenset(ancestors)
+        self.descendants = {topic_id: set() for topic_id in self.order}
+        for topic_id in reversed(self.order):
+            for prerequisite_id in self.prerequisites[topic_id]:
+                self.descendants[prerequisite_id].add(topic_id)
+                self.descendants[prerequisite_id] |= self.descendants[topic_id]
+
+    def creates_cycle(self, topic_id, prerequisite_ids):
+        """Would giving topic_id these prerequisites close a cycle?"""
+        return any(p == topic_id or p in self.descendants.get(topic_id, ()) for p in prerequisite_ids)
+
+    def region(self, topic_ids):
+        """The topics whose path membership a mastery change on topic_ids can affect."""
+        affected = set()
+        for topic_id in topic_ids:
+            if topic_id in self.descendants:
+                affected.add(topic_id)
+                affected |= self.descendants[topic_id]
+        return affected
+
+
+class TopicGraphCache:
+    """Per-worker TopicGraphs; prerequisite edits invalidate, the TTL covers other workers."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}  # class_id -> (monotonic time, TopicGraph)
+
+    def get(self, db, class_id):
+        with self._lock:
+            entry = self._entries.get(class_id)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+        topics = db.execute(
+            'SELECT id, topic_name FROM topics WHERE class_id = ?', (class_id,)
+        ).fetchall()
+        edges = db.execute('''
+            SELECT tp.topic_id, tp.prerequisite_id
+            FROM topics t
+            JOIN topic_prerequisites tp ON tp.topic_id = t.id
+            WHERE t.class_id = ?
+        ''', (class_id,)).fetchall()
+        graph = TopicGraph(
+            [(t['id'], t['topic_name']) for t in topics],
+            [(e['topic_id'], e['prerequisite_id']) for e in edges]
+        )
+        with self._lock:
+            self._entries[class_id] = (time.monotonic(), graph)
+        return graph
+
+    def invalidate(self, class_id=None):
+        with self._lock:
+            if class_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(class_id, None)
+
+
+topic_graph_cache = TopicGraphCache(TOPIC_CONTENT_CACHE_TTL)
+
+def build_learning_path(graph, content, mastery, previous=None):
+    """
+    Order a student's weak topics (attempted, below LEARNING_PATH_MASTERY)
+    together with their unmet prerequisites (weak or never attempted),
+    prerequisites first, with the lectures and quizzes covering each step.
+    Steps of the previous path that are now learned are kept as completed.
+    
+    Returns: path_data dict
+    """
+    def unmet(topic_id):
+        return mastery.get(topic_id, 0.0) < LEARNING_PATH_MASTERY
+    
+    weak = {topic_id for topic_id, score in mastery.items()
+            if topic_id in graph.rank and score < LEARNING_PATH_MASTERY}
+    required_by = {}
+    for topic_id in weak:
+        for ancestor in graph.ancestors[topic_id]:
+            if unmet(ancestor):
+                required_by.setdefault(ancestor, set()).add(topic_id)
+    
+    no_content = {'lectures': [], 'quizzes': []}
+    steps = []
+    for topic_id in sorted(weak | required_by.keys(), key=graph.rank.get):
+        covering = content.get(topic_id, no_content)
+        steps.append({
+            'topic_id': topic_id,
+            'topic_name': graph.names[topic_id],
+            'mastery': round(mastery[topic_id], 1) if topic_id in mastery else None,
+            'reason': 'weak' if topic_id in weak else 'prerequisite',
+            'required_by': sorted(required_by.get(topic_id, ())),
+            'lectures': covering['lectures'][:LEARNING_PATH_CONTENT],
+            'quizzes': covering['quizzes'][:LEARNING_PATH_CONTENT]
+        })
+    
+    on_path = {step['topic_id'] for step in steps}
+    seen = set()
+    if previous:
+        seen = {step['topic_id'] for step in previous['steps']} | set(previous['completed'])
+    completed = sorted(topic_id for topic_id in seen
+                       if topic_id in graph.rank and topic_id not in on_path and not unmet(topic_id))
+    
+    return {
+        'steps': steps,
+        'completed': completed,
+        'progress': round(len(completed) / (len(completed) + len(steps)), 3) if steps else 1.0,
+        'mastery_threshold': LEARNING_PATH_MASTERY,
+        'generated_at': datetime.now().isoformat()
+    }
+
+def refresh_learning_path(db, student_id, class_id, changed=None):
+    """
+    Writer job: bring a student's stored learning path up to date.
+    changed maps the topics whose mastery just moved to their new score; the
+    path is only rebuilt when that change reaches it (a changed topic or one
+    of its dependents is on the path, or a changed topic is now weak).
+    Without it the path is always rebuilt.
+    
+    Returns: True if the stored path was rewritten
+    """
+    graph = topic_graph_cache.get(db, class_id)
+    row = db.execute(
+        'SELECT path_data FROM learning_paths WHERE user_id = ? AND class_id = ?',
+        (student_id, class_id)
+    ).fetchone()
+    previous = json.loads(row['path_data']) if row else None
+    
+    if changed is not None and previous is not None:
+        on_path = {step['topic_id'] for step in previous['steps']}
+        now_weak = any(score < LEARNING_PATH_MASTERY for score in changed.values())
+        if not now_weak and not graph.region(changed) & on_path:
+            return False
+    
+    mastery = {row['topic_id']: row['mastery_score'] for row in db.execute('''
+        SELECT tm.topic_id, tm.mastery_score
+        FROM topics t
+        JOIN topic_mastery tm ON tm.topic_id = t.id
+        WHERE t.class_id = ? AND tm.user_id = ?
+    ''', (class_id, student_id)).fetchall()}
+    path = build_learning_path(graph, topic_content_index.get(db, class_id), mastery, previous)
+    if previous is not None and (path['steps'], path['completed']) == (previous['steps'], previous['completed']):
+        return False
+    
+    db.execute('''
+        INSERT INTO learning_paths (user_id, class_id, path_data, progress, last_updated)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(user_id, class_id) DO UPDATE SET
+            path_data = excluded.path_data,
+            progress = excluded.progress,
+            last_updated = excluded.last_updated
+    ''', (student_id, class_id, json.dumps(path), path['progress'], datetime.now()))
+    return True
+
+def schedule_learning_path_refresh(db, class_id, student_ids=None):
+    """
+    Queue full learning-path rebuilds on the writer thread after the DAG,
+    topic content or a batch of mastery scores changed. Defaults to every
+    student enrolled in the class, handled by one refresh_students job.
+    """
+    if student_ids is None:
+        student_ids = [row['student_id'] for row in db.execute(
+            'SELECT student_id FROM enrollments WHERE class_id = ?', (class_id,)
+        ).fetchall()]
+    if student_ids:
+        db_writer.submit(refresh_students, refresh_learning_path, class_id, student_ids) \
+            .add_done_callback(log_write_failure)
+    return len(student_ids)
 
 def generate_adaptive_recommendations(db, student_id, class_id):
     """
     AI-powered content recommendation engine.
     Recommends lectures, quizzes, and practice based on knowledge gaps.
+    A fixed handful of queries however many gaps or items there are; the
+    caller commits.
     
-    Returns: List of personalized recommendations
+    Returns: List of newly added recommendations
     """
     try:
         # Get knowledge gaps
         gaps = db.execute('''
-            SELECT kg.*, t.topic_name, t.class_id
+            SELECT kg.topic_id, kg.mastery_level, t.topic_name
             FROM knowledge_gaps kg
             JOIN topics t ON kg.topic_id = t.id
             WHERE kg.user_id = ? AND t.class_id = ?
@@ -448,81 +3544,101 @@ def generate_adaptive_recommendations(db, student_id, class_id):
             LIMIT 5
         ''', (student_id, class_id)).fetchall()
         
-        recommendations = []
+        # Nearest neighbours of what the student has already used, from the
+        # lists the cf_rebuild job precomputes
+        neighbors = db.execute('''
+            WITH used(content_type, content_id) AS (
+                SELECT 'quiz', quiz_id FROM quiz_submissions WHERE student_id = ?
+                UNION
+                SELECT 'lecture', lecture_id FROM lecture_views WHERE user_id = ?
+                UNION
+                SELECT content_type, content_id FROM recommendations
+                WHERE user_id = ? AND is_completed = 1
+            ),
+            ranked AS (
+                SELECT cn.neighbor_type, cn.neighbor_id, SUM(cn.similarity) AS score
+                FROM used
+                JOIN content_neighbors cn
+                    ON cn.content_type = used.content_type AND cn.content_id = used.content_id
+                WHERE cn.class_id = ?
+                    AND (cn.neighbor_type, cn.neighbor_id) NOT IN (SELECT content_type, content_id FROM used)
+                GROUP BY cn.neighbor_type, cn.neighbor_id
+                ORDER BY score DESC
+                LIMIT 10
+            )
+            SELECT ranked.neighbor_type, ranked.neighbor_id, ranked.score,
+                   COALESCE(l.filename, q.title) AS title
+            FROM ranked
+            LEFT JOIN lectures l ON ranked.neighbor_type = 'lecture' AND l.id = ranked.neighbor_id
+            LEFT JOIN quizzes q ON ranked.neighbor_type = 'quiz' AND q.id = ranked.neighbor_id
+            ORDER BY ranked.score DESC
+        ''', (student_id, student_id, student_id, class_id)).fetchall()
+        
+        if not gaps and not neighbors:
+            return []
+        
+        # Content covering each topic, and what the student already has pending
+        topic_content = topic_content_index.get(db, class_id)
+        
+        pending = {
+            (r['content_type'], r['content_id']) for r in db.execute('''
+                SELECT content_type, content_id FROM recommendations
+                WHERE user_id = ? AND is_completed = 0
+            ''', (student_id,)).fetchall()
+        }
         
+        # Gaps come weakest first, so each item keeps its highest-priority reason
+        candidates = {}
         for gap in gaps:
-            topic_id = gap['topic_id']
             topic_name = gap['topic_name']
             mastery = gap['mastery_level']
+            content = topic_content.get(gap['topic_id'], {'lectures': [], 'quizzes': []})
             
-            # Recommend lectures on this topic
-            lectures = db.execute('''
-                SELECT l.id, l.filename, l.class_id
-                FROM lectures l
-                WHERE l.class_id = ?
-                LIMIT 2
-            ''', (class_id,)).fetchall()
-            
-            for lecture in lectures:
-                reason = f"Review lecture on {topic_name} (Current mastery: {round(mastery*100, 1)}%)"
-                priority = int((1 - mastery) * 100)  # Lower mastery = higher priority
-                
-                # Check if already recommended
-                existing = db.execute('''
-                    SELECT id FROM recommendations 
-                    WHERE user_id = ? AND content_type = 'lecture' AND content_id = ?
-                    AND is_completed = 0
-                ''', (student_id, lecture['id'])).fetchone()
-                
-                if not existing:
-                    db.execute('''
-                        INSERT INTO recommendations
-                        (user_id, content_type, content_id, reason, priority)
-                        VALUES (?, ?, ?, ?, ?)
-                    ''', (student_id, 'lecture', lecture['id'], reason, priority))
-                    
-                    recommendations.append({
-                        'type': 'lecture',
-                        'id': lecture['id'],
-                        'title': lecture['filename'],
-                        'reason': reason,
-                        'priority': priority
-                    })
+            for lecture in content['lectures'][:2]:
+                key = ('lecture', lecture['id'])
+                if key in pending or key in candidates:
+                    continue
+                candidates[key] = {
+                    'type': 'lecture',
+                    'id': lecture['id'],
+                    'title': lecture['title'],
+                    'reason': f"Review lecture on {topic_name} (Current mastery: {round(mastery*100, 1)}%)",
+                    'priority': int((1 - mastery) * 100)  # Lower mastery = higher priority
+                }
             
             # Recommend practice quizzes
-            quizzes = db.execute('''
-                SELECT q.id, q.title
-                FROM quizzes q
-                WHERE q.class_id = ?
-                LIMIT 1
-            ''', (class_id,)).fetchall()
-            
-            for quiz in quizzes:
-                reason = f"Practice quiz for {topic_name} to improve mastery"
-                priority = int((1 - mastery) * 100) + 10  # Quizzes slightly higher priority
-                
-                existing = db.execute('''
-                    SELECT id FROM recommendations 
-                    WHERE user_id = ? AND content_type = 'quiz' AND content_id = ?
-                    AND is_completed = 0
-                ''', (student_id, quiz['id'])).fetchone()
-                
-                if not existing:
-                    db.execute('''
-                        INSERT INTO recommendations
-                        (user_id, content_type, content_id, reason, priority)
-                        VALUES (?, ?, ?, ?, ?)
-                    ''', (student_id, 'quiz', quiz['id'], reason, priority))
-                    
-                    recommendations.append({
-                        'type': 'quiz',
-                        'id': quiz['id'],
-                        'title': quiz['title'],
-                        'reason': reason,
-                        'priority': priority
-                    })
+            for quiz in content['quizzes'][:1]:
+                key = ('quiz', quiz['id'])
+                if key in pending or key in candidates:
+                    continue
+                candidates[key] = {
+                    'type': 'quiz',
+                    'id': quiz['id'],
+                    'title': quiz['title'],
+                    'reason': f"Practice quiz for {topic_name} to improve mastery",
+                    'priority': int((1 - mastery) * 100) + 10  # Quizzes slightly higher priority
+                }
         
-        db.commit()
+        # Then what classmates with a similar history went on to use
+        for neighbor in neighbors:
+            key = (neighbor['neighbor_type'], neighbor['neighbor_id'])
+            if key in pending or key in candidates or neighbor['title'] is None:
+                continue
+            candidates[key] = {
+                'type': neighbor['neighbor_type'],
+                'id': neighbor['neighbor_id'],
+                'title': neighbor['title'],
+                'reason': "Students who studied the same material as you also used this",
+                'priority': int(CF_PRIORITY * neighbor['score'] / neighbors[0]['score'])
+            }
+        
+        recommendations = list(candidates.values())
+        db.executemany('''
+            INSERT INTO recommendations
+            (user_id, content_type, content_id, reason, priority)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT DO NOTHING
+        ''', [(student_id, r['type'], r['id'], r['reason'], r['priority']) for r in recommendations])
         
         # Sort by priority
         recommendations.sort(key=lambda x: x['priority'], reverse=True)
@@ -532,6 +3648,33 @@ def generate_adaptive_recommendations(db, student_id, class_id):
         logger.error(f"Error generating recommendations: {e}")
         return []
 
+def refresh_recommendations(db, student_id, class_id):
+    """Writer job: regenerate one student's recommendations and stamp the time."""
+    recommendations = generate_adaptive_recommendations(db, student_id, class_id)
+    db.execute('''
+        INSERT INTO recommendation_refresh (user_id, class_id, refreshed_at)
+        VALUES (?, ?, ?)
+        ON CONFLICT(user_id, class_id) DO UPDATE SET refreshed_at = excluded.refreshed_at
+    ''', (student_id, class_id, datetime.now()))
+    return len(recommendations)
+
+def schedule_recommendation_refresh(db, class_id, student_ids=None):
+    """
+    Queue recommendation regeneration on the writer thread after a trigger
+    event (quiz submission, new content, topic changes). Defaults to every
+    student enrolled in the class; one refresh_students job works through
+    them a chunk at a time. Call after committing the trigger's own
+    writes, so the jobs don't wait on this request's transaction.
+    """
+    if student_ids is None:
+        student_ids = [row['student_id'] for row in db.execute(
+            'SELECT student_id FROM enrollments WHERE class_id = ?', (class_id,)
+        ).fetchall()]
+    if student_ids:
+        db_writer.submit(refresh_students, refresh_recommendations, class_id, student_ids) \
+            .add_done_callback(log_write_failure)
+    return len(student_ids)
+
 def get_student_context_for_ai(db, student_id):
     """
     Gathers student's learning context for AI-powered personalized tutoring.
@@ -686,106 +3829,104 @@ def call_fallback_ai(prompt, system_prompt):
     
     return "AI service temporarily unavailable. Please configure an API key."
 
-def check_and_create_intervention_alerts(db, student_id, class_id):
+# ----------------------------------------------------------------------------
+# Teacher intervention sweep
+# ----------------------------------------------------------------------------
+LOW_PACE_SCORE = 4.0  # pace_score (0-10) below this raises a low_performance alert
+DISENGAGED_DAYS = 7   # days without a quiz submission before a disengaged alert
+
+def _sweep_class_interventions(db, class_id):
     """
-    Monitors student performance and creates alerts for teachers
-    when intervention is needed (AI-driven early warning system).
+    Writer job: raise the missing alerts for one class, one INSERT ... SELECT
+    per trigger. The partial unique index on open alerts drops duplicates, so
+    a student keeps one unresolved alert of each type.
+    
+    Returns: {alert_type: alerts created}
     """
-    try:
-        # Get student metrics
-        metrics = db.execute('''
-            SELECT * FROM student_metrics
-            WHERE user_id = ? AND class_id = ?
-        ''', (student_id, class_id)).fetchone()
-        
-        if not metrics:
-            return
-        
-        # Get teacher
-        teacher = db.execute('''
-            SELECT teacher_id FROM classes WHERE id = ?
-        ''', (class_id,)).fetchone()
-        
-        if not teacher:
-            return
-        
-        teacher_id = teacher['teacher_id']
-        
-        # Check for intervention triggers
-        alerts = []
-        
-        # Trigger 1: Low performance (pace_score < 4.0)
-        if metrics['pace_score'] < 4.0:
-            # Check if alert already exists
-            existing = db.execute('''
-                SELECT id FROM teacher_interventions
-                WHERE student_id = ? AND class_id = ? AND alert_type = 'low_performance'
-                AND is_resolved = 0
-            ''', (student_id, class_id)).fetchone()
-            
-            if not existing:
-                message = f"Student performance is below threshold (Pace: {metrics['pace_score']}/10). Immediate attention needed."
-                db.execute('''
-                    INSERT INTO teacher_interventions
-                    (student_id, teacher_id, class_id, alert_type, message)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (student_id, teacher_id, class_id, 'low_performance', message))
-                alerts.append('low_performance')
-        
-        # Trigger 2: Knowledge gaps
-        gaps = db.execute('''
-            SELECT COUNT(*) as gap_count
-            FROM knowledge_gaps
-            WHERE user_id = ? AND mastery_level < 0.5
-        ''', (student_id,)).fetchone()
-        
-        if gaps and gaps['gap_count'] >= 3:
-            existing = db.execute('''
-                SELECT id FROM teacher_interventions
-                WHERE student_id = ? AND class_id = ? AND alert_type = 'knowledge_gap'
-                AND is_resolved = 0
-            ''', (student_id, class_id)).fetchone()
-            
-            if not existing:
-                message = f"Student has {gaps['gap_count']} significant knowledge gaps. Recommend review sessions."
-                db.execute('''
-                    INSERT INTO teacher_interventions
-                    (student_id, teacher_id, class_id, alert_type, message)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (student_id, teacher_id, class_id, 'knowledge_gap', message))
-                alerts.append('knowledge_gap')
-        
-        # Trigger 3: Disengagement (no activity in last 7 days)
-        last_activity = db.execute('''
-            SELECT MAX(submitted_at) as last_active
-            FROM quiz_submissions
-            WHERE student_id = ?
-        ''', (student_id,)).fetchone()
-        
-        if last_activity and last_activity['last_active']:
-            days_since = (datetime.now() - datetime.fromisoformat(last_activity['last_active'])).days
-            if days_since > 7:
-                existing = db.execute('''
-                    SELECT id FROM teacher_interventions
-                    WHERE student_id = ? AND class_id = ? AND alert_type = 'disengaged'
-                    AND is_resolved = 0
-                ''', (student_id, class_id)).fetchone()
-                
-                if not existing:
-                    message = f"Student inactive for {days_since} days. May need re-engagement."
-                    db.execute('''
-                        INSERT INTO teacher_interventions
-                        (student_id, teacher_id, class_id, alert_type, message)
-                        VALUES (?, ?, ?, ?, ?)
-                    ''', (student_id, teacher_id, class_id, 'disengaged', message))
-                    alerts.append('disengaged')
-        
-        db.commit()
-        return alerts
-        
-    except Exception as e:
-        logger.error(f"Error checking intervention alerts: {e}")
-        return []
+    created = {}
+    created['low_performance'] = db.execute('''
+        INSERT INTO teacher_interventions (student_id, teacher_id, class_id, alert_type, message)
+        SELECT sm.user_id, c.teacher_id, c.id, 'low_performance',
+               'Student performance is below threshold (Pace: ' || sm.pace_score
+               || '/10). Immediate attention needed.'
+        FROM classes c
+        JOIN student_metrics sm ON sm.class_id = c.id
+        WHERE c.id = ? AND sm.pace_score < ?
+        ON CONFLICT DO NOTHING
+    ''', (class_id, LOW_PACE_SCORE)).rowcount
+    
+    # Weak topics from the counters (mastery_level is correct / attempted),
+    # which the covering topic index holds
+    created['knowledge_gap'] = db.execute('''
+        INSERT INTO teacher_interventions (student_id, teacher_id, class_id, alert_type, message)
+        SELECT kg.user_id, c.teacher_id, c.id, 'knowledge_gap',
+               'Student has ' || COUNT(*) || ' significant knowledge gaps. Recommend review sessions.'
+        FROM classes c
+        JOIN topics t ON t.class_id = c.id
+        JOIN knowledge_gaps kg ON kg.topic_id = t.id
+        WHERE c.id = ? AND kg.questions_correct < ? * kg.questions_attempted
+        GROUP BY kg.user_id
+        HAVING COUNT(*) >= ?
+        ON CONFLICT DO NOTHING
+    ''', (class_id, STRUGGLING_MASTERY, STRUGGLING_WEAK_TOPICS)).rowcount
+    
+    # Activity in this class only; students who never submitted count from
+    # when they enrolled. Both timestamps are written with datetime.now(), so
+    # the cutoff uses the same clock rather than SQLite's UTC 'now'
+    now = datetime.now()
+    created['disengaged'] = db.execute('''
+        INSERT INTO teacher_interventions (student_id, teacher_id, class_id, alert_type, message)
+        SELECT a.student_id, c.teacher_id, c.id, 'disengaged',
+               'Student inactive for ' || CAST(julianday(?) - julianday(a.last_active) AS INTEGER)
+               || ' days. May need re-engagement.'
+        FROM classes c
+        JOIN (
+            SELECT e.class_id, e.student_id,
+                   COALESCE((SELECT MAX(s.submitted_at)
+                             FROM quiz_submissions s
+                             JOIN quizzes q ON q.id = s.quiz_id
+                             WHERE s.student_id = e.student_id AND q.class_id = e.class_id),
+                            e.enrolled_at) AS last_active
+            FROM enrollments e
+            WHERE e.class_id = ?
+        ) a ON a.class_id = c.id
+        WHERE c.id = ? AND a.last_active < ?
+        ON CONFLICT DO NOTHING
+    ''', (now, class_id, class_id, now - timedelta(days=DISENGAGED_DAYS))).rowcount
+    return created
+
+def sweep_interventions(class_ids=None):
+    """
+    Batch job: evaluate the intervention triggers for whole classes (default:
+    all) and raise the missing alerts. One writer job per class keeps each
+    write transaction short.
+    """
+    started = time.perf_counter()
+    totals = {'low_performance': 0, 'knowledge_gap': 0, 'disengaged': 0}
+    class_ids = class_ids or all_class_ids()
+    for class_id in class_ids:
+        created = db_writer.submit(_sweep_class_interventions, class_id).result(timeout=DB_WRITER_RESULT_TIMEOUT)
+        for alert_type, count in created.items():
+            totals[alert_type] += count
+    
+    result = {
+        'classes': len(class_ids),
+        'alerts_created': totals,
+        'duration_ms': round((time.perf_counter() - started) * 1000, 1)
+    }
+    logger.info(f"Intervention sweep: {sum(totals.values())} new alerts across "
+                f"{result['classes']} classes in {result['duration_ms']} ms")
+    return result
+
+
+maintenance_scheduler.add('intervention_sweep', sweep_interventions, INTERVENTION_SWEEP_INTERVAL,
+                          quiet_only=False)
+
+@app.cli.command('intervention-sweep')
+@click.argument('class_ids', nargs=-1, type=int)
+def intervention_sweep_command(class_ids):
+    """Raise intervention alerts now (default: all classes)."""
+    print(sweep_interventions(list(class_ids)))
 
 # Login required decorator
 def login_required(f):
@@ -838,7 +3979,6 @@ def register():
         db.execute('INSERT INTO users (name, email, password_hash, role) VALUES (?, ?, ?, ?)',
                    (name, email, password_hash, role))
         db.commit()
-        db.close()
         
         return jsonify({'message': 'Registration successful'}), 201
     
@@ -856,7 +3996,6 @@ def login():
         
         db = get_db()
         user = db.execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
-        db.close()
         
         if user and check_password_hash(user['password_hash'], password):
             session['user_id'] = user['id']
@@ -894,7 +4033,6 @@ def get_teacher_classes():
         'SELECT * FROM classes WHERE teacher_id = ? ORDER BY created_at DESC',
         (session['user_id'],)
     ).fetchall()
-    db.close()
     
     return jsonify([dict(c) for c in classes])
 
@@ -916,7 +4054,6 @@ def create_class():
     )
     class_id = cursor.lastrowid
     db.commit()
-    db.close()
     
     return jsonify({'message': 'Class created', 'class_id': class_id}), 201
 
@@ -928,25 +4065,36 @@ def upload_lecture():
         return jsonify({'error': 'No file provided'}), 400
     
     file = request.files['file']
-    class_id = request.form.get('class_id')
+    class_id = request.form.get('class_id', type=int)
     
     if file.filename == '':
         return jsonify({'error': 'No file selected'}), 400
     
     if file and class_id:
+        db = get_db()
+        topic_ids = request.form.getlist('topic_ids', type=int)
+        if foreign_topic_ids(db, class_id, topic_ids):
+            return jsonify({'error': 'Topics must belong to the lecture\'s class'}), 400
+        
         filename = secure_filename(file.filename)
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         file.save(filepath)
         
-        db = get_db()
-        db.execute(
+        lecture_id = db.execute(
             'INSERT INTO lectures (class_id, filename, filepath) VALUES (?, ?, ?)',
             (class_id, filename, filepath)
+        ).lastrowid
+        db.executemany(
+            'INSERT OR IGNORE INTO lecture_topics (lecture_id, topic_id) VALUES (?, ?)',
+            [(lecture_id, topic_id) for topic_id in topic_ids]
         )
         db.commit()
-        db.close()
+        if topic_ids:
+            topic_content_index.invalidate(class_id)
+            schedule_learning_path_refresh(db, class_id)
+        schedule_recommendation_refresh(db, class_id)
         
-        return jsonify({'message': 'Lecture uploaded', 'filename': filename}), 201
+        return jsonify({'message': 'Lecture uploaded', 'filename': filename, 'lecture_id': lecture_id}), 201
     
     return jsonify({'error': 'Invalid request'}), 400
 
@@ -963,7 +4111,6 @@ def get_student_classes():
         WHERE e.student_id = ?
         ORDER BY e.enrolled_at DESC
     ''', (session['user_id'],)).fetchall()
-    db.close()
     
     return jsonify([dict(c) for c in classes])
 
@@ -980,7 +4127,6 @@ def get_available_classes():
         )
         ORDER BY c.created_at DESC
     ''', (session['user_id'],)).fetchall()
-    db.close()
     
     return jsonify([dict(c) for c in classes])
 
@@ -1005,11 +4151,10 @@ def join_class():
         return jsonify({'error': 'Already enrolled'}), 400
     
     db.execute(
-        'INSERT INTO enrollments (student_id, class_id) VALUES (?, ?)',
-        (session['user_id'], class_id)
+        'INSERT INTO enrollments (student_id, class_id, enrolled_at) VALUES (?, ?, ?)',
+        (session['user_id'], class_id, datetime.now())
     )
     db.commit()
-    db.close()
     
     return jsonify({'message': 'Enrolled successfully'}), 201
 
@@ -1022,7 +4167,6 @@ def class_view(class_id):
     class_info = db.execute('SELECT * FROM classes WHERE id = ?', (class_id,)).fetchone()
     
     if not class_info:
-        db.close()
         return "Class not found", 404
     
     # Check access
@@ -1032,13 +4176,10 @@ def class_view(class_id):
             (session['user_id'], class_id)
         ).fetchone()
         if not enrollment:
-            db.close()
             return "Access denied", 403
     elif class_info['teacher_id'] != session['user_id']:
-        db.close()
         return "Access denied", 403
     
-    db.close()
     return render_template('class_view.html', class_id=class_id)
 
 @app.route('/api/class/<int:class_id>/lectures')
@@ -1049,10 +4190,47 @@ def get_class_lectures(class_id):
         'SELECT * FROM lectures WHERE class_id = ? ORDER BY uploaded_at DESC',
         (class_id,)
     ).fetchall()
-    db.close()
     
     return jsonify([dict(l) for l in lectures])
 
+def record_lecture_view(db, user_id, lecture_id):
+    """Writer job: count a lecture open for the recommender."""
+    db.execute('''
+        INSERT INTO lecture_views (user_id, lecture_id, last_viewed_at)
+        VALUES (?, ?, ?)
+        ON CONFLICT(user_id, lecture_id) DO UPDATE SET
+            view_count = view_count + 1,
+            last_viewed_at = excluded.last_viewed_at
+    ''', (user_id, lecture_id, datetime.now()))
+
+@app.route('/lecture/<int:lecture_id>')
+@login_required
+def open_lecture(lecture_id):
+    """Serve a lecture file, recording student views."""
+    db = get_db()
+    lecture = db.execute('''
+        SELECT l.filepath, l.class_id, c.teacher_id
+        FROM lectures l
+        JOIN classes c ON c.id = l.class_id
+        WHERE l.id = ?
+    ''', (lecture_id,)).fetchone()
+    
+    if not lecture:
+        return "Lecture not found", 404
+    
+    if session['role'] == 'student':
+        enrollment = db.execute(
+            'SELECT id FROM enrollments WHERE student_id = ? AND class_id = ?',
+            (session['user_id'], lecture['class_id'])
+        ).fetchone()
+        if not enrollment:
+            return "Access denied", 403
+        db_writer.submit(record_lecture_view, session['user_id'], lecture_id).add_done_callback(log_write_failure)
+    elif lecture['teacher_id'] != session['user_id']:
+        return "Access denied", 403
+    
+    return redirect('/' + lecture['filepath'].replace(os.sep, '/'))
+
 @app.route('/api/create_quiz', methods=['POST'])
 @login_required
 @teacher_required
@@ -1082,7 +4260,7 @@ def create_quiz():
         )
     
     db.commit()
-    db.close()
+    schedule_recommendation_refresh(db, class_id)
     
     return jsonify({'message': 'Quiz created', 'quiz_id': quiz_id}), 201
 
@@ -1094,26 +4272,42 @@ def get_class_quizzes(class_id):
         'SELECT * FROM quizzes WHERE class_id = ? ORDER BY created_at DESC',
         (class_id,)
     ).fetchall()
-    db.close()
     
     return jsonify([dict(q) for q in quizzes])
 
 @app.route('/api/quiz/<int:quiz_id>')
 @login_required
 def get_quiz(quiz_id):
+    """
+    The quiz with all its questions, or with ?mode=adaptive only the first
+    question; the rest come one at a time from /api/quiz/<id>/adaptive/answer.
+    """
     db = get_db()
     
     quiz = db.execute('SELECT * FROM quizzes WHERE id = ?', (quiz_id,)).fetchone()
     if not quiz:
-        db.close()
         return jsonify({'error': 'Quiz not found'}), 404
     
+    if request.args.get('mode') == 'adaptive':
+        bank = item_bank_cache.get(db, quiz_id)
+        if bank is None:
+            return jsonify({'error': 'Quiz has no questions'}), 404
+        first = bank.next_item(0.0, set())
+        session['adaptive_quiz'] = {'quiz_id': quiz_id, 'pending': first, 'responses': []}
+        
+        quiz_data = dict(quiz)
+        quiz_data.update({
+            'mode': 'adaptive',
+            'question': _adaptive_question(db, first),
+            'max_questions': min(ADAPTIVE_QUIZ_MAX_ITEMS, len(bank.question_ids))
+        })
+        return jsonify(quiz_data)
+    
     questions = db.execute(
         'SELECT id, question_text, options FROM quiz_questions WHERE quiz_id = ?',
         (quiz_id,)
     ).fetchall()
     
-    db.close()
     
     quiz_data = dict(quiz)
     quiz_data['questions'] = [dict(q) for q in questions]
@@ -1122,12 +4316,68 @@ def get_quiz(quiz_id):
     
     return jsonify(quiz_data)
 
+def _adaptive_question(db, question_id):
+    question = dict(db.execute(
+        'SELECT id, question_text, options FROM quiz_questions WHERE id = ?',
+        (question_id,)
+    ).fetchone())
+    question['options'] = json.loads(question['options'])
+    return question
+
+@app.route('/api/quiz/<int:quiz_id>/adaptive/answer', methods=['POST'])
+@login_required
+def answer_adaptive_quiz(quiz_id):
+    """
+    Record one answer of an adaptive quiz and return the next question, the
+    one most informative at the updated ability estimate. When the estimate
+    is precise enough (or the question budget is spent) it returns
+    finished=true; /api/submit_quiz with mode='adaptive' then grades the
+    answers recorded here.
+    """
+    state = session.get('adaptive_quiz')
+    if not state or state['quiz_id'] != quiz_id or state['pending'] is None:
+        return jsonify({'error': 'No adaptive quiz in progress'}), 400
+    
+    data = request.json
+    question_id = data.get('question_id')
+    if question_id != state['pending']:
+        return jsonify({'error': 'Answer the current question first'}), 400
+    
+    db = get_db()
+    bank = item_bank_cache.get(db, quiz_id)
+    if bank is None or question_id not in bank.position:
+        return jsonify({'error': 'Quiz has no questions'}), 400
+    
+    state['responses'].append([question_id, data.get('answer')])
+    graded = [(qid, answer == bank.correct_options.get(qid)) for qid, answer in state['responses']]
+    theta, se = bank.estimate(graded)
+    
+    asked = {qid for qid, _ in state['responses']}
+    finished = (se <= ADAPTIVE_QUIZ_TARGET_SE
+                or len(asked) >= ADAPTIVE_QUIZ_MAX_ITEMS
+                or len(asked) == len(bank.question_ids))
+    next_id = None if finished else bank.next_item(theta, asked)
+    state['pending'] = next_id
+    session['adaptive_quiz'] = state
+    
+    response = {
+        'finished': next_id is None,
+        'questions_answered': len(asked),
+        'ability': {'theta': round(theta, 3), 'standard_error': round(se, 3)}
+    }
+    if next_id is None:
+        response['answers'] = {str(qid): answer for qid, answer in state['responses']}
+    else:
+        response['question'] = _adaptive_question(db, next_id)
+    return jsonify(response)
+
 @app.route('/api/submit_quiz', methods=['POST'])
 @login_required
 def submit_quiz():
     """
     ENHANCED QUIZ SUBMISSION with Adaptive Learning Features
-    Now triggers gap analysis, recommendations, and intervention alerts!
+    Now triggers gap analysis and recommendations; intervention alerts
+    come from the periodic intervention_sweep job.
     """
     data = request.json
     quiz_id = data.get('quiz_id')
@@ -1145,17 +4395,40 @@ def submit_quiz():
         (quiz_id,)
     ).fetchall()
     
+    # Adaptive quizzes are graded on the answers recorded in the session as
+    # the student went, not on what the client sends
+    if data.get('mode') == 'adaptive':
+        state = session.get('adaptive_quiz')
+        if (not state or str(state['quiz_id']) != str(quiz_id)
+                or state['pending'] is not None):
+            return jsonify({'error': 'No finished adaptive quiz to submit'}), 400
+        answers = {str(qid): answer for qid, answer in state['responses']}
+        questions = [q for q in questions if str(q['id']) in answers]
+        session.pop('adaptive_quiz', None)
+    
+    if not questions:
+        return jsonify({'error': 'No questions to grade'}), 400
+    
     score = 0
     total = len(questions)
+    graded = []  # (question_id, chosen_option, is_correct)
     
     for q in questions:
-        if str(q['id']) in answers and answers[str(q['id'])] == q['correct_option_index']:
+        chosen = answers.get(str(q['id']))
+        is_correct = chosen is not None and chosen == q['correct_option_index']
+        if is_correct:
             score += 1
-    
-    # Save submission
-    db.execute(
-        'INSERT INTO quiz_submissions (quiz_id, student_id, score, total, duration_seconds) VALUES (?, ?, ?, ?, ?)',
-        (quiz_id, session['user_id'], score, total, duration)
+        graded.append((q['id'], chosen, int(is_correct)))
+    
+    # Save submission and the per-question answers
+    submission_id = db.execute(
+        'INSERT INTO quiz_submissions (quiz_id, student_id, score, total, duration_seconds, submitted_at) VALUES (?, ?, ?, ?, ?, ?)',
+        (quiz_id, session['user_id'], score, total, duration, datetime.now())
+    ).lastrowid
+    db.executemany(
+        'INSERT INTO quiz_answers (submission_id, student_id, question_id, chosen_option, is_correct) VALUES (?, ?, ?, ?, ?)',
+        [(submission_id, session['user_id'], question_id, chosen, is_correct)
+         for question_id, chosen, is_correct in graded]
     )
     
     # Get class_id for metrics
@@ -1163,20 +4436,25 @@ def submit_quiz():
     class_id = quiz['class_id']
     
     # Update student metrics
-    update_student_metrics(db, session['user_id'], class_id)
+    update_student_metrics(db, session['user_id'], class_id, score=score, possible=total,
+                           duration=duration, submissions=1)
     
     # 🚀 ADAPTIVE LEARNING FEATURES
     # 1. Analyze knowledge gaps
-    gaps = analyze_knowledge_gaps(db, session['user_id'], class_id)
-    
-    # 2. Generate personalized recommendations
-    recommendations = generate_adaptive_recommendations(db, session['user_id'], class_id)
-    
-    # 3. Check for teacher intervention alerts
-    alerts = check_and_create_intervention_alerts(db, session['user_id'], class_id)
+    gaps, gap_deltas = analyze_knowledge_gaps(db, session['user_id'], class_id, submission_id)
+    mastery = update_topic_mastery(db, session['user_id'], submission_id, duration, total)
     
     db.commit()
-    db.close()
+    class_mastery_cache.apply_submission(class_id, session['user_id'], submission_id, gap_deltas)
+    
+    # 2. Regenerate personalized recommendations and the learning path in the background
+    schedule_recommendation_refresh(db, class_id, [session['user_id']])
+    db_writer.submit(
+        refresh_learning_path, session['user_id'], class_id,
+        {topic_id: state['mastery'] * 100 for topic_id, state in mastery.items()}
+    ).add_done_callback(log_write_failure)
+    for topic_id, state in mastery.items():
+        review_notifier.schedule(session['user_id'], topic_id, state['next_review_at'])
     
     # Build enhanced response
     response = {
@@ -1187,39 +4465,24 @@ def submit_quiz():
         'adaptive_insights': {
             'knowledge_gaps_detected': len(gaps),
             'gaps': gaps[:3],  # Top 3 gaps
-            'recommendations_generated': len(recommendations),
-            'recommendations': recommendations[:5],  # Top 5 recommendations
-            'teacher_alerts_triggered': len(alerts) if alerts else 0
+            'recommendations_refresh_queued': True  # served by /api/recommendations
         }
     }
     
     return jsonify(response), 200
 
-def update_student_metrics(db, student_id, class_id):
-    # Get all quiz submissions for this student in this class
-    submissions = db.execute('''
-        SELECT qs.score, qs.total, qs.duration_seconds
-        FROM quiz_submissions qs
-        JOIN quizzes q ON qs.quiz_id = q.id
-        WHERE qs.student_id = ? AND q.class_id = ?
-    ''', (student_id, class_id)).fetchall()
-    
-    if not submissions:
-        return
+def pace_metrics(total_score, total_possible, total_duration, submission_count, chat_count):
+    """
+    Derive the student_metrics scores from the running sums.
     
-    # Calculate metrics
-    total_score = sum(s['score'] for s in submissions)
-    total_possible = sum(s['total'] for s in submissions)
+    Returns: (score_avg, avg_time, pace_score, rating)
+    """
     accuracy = total_score / total_possible if total_possible > 0 else 0
     
-    avg_time = sum(s['duration_seconds'] for s in submissions) / len(submissions)
+    avg_time = total_duration / submission_count if submission_count > 0 else 0
     speed = min(1, 60 / (avg_time + 1))
     
-    # Get chat engagement
-    chat_count = db.execute(
-        'SELECT COUNT(*) as cnt FROM chat_messages WHERE user_id = ? AND class_id = ?',
-        (student_id, class_id)
-    ).fetchone()['cnt']
+    # Chat engagement
     engagement = min(1, chat_count / 20)
     
     # Calculate pace score (0-10)
@@ -1228,12 +4491,86 @@ def update_student_metrics(db, student_id, class_id):
     # Calculate rating (0-10)
     rating = min(10, pace_score)
     
+    return round(accuracy * 100, 1), round(avg_time, 1), pace_score, rating
+
+def update_student_metrics(db, student_id, class_id, score=0, possible=0, duration=0,
+                           submissions=0, chats=0):
+    """
+    Add one event's deltas to the student's running sums and re-derive the
+    pace score: O(1) regardless of history. Called from submit_quiz (inside
+    its write transaction) and from the chat writer job.
+    
+    A student gets a metrics row with their first submission; chat before
+    that is counted once, when the row is created.
+    """
+    sums = db.execute('''
+        SELECT total_score, total_possible, total_duration, submission_count, chat_count
+        FROM student_metrics
+        WHERE user_id = ? AND class_id = ?
+    ''', (student_id, class_id)).fetchone()
+    
+    if sums is None:
+        if not submissions:
+            return
+        chat_count = db.execute(
+            'SELECT COUNT(*) as cnt FROM chat_messages WHERE user_id = ? AND class_id = ?',
+            (student_id, class_id)
+        ).fetchone()['cnt']
+        sums = (0, 0, 0, 0, chat_count)
+        chats = 0
+    
+    totals = (
+        sums[0] + score,
+        sums[1] + possible,
+        sums[2] + (duration or 0),
+        sums[3] + submissions,
+        sums[4] + chats
+    )
+    
     # Update or insert metrics
     db.execute('''
         INSERT OR REPLACE INTO student_metrics
-        (user_id, class_id, score_avg, avg_time, pace_score, rating)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (student_id, class_id, round(accuracy * 100, 1), round(avg_time, 1), pace_score, rating))
+        (user_id, class_id, score_avg, avg_time, pace_score, rating,
+         total_score, total_possible, total_duration, submission_count, chat_count, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (student_id, class_id, *pace_metrics(*totals), *totals, datetime.now()))
+
+def rebuild_student_metrics(db):
+    """Recompute every student_metrics row from quiz_submissions and chat_messages."""
+    aggregates = db.execute('''
+        SELECT qs.student_id, q.class_id,
+               SUM(qs.score) AS total_score, SUM(qs.total) AS total_possible,
+               SUM(COALESCE(qs.duration_seconds, 0)) AS total_duration,
+               COUNT(*) AS submission_count,
+               (SELECT COUNT(*) FROM chat_messages cm
+                WHERE cm.user_id = qs.student_id AND cm.class_id = q.class_id) AS chat_count
+        FROM quiz_submissions qs
+        JOIN quizzes q ON qs.quiz_id = q.id
+        GROUP BY qs.student_id, q.class_id
+    ''').fetchall()
+    
+    now = datetime.now()
+    rows = []
+    for row in aggregates:
+        totals = tuple(row)[2:]
+        rows.append((row['student_id'], row['class_id'], *pace_metrics(*totals), *totals, now))
+    
+    db.execute('DELETE FROM student_metrics')
+    db.executemany('''
+        INSERT INTO student_metrics
+        (user_id, class_id, score_avg, avg_time, pace_score, rating,
+         total_score, total_possible, total_duration, submission_count, chat_count, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    logger.info(f"Rebuilt student metrics for {len(rows)} student-class pairs")
+    return len(rows)
+
+@app.cli.command('rebuild-student-metrics')
+def rebuild_student_metrics_command():
+    """Recompute student_metrics running sums from scratch."""
+    with get_db_context() as db:
+        count = rebuild_student_metrics(db)
+    print(f"Rebuilt metrics for {count} student-class pairs")
 
 @app.route('/api/analytics')
 @login_required
@@ -1249,7 +4586,6 @@ def get_analytics():
             WHERE sm.user_id = ?
         ''', (session['user_id'],)).fetchall()
         
-        db.close()
         return jsonify([dict(m) for m in metrics])
     
     else:
@@ -1275,7 +4611,6 @@ def get_analytics():
                 ORDER BY sm.rating DESC
             ''', (session['user_id'],)).fetchall()
         
-        db.close()
         return jsonify([dict(m) for m in metrics])
 
 @app.route('/api/chatbot', methods=['POST'])
@@ -1302,13 +4637,11 @@ def chatbot():
     # Render markdown with math support
     rendered_answer = render_markdown_with_math(answer)
     
-    # Save to database
-    db.execute(
+    # Log the query through the writer queue; the answer doesn't wait for it
+    db_writer.execute(
         'INSERT INTO ai_queries (user_id, prompt, response) VALUES (?, ?, ?)',
         (session['user_id'], prompt, answer)
-    )
-    db.commit()
-    db.close()
+    ).add_done_callback(log_write_failure)
     
     return jsonify({
         'answer': rendered_answer, 
@@ -1356,7 +4689,6 @@ def send_password_reset_otp():
         (email, otp, expires_at)
     )
     db.commit()
-    db.close()
     
     # Send email
     email_sent = send_otp_email(email, otp)
@@ -1399,7 +4731,6 @@ def verify_and_reset_password():
     ''', (email, otp, datetime.now())).fetchone()
     
     if not otp_record:
-        db.close()
         return jsonify({'error': 'Invalid or expired OTP'}), 400
     
     # Update password
@@ -1410,7 +4741,6 @@ def verify_and_reset_password():
     db.execute('UPDATE password_reset_otp SET used = 1 WHERE id = ?', (otp_record['id'],))
     
     db.commit()
-    db.close()
     
     logger.info(f"Password reset successful for {email}")
     return jsonify({'message': 'Password reset successful'}), 200
@@ -1426,13 +4756,10 @@ def submit_feedback():
     if not rating or rating not in [1, 2, 3, 4, 5]:
         return jsonify({'error': 'Valid rating (1-5) is required'}), 400
     
-    db = get_db()
-    db.execute(
+    db_writer.execute(
         'INSERT INTO feedback (user_id, rating, message) VALUES (?, ?, ?)',
         (session['user_id'], rating, message)
-    )
-    db.commit()
-    db.close()
+    ).result(timeout=DB_WRITER_RESULT_TIMEOUT)
     
     logger.info(f"Feedback submitted by user {session['user_id']}: {rating} stars")
     return jsonify({'message': 'Thank you for your feedback!'}), 201
@@ -1449,7 +4776,6 @@ def get_all_feedback():
         JOIN users u ON f.user_id = u.id
         ORDER BY f.created_at DESC
     ''').fetchall()
-    db.close()
     
     return jsonify([dict(f) for f in feedback_list])
 
@@ -1472,7 +4798,6 @@ def start_live_class():
     ).fetchone()
     
     if not class_info:
-        db.close()
         return jsonify({'error': 'Class not found or unauthorized'}), 403
     
     # Generate unique room name
@@ -1485,7 +4810,6 @@ def start_live_class():
     ).fetchone()
     
     if existing_session:
-        db.close()
         return jsonify({'error': 'A live session is already active for this class'}), 400
     
     # Create new session
@@ -1494,7 +4818,6 @@ def start_live_class():
         VALUES (?, ?, ?)
     ''', (class_id, room_name, session['user_id']))
     db.commit()
-    db.close()
     
     logger.info(f"Live class started: {room_name} by user {session['user_id']}")
     
@@ -1524,7 +4847,6 @@ def join_live_class(class_id):
         ''', (class_id, session['user_id'])).fetchone()
     
     if not class_info:
-        db.close()
         return jsonify({'error': 'Class not found or no access'}), 403
     
     # Get active session
@@ -1534,7 +4856,6 @@ def join_live_class(class_id):
         ORDER BY started_at DESC LIMIT 1
     ''', (class_id,)).fetchone()
     
-    db.close()
     
     if not live_session:
         return jsonify({'error': 'No active live session'}), 404
@@ -1566,12 +4887,23 @@ def end_live_class():
     ''', (datetime.now(), class_id, session['user_id']))
     
     db.commit()
-    db.close()
     
     logger.info(f"Live class ended for class {class_id}")
     return jsonify({'message': 'Live class ended'}), 200
 
 # Socket.IO events for real-time chat
+@socketio.on('connect')
+def on_connect():
+    # Students get their review reminders in a personal room
+    if session.get('role') == 'student':
+        join_room(f"user_{session['user_id']}")
+        review_notifier.connect(session['user_id'])
+
+@socketio.on('disconnect')
+def on_disconnect():
+    if session.get('role') == 'student':
+        review_notifier.disconnect(session['user_id'])
+
 @socketio.on('join')
 def on_join(data):
     room = str(data['class_id'])
@@ -1590,19 +4922,24 @@ def on_leave(data):
         'user': session['name']
     }, room=room)
 
+def save_chat_message(db, class_id, user_id, message):
+    """Writer job: store a chat message and count it toward engagement."""
+    message_id = db.execute(
+        'INSERT INTO chat_messages (class_id, user_id, message) VALUES (?, ?, ?)',
+        (class_id, user_id, message)
+    ).lastrowid
+    update_student_metrics(db, user_id, class_id, chats=1)
+    return message_id
+
 @socketio.on('message')
 def handle_message(data):
     room = str(data['class_id'])
     message = data['message']
     
-    # Save message to database
-    db = get_db()
-    db.execute(
-        'INSERT INTO chat_messages (class_id, user_id, message) VALUES (?, ?, ?)',
-        (data['class_id'], session['user_id'], message)
-    )
-    db.commit()
-    db.close()
+    # Save message through the writer queue (group commit with other chats)
+    db_writer.submit(
+        save_chat_message, data['class_id'], session['user_id'], message
+    ).result(timeout=DB_WRITER_RESULT_TIMEOUT)
     
     # Broadcast message
     emit('message', {
@@ -1622,7 +4959,6 @@ def get_class_messages(class_id):
         WHERE cm.class_id = ?
         ORDER BY cm.timestamp ASC
     ''', (class_id,)).fetchall()
-    db.close()
     
     return jsonify([dict(m) for m in messages])
 
@@ -1635,24 +4971,12 @@ def get_class_messages(class_id):
 def get_recommendations():
     """
     Get personalized content recommendations for the logged-in student.
-    Based on knowledge gaps and learning patterns.
+    Based on knowledge gaps and learning patterns; generated in the
+    background after quiz submissions and content changes, so this is a
+    read only. generated_at says when they were last refreshed.
     """
     db = get_db()
     
-    # Get all enrolled classes
-    classes = db.execute('''
-        SELECT DISTINCT class_id FROM enrollments WHERE student_id = ?
-    ''', (session['user_id'],)).fetchall()
-    
-    all_recommendations = []
-    
-    for cls in classes:
-        class_id = cls['class_id']
-        # Generate fresh recommendations
-        recs = generate_adaptive_recommendations(db, session['user_id'], class_id)
-        all_recommendations.extend(recs)
-    
-    # Also get stored recommendations
     stored_recs = db.execute('''
         SELECT r.*, 
                CASE 
@@ -1668,11 +4992,14 @@ def get_recommendations():
         LIMIT 10
     ''', (session['user_id'],)).fetchall()
     
-    db.close()
+    refreshed = db.execute(
+        'SELECT MAX(refreshed_at) as refreshed_at FROM recommendation_refresh WHERE user_id = ?',
+        (session['user_id'],)
+    ).fetchone()
     
     return jsonify({
         'recommendations': [dict(r) for r in stored_recs],
-        'freshly_generated': all_recommendations
+        'generated_at': refreshed['refreshed_at']
     })
 
 @app.route('/api/knowledge-gaps')
@@ -1693,16 +5020,79 @@ def get_knowledge_gaps():
         ORDER BY kg.mastery_level ASC
     ''', (session['user_id'],)).fetchall()
     
-    db.close()
     
     return jsonify([dict(g) for g in gaps])
 
+@app.route('/api/learning-path/<int:class_id>')
+@login_required
+def get_learning_path(class_id):
+    """
+    The student's learning path for a class: weak topics after their unmet
+    prerequisites, each with the content that covers it. Served as stored;
+    paths are kept current in the background as mastery changes.
+    """
+    db = get_db()
+    
+    row = db.execute(
+        'SELECT path_data, last_updated FROM learning_paths WHERE user_id = ? AND class_id = ?',
+        (session['user_id'], class_id)
+    ).fetchone()
+    
+    if row is None:
+        enrolled = db.execute(
+            'SELECT id FROM enrollments WHERE student_id = ? AND class_id = ?',
+            (session['user_id'], class_id)
+        ).fetchone()
+        if not enrolled:
+            return jsonify({'error': 'Not enrolled in this class'}), 403
+        # First view: build it in the background
+        db_writer.submit(refresh_learning_path, session['user_id'], class_id).add_done_callback(log_write_failure)
+        return jsonify({'class_id': class_id, 'steps': [], 'completed': [], 'pending': True})
+    
+    path = json.loads(row['path_data'])
+    path['class_id'] = class_id
+    path['last_updated'] = row['last_updated']
+    return jsonify(path)
+
+@app.route('/api/reviews/due')
+@login_required
+def get_due_reviews():
+    """
+    Topics due for spaced-repetition review now (SM-2, scheduled on each
+    quiz that covers the topic), most overdue first, plus when the next one
+    comes due. Both are range reads on the (user_id, next_review_at) index.
+    """
+    db = get_db()
+    now = datetime.now()
+    
+    due = db.execute('''
+        SELECT tm.topic_id, t.topic_name, t.class_id, tm.next_review_at,
+               tm.review_interval, tm.review_count, tm.mastery_score
+        FROM topic_mastery tm
+        JOIN topics t ON t.id = tm.topic_id
+        WHERE tm.user_id = ? AND tm.next_review_at <= ?
+        ORDER BY tm.next_review_at
+        LIMIT 50
+    ''', (session['user_id'], now)).fetchall()
+    upcoming = db.execute('''
+        SELECT MIN(next_review_at) as next_review_at
+        FROM topic_mastery
+        WHERE user_id = ? AND next_review_at > ?
+    ''', (session['user_id'], now)).fetchone()
+    
+    return jsonify({
+        'due': [dict(row) for row in due],
+        'next_review_at': upcoming['next_review_at']
+    })
+
 @app.route('/api/topic-mastery/<int:class_id>')
 @login_required
 def get_topic_mastery(class_id):
     """
     Get detailed topic-wise mastery for a specific class.
     Shows student's strength and weakness visualization data.
+    bkt_mastery_score (0-100) is the knowledge-tracing estimate, which
+    weights recent answers; mastery_level is the raw correct ratio.
     """
     db = get_db()
     
@@ -1711,14 +5101,16 @@ def get_topic_mastery(class_id):
         SELECT t.id, t.topic_name,
                COALESCE(kg.mastery_level, 0) as mastery_level,
                COALESCE(kg.questions_attempted, 0) as questions_attempted,
-               COALESCE(kg.questions_correct, 0) as questions_correct
+               COALESCE(kg.questions_correct, 0) as questions_correct,
+               tm.mastery_score as bkt_mastery_score,
+               tm.confidence_level
         FROM topics t
         LEFT JOIN knowledge_gaps kg ON t.id = kg.topic_id AND kg.user_id = ?
+        LEFT JOIN topic_mastery tm ON t.id = tm.topic_id AND tm.user_id = ?
         WHERE t.class_id = ?
         ORDER BY t.topic_name
-    ''', (session['user_id'], class_id)).fetchall()
+    ''', (session['user_id'], session['user_id'], class_id)).fetchall()
     
-    db.close()
     
     # Calculate mastery categories
     mastery_data = {
@@ -1747,6 +5139,64 @@ def get_topic_mastery(class_id):
         'mastery_breakdown': mastery_data
     })
 
+@app.route('/api/teacher/class/<int:class_id>/mastery-matrix')
+@login_required
+@teacher_required
+def get_class_mastery_matrix(class_id):
+    """
+    Class-wide topic mastery for the teacher: per-topic mean and quartiles,
+    and the students who are struggling. Add ?include=matrix for the full
+    students x topics matrix (mastery 0-1, null where not attempted).
+    """
+    db = get_db()
+    
+    cls = db.execute(
+        'SELECT id FROM classes WHERE id = ? AND teacher_id = ?',
+        (class_id, session['user_id'])
+    ).fetchone()
+    if not cls:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    result, cached = class_mastery_cache.get(db, class_id)
+    
+    response = {k: v for k, v in result.items() if k != '_arrays'}
+    response['cached'] = cached
+    if request.args.get('include') == 'matrix':
+        student_ids, topic_ids, mastery = result['_arrays']
+        response['matrix'] = {
+            'student_ids': student_ids.tolist(),
+            'topic_ids': topic_ids.tolist(),
+            'values': np.where(np.isnan(mastery), None, mastery.round(3)).tolist()
+        }
+    
+    return jsonify(response)
+
+@app.route('/api/teacher/quiz/<int:quiz_id>/item-analysis')
+@login_required
+@teacher_required
+def get_quiz_item_analysis(quiz_id):
+    """
+    Classical item analysis for a quiz: per-question p-value (share correct),
+    point-biserial discrimination (raw and with the item removed from the
+    total), distractor selection frequencies, and KR-20 reliability.
+    """
+    db = get_db()
+    
+    quiz = db.execute('''
+        SELECT q.id
+        FROM quizzes q
+        JOIN classes c ON c.id = q.class_id
+        WHERE q.id = ? AND c.teacher_id = ?
+    ''', (quiz_id, session['user_id'])).fetchone()
+    if not quiz:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    report = item_analysis_cache.get(db, quiz_id)
+    if report is None:
+        return jsonify({'error': 'Quiz has no questions'}), 404
+    
+    return jsonify(report)
+
 @app.route('/api/teacher/interventions')
 @login_required
 @teacher_required
@@ -1766,7 +5216,6 @@ def get_teacher_interventions():
         ORDER BY ti.created_at DESC
     ''', (session['user_id'],)).fetchall()
     
-    db.close()
     
     return jsonify([dict(i) for i in interventions])
 
@@ -1784,7 +5233,6 @@ def resolve_intervention(intervention_id):
     ''', (datetime.now(), intervention_id, session['user_id']))
     
     db.commit()
-    db.close()
     
     return jsonify({'message': 'Intervention marked as resolved'})
 
@@ -1818,8 +5266,8 @@ def manage_topics():
             (class_id, topic_name, description)
         )
         db.commit()
+        class_mastery_cache.invalidate(class_id)
         topic_id = db.execute('SELECT last_insert_rowid()').fetchone()[0]
-        db.close()
         
         return jsonify({'message': 'Topic created', 'topic_id': topic_id}), 201
     
@@ -1833,7 +5281,6 @@ def manage_topics():
             ORDER BY c.title, t.topic_name
         ''', (session['user_id'],)).fetchall()
         
-        db.close()
         return jsonify([dict(t) for t in topics])
 
 @app.route('/api/teacher/assign-question-topics', methods=['POST'])
@@ -1846,27 +5293,143 @@ def assign_question_topics():
     """
     data = request.json
     question_id = data.get('question_id')
-    topic_ids = data.get('topic_ids', [])
+    topic_ids = [int(t) for t in data.get('topic_ids', [])]
     
     if not question_id or not topic_ids:
         return jsonify({'error': 'question_id and topic_ids required'}), 400
     
     db = get_db()
     
-    # Remove existing assignments
+    quiz = db.execute('''
+        SELECT q.class_id FROM quiz_questions qq
+        JOIN quizzes q ON q.id = qq.quiz_id
+        JOIN classes c ON c.id = q.class_id
+        WHERE qq.id = ? AND c.teacher_id = ?
+    ''', (question_id, session['user_id'])).fetchone()
+    if not quiz:
+        return jsonify({'error': 'Unauthorized'}), 403
+    if foreign_topic_ids(db, quiz['class_id'], topic_ids):
+        return jsonify({'error': 'Topics must belong to the question\'s class'}), 400
+    
+    # Replace the existing assignments
     db.execute('DELETE FROM question_topics WHERE question_id = ?', (question_id,))
+    db.executemany(
+        'INSERT OR IGNORE INTO question_topics (question_id, topic_id) VALUES (?, ?)',
+        [(question_id, topic_id) for topic_id in topic_ids]
+    )
+    db.commit()
     
-    # Add new assignments
-    for topic_id in topic_ids:
-        db.execute(
-            'INSERT INTO question_topics (question_id, topic_id) VALUES (?, ?)',
-            (question_id, topic_id)
-        )
+    class_mastery_cache.invalidate(quiz['class_id'])
+    topic_content_index.invalidate(quiz['class_id'])
+    schedule_recommendation_refresh(db, quiz['class_id'])
+    schedule_learning_path_refresh(db, quiz['class_id'])
+    
+    return jsonify({'message': 'Topics assigned to question successfully'})
+
+@app.route('/api/teacher/assign-lecture-topics', methods=['POST'])
+@login_required
+@teacher_required
+def assign_lecture_topics():
+    """
+    Assign topics to a lecture so gap-driven recommendations can point
+    students at the lectures covering their weak topics.
+    """
+    data = request.json
+    lecture_id = data.get('lecture_id')
+    topic_ids = [int(t) for t in data.get('topic_ids', [])]
+    
+    if not lecture_id:
+        return jsonify({'error': 'lecture_id required'}), 400
+    
+    db = get_db()
     
+    lecture = db.execute('''
+        SELECT l.class_id
+        FROM lectures l
+        JOIN classes c ON c.id = l.class_id
+        WHERE l.id = ? AND c.teacher_id = ?
+    ''', (lecture_id, session['user_id'])).fetchone()
+    if not lecture:
+        return jsonify({'error': 'Unauthorized'}), 403
+    if foreign_topic_ids(db, lecture['class_id'], topic_ids):
+        return jsonify({'error': 'Topics must belong to the lecture\'s class'}), 400
+    
+    # Replace the existing assignments
+    db.execute('DELETE FROM lecture_topics WHERE lecture_id = ?', (lecture_id,))
+    db.executemany(
+        'INSERT OR IGNORE INTO lecture_topics (lecture_id, topic_id) VALUES (?, ?)',
+        [(lecture_id, topic_id) for topic_id in topic_ids]
+    )
     db.commit()
-    db.close()
     
-    return jsonify({'message': 'Topics assigned to question successfully'})
+    topic_content_index.invalidate(lecture['class_id'])
+    schedule_recommendation_refresh(db, lecture['class_id'])
+    schedule_learning_path_refresh(db, lecture['class_id'])
+    
+    return jsonify({'message': 'Topics assigned to lecture successfully'})
+
+@app.route('/api/teacher/topic-prerequisites', methods=['GET', 'POST'])
+@login_required
+@teacher_required
+def manage_topic_prerequisites():
+    """
+    GET ?class_id=: the class's prerequisite edges
+    POST: replace a topic's prerequisites ({topic_id, prerequisite_ids});
+    edges that would create a cycle are rejected
+    """
+    db = get_db()
+    
+    if request.method == 'GET':
+        class_id = request.args.get('class_id', type=int)
+        cls = db.execute(
+            'SELECT id FROM classes WHERE id = ? AND teacher_id = ?',
+            (class_id, session['user_id'])
+        ).fetchone()
+        if not cls:
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        graph = topic_graph_cache.get(db, class_id)
+        return jsonify({
+            'class_id': class_id,
+            'topics': [{
+                'topic_id': topic_id,
+                'topic_name': graph.names[topic_id],
+                'prerequisite_ids': sorted(graph.prerequisites[topic_id])
+            } for topic_id in graph.order]
+        })
+    
+    data = request.json
+    topic_id = data.get('topic_id')
+    prerequisite_ids = [int(p) for p in data.get('prerequisite_ids', [])]
+    
+    topic = db.execute('''
+        SELECT t.id, t.class_id
+        FROM topics t
+        JOIN classes c ON c.id = t.class_id
+        WHERE t.id = ? AND c.teacher_id = ?
+    ''', (topic_id, session['user_id'])).fetchone()
+    if not topic:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    topic_id, class_id = topic['id'], topic['class_id']
+    topic_graph_cache.invalidate(class_id)
+    graph = topic_graph_cache.get(db, class_id)
+    if any(p not in graph.names for p in prerequisite_ids):
+        return jsonify({'error': 'Prerequisites must be topics of the same class'}), 400
+    if graph.creates_cycle(topic_id, prerequisite_ids):
+        return jsonify({'error': 'These prerequisites would create a cycle'}), 400
+    
+    db.execute('DELETE FROM topic_prerequisites WHERE topic_id = ?', (topic_id,))
+    db.executemany(
+        'INSERT INTO topic_prerequisites (topic_id, prerequisite_id) VALUES (?, ?)',
+        [(topic_id, p) for p in set(prerequisite_ids)]
+    )
+    db.commit()
+    
+    topic_graph_cache.invalidate(class_id)
+    schedule_learning_path_refresh(db, class_id)
+    
+    return jsonify({'message': 'Prerequisites updated'})
 
 @app.route('/api/mark-recommendation-complete/<int:rec_id>', methods=['POST'])
 @login_required
@@ -1874,14 +5437,14 @@ def mark_recommendation_complete(rec_id):
     """Mark a recommendation as completed by the student."""
     db = get_db()
     
+    # REPLACE drops an older completed copy of the same item (unique index)
     db.execute('''
-        UPDATE recommendations
+        UPDATE OR REPLACE recommendations
         SET is_completed = 1
         WHERE id = ? AND user_id = ?
     ''', (rec_id, session['user_id']))
     
     db.commit()
-    db.close()
     
     return jsonify({'message': 'Recommendation marked as complete'})
 
@@ -1892,64 +5455,92 @@ def mark_recommendation_complete(rec_id):
 @app.route('/api/health')
 def health_check():
     """
-    Health check endpoint to verify application and database status.
-    
+    Liveness check: answers without touching the database, so load balancers
+    can probe it as often as they like.
+
     Returns JSON with:
     - Application status
-    - Database connection status
-    - Configuration details (non-sensitive)
+    - The last database health result (from /api/health/ready or /api/db/status)
+    """
+    return jsonify({
+        'status': 'ok',
+        'application': 'Education Platform',
+        'database': db_stats.health(refresh=False),
+        'timestamp': datetime.now().isoformat()
+    }), 200
+
+@app.route('/api/health/ready')
+def readiness_check():
+    """
+    Readiness check: runs a real query against the database and checks the
+    write queue. Returns 503 when the worker can't serve requests.
     """
     try:
         db_health = check_db_health()
+        writer = db_writer.stats()
+        ready = db_health['status'] == 'healthy' and writer['queue_depth'] < DB_WRITER_QUEUE_SIZE
         
         return jsonify({
-            'status': 'ok',
+            'status': 'ok' if ready else 'unavailable',
             'application': 'Education Platform',
             'database': db_health,
+            'write_queue': writer,
             'timestamp': datetime.now().isoformat()
-        }), 200
+        }), 200 if ready else 503
         
     except Exception as e:
-        logger.error(f"Health check failed: {e}")
+        logger.error(f"Readiness check failed: {e}")
         return jsonify({
             'status': 'error',
             'error': str(e),
             'timestamp': datetime.now().isoformat()
-        }), 500
+        }), 503
 
 @app.route('/api/db/status')
+@login_required
+@teacher_required
 def database_status():
     """
     Detailed database status endpoint for debugging.
-    Only accessible in development mode.
+    Teachers only: it exposes pool, WAL, write-queue and schema internals.
     """
     try:
-        health = check_db_health()
-        
-        # Additional database statistics
-        db = get_db()
+        health = db_stats.health()
         
-        # Get row counts for main tables
-        tables_stats = {}
-        main_tables = ['users', 'classes', 'enrollments', 'lectures', 
-                      'quizzes', 'quiz_submissions', 'chat_messages']
+        # Row counts for the main tables, from the trigger-maintained snapshot
+        tables_stats = db_stats.table_counts()
         
-        for table in main_tables:
-            try:
-                cursor = db.execute(f"SELECT COUNT(*) as count FROM {table}")
-                count = cursor.fetchone()['count']
-                tables_stats[table] = count
-            except sqlite3.Error:
-                tables_stats[table] = 'N/A'
+        db = get_db()
         
-        db.close()
+        with get_db_context() as write_db:
+            effective_write = read_pragma_profile(write_db)
+        pragma_profile = {
+            'name': DB_PROFILE,
+            'configured': DB_PRAGMAS,
+            'effective': effective_write,
+            'read_pool': {
+                'configured': DB_READ_PRAGMAS,
+                'effective': read_pragma_profile(db, DB_READ_PRAGMAS)
+            }
+        }
         
         return jsonify({
             'health': health,
             'table_statistics': tables_stats,
+            'table_statistics_snapshot': db_stats.snapshot_info(),
+            'pragma_profile': pragma_profile,
+            'wal_checkpoint': wal_checkpointer.stats(),
+            'maintenance': maintenance_scheduler.stats(),
+            'connection_pool': db_pool.stats(),
+            'read_pool': db_read_pool.stats(),
+            'write_queue': db_writer.stats(),
+            'slow_queries': slow_query_log.stats(),
+            'backups': backup_service.stats(),
             'configuration': {
                 'database_path': DATABASE_PATH,
-                'timeout': DATABASE_TIMEOUT
+                'timeout': DATABASE_TIMEOUT,
+                'pool_size': DB_POOL_SIZE,
+                'pool_timeout': DB_POOL_TIMEOUT
             }
         }), 200
         
@@ -1960,6 +5551,19 @@ def database_status():
             'error': str(e)
         }), 500
 
+@app.route('/api/db/slow-queries')
+@login_required
+@teacher_required
+def slow_queries():
+    """
+    Recent slow statements with their query plans (teachers only).
+    Newest first; the buffer keeps the last DB_SLOW_QUERY_LOG_SIZE entries.
+    """
+    return jsonify({
+        **slow_query_log.stats(),
+        'entries': slow_query_log.entries()
+    })
+
 # ============================================================================
 # APPLICATION STARTUP
 # ============================================================================
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Query Plan Check
+Runs EXPLAIN QUERY PLAN on every SQL statement in app.py against a fresh
+copy of schema.sql and fails if any statement still needs a full table scan.
+
+Usage:
+    python check_query_plans.py            # check app.py
+    python check_query_plans.py -v         # also print every plan
+"""
+
+import ast
+import os
+import re
+import sqlite3
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(BASE_DIR, 'app.py')
+SCHEMA_PATH = os.path.join(BASE_DIR, 'schema.sql')
+
+# Statements that read a whole (tiny) table on purpose
+ALLOWED_FULL_SCANS = {
+    "SELECT COUNT(*) as count FROM sqlite_master WHERE type='table'",
+    "SELECT COUNT(*) FROM sqlite_master",  # opens the backup's read transaction
+    "SELECT table_name, row_count FROM table_row_counts",  # one row per counted table
+}
+
+# "SCAN t" without an index is a full table scan; "SCAN t USING INDEX" walks
+# an index in order and "SEARCH" is an index lookup. Scanning a CTE's
+# materialized result is not a table scan
+FULL_SCAN_RE = re.compile(r'^SCAN (?!CONSTANT ROW)(\w+)\b(?! USING (?:COVERING )?INDEX)(?! USING INTEGER PRIMARY KEY)')
+CTE_NAME_RE = re.compile(r'(?:\bWITH(?: RECURSIVE)?|,)\s*(\w+)\s*(?:\([^()]*\))?\s*AS\s*\(', re.IGNORECASE)
+
+
+def extract_statements(path):
+    """Find every literal SQL string passed to execute()/executemany()."""
+    with open(path, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=path)
+
+    statements = []
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)):
+            continue
+        if node.func.attr not in ('execute', 'executemany') or not node.args:
+            continue
+        arg = node.args[0]
+        if isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+            statements.append((node.lineno, arg.value))
+        elif isinstance(arg, ast.Name):
+            # SQL held in a module-level constant
+            statements.extend(
+                (node.lineno, sql) for sql in _resolve_constant(tree, arg.id)
+            )
+        else:
+            statements.append((node.lineno, None))  # dynamic SQL
+    return sorted(statements, key=lambda s: s[0])
+
+
+def _resolve_constant(tree, name):
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(
+            isinstance(t, ast.Name) and t.id == name for t in node.targets
+        ):
+            if isinstance(node.value, ast.Constant) and isinstance(node.value.value, str):
+                return [node.value.value]
+    return []
+
+
+def normalize(sql):
+    return ' '.join(sql.split())
+
+
+def explain(db, sql):
+    params = [None] * sql.count('?')
+    return [row[3] for row in db.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()]
+
+
+def main():
+    verbose = '-v' in sys.argv
+
+    print("=" * 60)
+    print("QUERY PLAN CHECK")
+    print("=" * 60)
+
+    db = sqlite3.connect(':memory:')
+    with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
+        db.executescript(f.read())
+
+    failures = []
+    checked = 0
+    skipped = 0
+
+    for lineno, sql in extract_statements(APP_PATH):
+        if sql is None:
+            print(f"   [SKIP] app.py:{lineno} dynamic SQL")
+            skipped += 1
+            continue
+
+        sql = normalize(sql)
+        if sql.upper().startswith(('PRAGMA', 'BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT',
+                                   'RELEASE', 'ANALYZE', 'VACUUM', 'CREATE', 'DROP')):
+            continue
+
+        try:
+            plan = explain(db, sql)
+        except sqlite3.Error as e:
+            print(f"   [ERROR] app.py:{lineno} {e}: {sql[:80]}")
+            failures.append((lineno, sql, [str(e)]))
+            continue
+
+        checked += 1
+        ctes = set(CTE_NAME_RE.findall(sql))
+        scans = [step for step in plan
+                 if (m := FULL_SCAN_RE.match(step)) and m.group(1) not in ctes]
+        if scans and sql not in ALLOWED_FULL_SCANS:
+            print(f"   [FAIL] app.py:{lineno} {sql[:80]}")
+            for step in scans:
+                print(f"          {step}")
+            failures.append((lineno, sql, scans))
+        elif verbose:
+            print(f"   [OK] app.py:{lineno} {sql[:80]}")
+            for step in plan:
+                print(f"          {step}")
+
+    db.close()
+
+    print("\n" + "=" * 60)
+    print(f"Checked {checked} statements, skipped {skipped} dynamic statements")
+    if failures:
+        print(f"[FAIL] {len(failures)} statements still do a full table scan")
+        print("=" * 60)
+        return 1
+
+    print("[SUCCESS] No full table scans")
+    print("=" * 60)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -82,6 +82,19 @@ CREATE TABLE IF NOT EXISTS quiz_submissions (
     FOREIGN KEY (student_id) REFERENCES users(id)
 );
 
+-- Per-question answers for each submission (feeds knowledge gap analysis)
+CREATE TABLE IF NOT EXISTS quiz_answers (
+    submission_id INTEGER NOT NULL,
+    student_id INTEGER NOT NULL,
+    question_id INTEGER NOT NULL,
+    chosen_option INTEGER, -- NULL when the question was skipped
+    is_correct INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (submission_id, question_id),
+    FOREIGN KEY (submission_id) REFERENCES quiz_submissions(id),
+    FOREIGN KEY (student_id) REFERENCES users(id),
+    FOREIGN KEY (question_id) REFERENCES quiz_questions(id)
+) WITHOUT ROWID;
+
 -- AI queries table
 CREATE TABLE IF NOT EXISTS ai_queries (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -100,6 +113,12 @@ CREATE TABLE IF NOT EXISTS student_metrics (
     avg_time REAL DEFAULT 0,
     pace_score REAL DEFAULT 0,
     rating REAL DEFAULT 0,
+    -- Running sums the metrics above are derived from
+    total_score INTEGER DEFAULT 0,
+    total_possible INTEGER DEFAULT 0,
+    total_duration INTEGER DEFAULT 0,
+    submission_count INTEGER DEFAULT 0,
+    chat_count INTEGER DEFAULT 0,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     PRIMARY KEY (user_id, class_id),
     FOREIGN KEY (user_id) REFERENCES users(id),
@@ -158,6 +177,35 @@ CREATE TABLE IF NOT EXISTS question_topics (
     FOREIGN KEY (topic_id) REFERENCES topics(id)
 );
 
+-- Topic prerequisite DAG (prerequisite_id must be learned before topic_id)
+CREATE TABLE IF NOT EXISTS topic_prerequisites (
+    topic_id INTEGER NOT NULL,
+    prerequisite_id INTEGER NOT NULL,
+    PRIMARY KEY (topic_id, prerequisite_id),
+    FOREIGN KEY (topic_id) REFERENCES topics(id),
+    FOREIGN KEY (prerequisite_id) REFERENCES topics(id)
+) WITHOUT ROWID;
+
+-- Lecture-Topic mapping (set by the teacher; targets gap recommendations)
+CREATE TABLE IF NOT EXISTS lecture_topics (
+    lecture_id INTEGER NOT NULL,
+    topic_id INTEGER NOT NULL,
+    PRIMARY KEY (lecture_id, topic_id),
+    FOREIGN KEY (lecture_id) REFERENCES lectures(id),
+    FOREIGN KEY (topic_id) REFERENCES topics(id)
+) WITHOUT ROWID;
+
+-- Quiz-Topic mapping with how many of the quiz's questions test the topic.
+-- Derived from question_topics by the triggers at the end of this file
+CREATE TABLE IF NOT EXISTS quiz_topics (
+    quiz_id INTEGER NOT NULL,
+    topic_id INTEGER NOT NULL,
+    question_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (quiz_id, topic_id),
+    FOREIGN KEY (quiz_id) REFERENCES quizzes(id),
+    FOREIGN KEY (topic_id) REFERENCES topics(id)
+) WITHOUT ROWID;
+
 -- Knowledge gaps table (AI-detected weak areas)
 CREATE TABLE IF NOT EXISTS knowledge_gaps (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -185,7 +233,40 @@ CREATE TABLE IF NOT EXISTS recommendations (
     FOREIGN KEY (user_id) REFERENCES users(id)
 );
 
--- Learning paths (AI-generated personalized paths)
+-- When each student's recommendations for a class were last regenerated
+CREATE TABLE IF NOT EXISTS recommendation_refresh (
+    user_id INTEGER NOT NULL,
+    class_id INTEGER NOT NULL,
+    refreshed_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (user_id, class_id),
+    FOREIGN KEY (user_id) REFERENCES users(id),
+    FOREIGN KEY (class_id) REFERENCES classes(id)
+) WITHOUT ROWID;
+
+-- Lecture opens per student (collaborative-filtering signal)
+CREATE TABLE IF NOT EXISTS lecture_views (
+    user_id INTEGER NOT NULL,
+    lecture_id INTEGER NOT NULL,
+    view_count INTEGER DEFAULT 1,
+    last_viewed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, lecture_id),
+    FOREIGN KEY (user_id) REFERENCES users(id),
+    FOREIGN KEY (lecture_id) REFERENCES lectures(id)
+) WITHOUT ROWID;
+
+-- Top-K item-item neighbours per lecture/quiz (rebuilt by the cf_rebuild job)
+CREATE TABLE IF NOT EXISTS content_neighbors (
+    content_type TEXT NOT NULL, -- 'lecture', 'quiz'
+    content_id INTEGER NOT NULL,
+    neighbor_type TEXT NOT NULL,
+    neighbor_id INTEGER NOT NULL,
+    similarity REAL NOT NULL, -- cosine over the students x content interactions
+    class_id INTEGER NOT NULL,
+    PRIMARY KEY (content_type, content_id, neighbor_type, neighbor_id),
+    FOREIGN KEY (class_id) REFERENCES classes(id)
+) WITHOUT ROWID;
+
+-- Learning paths (per student and class, kept current by refresh_learning_path)
 CREATE TABLE IF NOT EXISTS learning_paths (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     user_id INTEGER NOT NULL,
@@ -198,7 +279,29 @@ CREATE TABLE IF NOT EXISTS learning_paths (
     FOREIGN KEY (class_id) REFERENCES classes(id)
 );
 
--- Student topic mastery (detailed tracking)
+-- Bayesian Knowledge Tracing parameters per topic (fitted by the bkt_refit job)
+CREATE TABLE IF NOT EXISTS bkt_parameters (
+    topic_id INTEGER PRIMARY KEY,
+    prior REAL NOT NULL,
+    learn REAL NOT NULL,
+    slip REAL NOT NULL,
+    guess REAL NOT NULL,
+    observations INTEGER DEFAULT 0, -- answers the fit used
+    fitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (topic_id) REFERENCES topics(id)
+);
+
+-- 2PL item parameters per question (fitted by the irt_calibrate job)
+CREATE TABLE IF NOT EXISTS item_parameters (
+    question_id INTEGER PRIMARY KEY,
+    discrimination REAL NOT NULL,
+    difficulty REAL NOT NULL,
+    responses INTEGER DEFAULT 0, -- answers the calibration used
+    calibrated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (question_id) REFERENCES quiz_questions(id)
+);
+
+-- Student topic mastery (detailed tracking, BKT P(known) x 100)
 CREATE TABLE IF NOT EXISTS topic_mastery (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     user_id INTEGER NOT NULL,
@@ -207,6 +310,10 @@ CREATE TABLE IF NOT EXISTS topic_mastery (
     confidence_level TEXT DEFAULT 'beginner', -- beginner, intermediate, advanced, expert
     time_spent INTEGER DEFAULT 0, -- seconds
     last_practiced TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    next_review_at TIMESTAMP, -- SM-2 spaced repetition; NULL until first reviewed
+    review_interval REAL DEFAULT 0, -- days
+    ease_factor REAL DEFAULT 2.5,
+    review_count INTEGER DEFAULT 0, -- consecutive successful reviews
     FOREIGN KEY (user_id) REFERENCES users(id),
     FOREIGN KEY (topic_id) REFERENCES topics(id),
     UNIQUE(user_id, topic_id)
@@ -240,3 +347,236 @@ CREATE TABLE IF NOT EXISTS ai_context_sessions (
     FOREIGN KEY (user_id) REFERENCES users(id)
 );
 
+
+-- ============================================================================
+-- INDEXES (matched to the queries in app.py)
+-- All statements are idempotent so they can be re-applied to existing
+-- databases; run `python check_query_plans.py` after changing a query.
+-- ============================================================================
+
+-- Teacher class lists, newest first
+CREATE INDEX IF NOT EXISTS idx_classes_teacher_created
+    ON classes(teacher_id, created_at);
+-- Class catalogue (available classes), newest first
+CREATE INDEX IF NOT EXISTS idx_classes_created
+    ON classes(created_at);
+
+-- Class rosters (UNIQUE(student_id, class_id) covers per-student lookups)
+CREATE INDEX IF NOT EXISTS idx_enrollments_class
+    ON enrollments(class_id, student_id);
+
+CREATE INDEX IF NOT EXISTS idx_lectures_class_uploaded
+    ON lectures(class_id, uploaded_at);
+
+-- Chat history per class, in time order
+CREATE INDEX IF NOT EXISTS idx_chat_messages_class_timestamp
+    ON chat_messages(class_id, timestamp);
+-- Chat engagement counts when a student's metrics row is first created
+CREATE INDEX IF NOT EXISTS idx_chat_messages_user_class
+    ON chat_messages(user_id, class_id);
+
+CREATE INDEX IF NOT EXISTS idx_quizzes_class_created
+    ON quizzes(class_id, created_at);
+
+-- Covers grading in submit_quiz (id is the rowid)
+CREATE INDEX IF NOT EXISTS idx_quiz_questions_quiz
+    ON quiz_questions(quiz_id, correct_option_index);
+
+-- Student history, recent quizzes and last-activity lookups
+CREATE INDEX IF NOT EXISTS idx_quiz_submissions_student_submitted
+    ON quiz_submissions(student_id, submitted_at);
+CREATE INDEX IF NOT EXISTS idx_quiz_submissions_quiz
+    ON quiz_submissions(quiz_id, student_id);
+
+CREATE INDEX IF NOT EXISTS idx_ai_queries_user
+    ON ai_queries(user_id, created_at);
+
+-- Teacher analytics per class ordered by rating
+CREATE INDEX IF NOT EXISTS idx_student_metrics_class_rating
+    ON student_metrics(class_id, rating);
+CREATE INDEX IF NOT EXISTS idx_student_metrics_user_updated
+    ON student_metrics(user_id, updated_at);
+-- Low-pace students per class for the intervention sweep
+CREATE INDEX IF NOT EXISTS idx_student_metrics_class_pace
+    ON student_metrics(class_id, pace_score);
+
+CREATE INDEX IF NOT EXISTS idx_feedback_created
+    ON feedback(created_at);
+CREATE INDEX IF NOT EXISTS idx_feedback_user
+    ON feedback(user_id);
+
+-- OTP verification and cleanup
+CREATE INDEX IF NOT EXISTS idx_password_reset_otp_email_expires
+    ON password_reset_otp(email, expires_at);
+CREATE INDEX IF NOT EXISTS idx_password_reset_otp_expires
+    ON password_reset_otp(expires_at);
+CREATE INDEX IF NOT EXISTS idx_password_reset_otp_used
+    ON password_reset_otp(used) WHERE used = 1;
+
+CREATE INDEX IF NOT EXISTS idx_live_sessions_class_active
+    ON live_sessions(class_id, is_active, started_at);
+
+CREATE INDEX IF NOT EXISTS idx_topics_class_name
+    ON topics(class_id, topic_name);
+
+-- Gap analysis aggregates a student's answers per question (covering)
+CREATE INDEX IF NOT EXISTS idx_quiz_answers_student_question
+    ON quiz_answers(student_id, question_id, is_correct);
+
+-- All answers to a question, for per-topic batch jobs (covering)
+CREATE INDEX IF NOT EXISTS idx_quiz_answers_question
+    ON quiz_answers(question_id, student_id, submission_id, is_correct);
+
+-- Reverse lookup; the primary key already covers question_id
+CREATE INDEX IF NOT EXISTS idx_question_topics_topic
+    ON question_topics(topic_id, question_id);
+
+-- A class's prerequisite edges are read with its topics (PK covers per-topic lookups)
+CREATE INDEX IF NOT EXISTS idx_topic_prerequisites_prerequisite
+    ON topic_prerequisites(prerequisite_id, topic_id);
+
+-- Topic -> content lookups for recommendations (covering)
+CREATE INDEX IF NOT EXISTS idx_lecture_topics_topic
+    ON lecture_topics(topic_id, lecture_id);
+CREATE INDEX IF NOT EXISTS idx_quiz_topics_topic
+    ON quiz_topics(topic_id, quiz_id, question_count);
+
+-- Weakest topics first (UNIQUE(user_id, topic_id) covers point lookups)
+CREATE INDEX IF NOT EXISTS idx_knowledge_gaps_user_mastery
+    ON knowledge_gaps(user_id, mastery_level);
+-- Class-wide mastery reads every counter of a class's topics (covering)
+DROP INDEX IF EXISTS idx_knowledge_gaps_topic;
+CREATE INDEX IF NOT EXISTS idx_knowledge_gaps_topic_counters
+    ON knowledge_gaps(topic_id, user_id, questions_attempted, questions_correct);
+
+-- One row per item and state; generation inserts with ON CONFLICT DO NOTHING
+DROP INDEX IF EXISTS idx_recommendations_user_content;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_recommendations_unique
+    ON recommendations(user_id, content_type, content_id, is_completed);
+-- The pending-recommendations list
+CREATE INDEX IF NOT EXISTS idx_recommendations_user_priority
+    ON recommendations(user_id, is_completed, priority, created_at);
+
+-- Completed recommendations per item, read by the cf_rebuild job
+CREATE INDEX IF NOT EXISTS idx_recommendations_completed
+    ON recommendations(content_type, content_id, user_id) WHERE is_completed = 1;
+
+-- Who opened a class's lectures, read by the cf_rebuild job (covering)
+CREATE INDEX IF NOT EXISTS idx_lecture_views_lecture
+    ON lecture_views(lecture_id, user_id);
+
+-- A class's neighbour lists are replaced as a whole
+CREATE INDEX IF NOT EXISTS idx_content_neighbors_class
+    ON content_neighbors(class_id);
+
+-- One path per student and class; refreshes upsert on it
+DROP INDEX IF EXISTS idx_learning_paths_user_class;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_learning_paths_user_class_unique
+    ON learning_paths(user_id, class_id);
+
+CREATE INDEX IF NOT EXISTS idx_topic_mastery_topic
+    ON topic_mastery(topic_id);
+-- A student's reviews that are due, soonest first
+CREATE INDEX IF NOT EXISTS idx_topic_mastery_user_review
+    ON topic_mastery(user_id, next_review_at);
+
+-- Open alerts per teacher, and at most one open alert per student, class and
+-- type (the intervention sweep inserts with ON CONFLICT DO NOTHING)
+CREATE INDEX IF NOT EXISTS idx_teacher_interventions_teacher_open
+    ON teacher_interventions(teacher_id, is_resolved, created_at);
+DROP INDEX IF EXISTS idx_teacher_interventions_student_alert;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_teacher_interventions_open_unique
+    ON teacher_interventions(student_id, class_id, alert_type) WHERE is_resolved = 0;
+
+CREATE INDEX IF NOT EXISTS idx_ai_context_sessions_user
+    ON ai_context_sessions(user_id);
+
+-- ============================================================================
+-- Row counts for /api/db/status, kept current by triggers so the status
+-- endpoint never has to COUNT(*) a large table
+-- ============================================================================
+CREATE TABLE IF NOT EXISTS table_row_counts (
+    table_name TEXT PRIMARY KEY,
+    row_count INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS trg_users_count_insert AFTER INSERT ON users
+BEGIN UPDATE table_row_counts SET row_count = row_count + 1 WHERE table_name = 'users'; END;
+CREATE TRIGGER IF NOT EXISTS trg_users_count_delete AFTER DELETE ON users
+BEGIN UPDATE table_row_counts SET row_count = row_count - 1 WHERE table_name = 'users'; END;
+CREATE TRIGGER IF NOT EXISTS trg_classes_count_insert AFTER INSERT ON classes
+BEGIN UPDATE table_row_counts SET row_count = row_count + 1 WHERE table_name = 'classes'; END;
+CREATE TRIGGER IF NOT EXISTS trg_classes_count_delete AFTER DELETE ON classes
+BEGIN UPDATE table_row_counts SET row_count = row_count - 1 WHERE table_name = 'classes'; END;
+CREATE TRIGGER IF NOT EXISTS trg_enrollments_count_insert AFTER INSERT ON enrollments
+BEGIN UPDATE table_row_counts SET row_count = row_count + 1 WHERE table_name = 'enrollments'; END;
+CREATE TRIGGER IF NOT EXISTS trg_enrollments_count_delete AFTER DELETE ON enrollments
+BEGIN UPDATE table_row_counts SET row_count = row_count - 1 WHERE table_name = 'enrollments'; END;
+CREATE TRIGGER IF NOT EXISTS trg_lectures_count_insert AFTER INSERT ON lectures
+BEGIN UPDATE table_row_counts SET row_count = row_count + 1 WHERE table_name = 'lectures'; END;
+CREATE TRIGGER IF NOT EXISTS trg_lectures_count_delete AFTER DELETE ON lectures
+BEGIN UPDATE table_row_counts SET row_count = row_count - 1 WHERE table_name = 'lectures'; END;
+CREATE TRIGGER IF NOT EXISTS trg_quizzes_count_insert AFTER INSERT ON quizzes
+BEGIN UPDATE table_row_counts SET row_count = row_count + 1 WHERE table_name = 'quizzes'; END;
+CREATE TRIGGER IF NOT EXISTS trg_quizzes_count_delete AFTER DELETE ON quizzes
+BEGIN UPDATE table_row_counts SET row_count = row_count - 1 WHERE table_name = 'quizzes'; END;
+CREATE TRIGGER IF NOT EXISTS trg_quiz_submissions_count_insert AFTER INSERT ON quiz_submissions
+BEGIN UPDATE table_row_counts SET row_count = row_count + 1 WHERE table_name = 'quiz_submissions'; END;
+CREATE TRIGGER IF NOT EXISTS trg_quiz_submissions_count_delete AFTER DELETE ON quiz_submissions
+BEGIN UPDATE table_row_counts SET row_count = row_count - 1 WHERE table_name = 'quiz_submissions'; END;
+CREATE TRIGGER IF NOT EXISTS trg_chat_messages_count_insert AFTER INSERT ON chat_messages
+BEGIN UPDATE table_row_counts SET row_count = row_count + 1 WHERE table_name = 'chat_messages'; END;
+CREATE TRIGGER IF NOT EXISTS trg_chat_messages_count_delete AFTER DELETE ON chat_messages
+BEGIN UPDATE table_row_counts SET row_count = row_count - 1 WHERE table_name = 'chat_messages'; END;
+
+-- Seed once (existing databases); the COUNT(*) only runs while the row is missing
+INSERT INTO table_row_counts (table_name, row_count)
+    SELECT 'users', (SELECT COUNT(*) FROM users)
+    WHERE NOT EXISTS (SELECT 1 FROM table_row_counts WHERE table_name = 'users');
+INSERT INTO table_row_counts (table_name, row_count)
+    SELECT 'classes', (SELECT COUNT(*) FROM classes)
+    WHERE NOT EXISTS (SELECT 1 FROM table_row_counts WHERE table_name = 'classes');
+INSERT INTO table_row_counts (table_name, row_count)
+    SELECT 'enrollments', (SELECT COUNT(*) FROM enrollments)
+    WHERE NOT EXISTS (SELECT 1 FROM table_row_counts WHERE table_name = 'enrollments');
+INSERT INTO table_row_counts (table_name, row_count)
+    SELECT 'lectures', (SELECT COUNT(*) FROM lectures)
+    WHERE NOT EXISTS (SELECT 1 FROM table_row_counts WHERE table_name = 'lectures');
+INSERT INTO table_row_counts (table_name, row_count)
+    SELECT 'quizzes', (SELECT COUNT(*) FROM quizzes)
+    WHERE NOT EXISTS (SELECT 1 FROM table_row_counts WHERE table_name = 'quizzes');
+INSERT INTO table_row_counts (table_name, row_count)
+    SELECT 'quiz_submissions', (SELECT COUNT(*) FROM quiz_submissions)
+    WHERE NOT EXISTS (SELECT 1 FROM table_row_counts WHERE table_name = 'quiz_submissions');
+INSERT INTO table_row_counts (table_name, row_count)
+    SELECT 'chat_messages', (SELECT COUNT(*) FROM chat_messages)
+    WHERE NOT EXISTS (SELECT 1 FROM table_row_counts WHERE table_name = 'chat_messages');
+
+-- ============================================================================
+-- quiz_topics follows question_topics, so tagging a question is all it takes
+-- to link its quiz to the topic
+-- ============================================================================
+CREATE TRIGGER IF NOT EXISTS trg_question_topics_quiz_insert AFTER INSERT ON question_topics
+BEGIN
+    INSERT INTO quiz_topics (quiz_id, topic_id, question_count)
+    SELECT quiz_id, NEW.topic_id, 1 FROM quiz_questions WHERE id = NEW.question_id
+    ON CONFLICT(quiz_id, topic_id) DO UPDATE SET question_count = question_count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_question_topics_quiz_delete AFTER DELETE ON question_topics
+BEGIN
+    UPDATE quiz_topics SET question_count = question_count - 1
+    WHERE topic_id = OLD.topic_id
+        AND quiz_id = (SELECT quiz_id FROM quiz_questions WHERE id = OLD.question_id);
+    DELETE FROM quiz_topics
+    WHERE topic_id = OLD.topic_id
+        AND quiz_id = (SELECT quiz_id FROM quiz_questions WHERE id = OLD.question_id)
+        AND question_count <= 0;
+END;
+
+-- Backfill once (existing databases); only runs while quiz_topics is empty
+INSERT INTO quiz_topics (quiz_id, topic_id, question_count)
+    SELECT qq.quiz_id, qt.topic_id, COUNT(*)
+    FROM question_topics qt
+    JOIN quiz_questions qq ON qq.id = qt.question_id
+    WHERE NOT EXISTS (SELECT 1 FROM quiz_topics)
+    GROUP BY qq.quiz_id, qt.topic_id;
@@ -17,8 +17,9 @@ def seed_database():
     print("Clearing existing data...")
     tables = [
         'ai_context_sessions', 'teacher_interventions', 'topic_mastery', 'learning_paths',
-        'recommendations', 'knowledge_gaps', 'question_topics', 'topics',
-        'messages', 'quiz_submissions', 'quiz_questions', 'quizzes', 'lectures',
+        'recommendations', 'content_neighbors', 'lecture_views', 'knowledge_gaps',
+        'lecture_topics', 'quiz_topics', 'question_topics', 'topics',
+        'messages', 'quiz_answers', 'quiz_submissions', 'quiz_questions', 'quizzes', 'lectures',
         'enrollments', 'classes', 'users'
     ]
     
@@ -336,6 +337,20 @@ def seed_database():
     db.commit()
     print("[OK] Assigned topics to questions")
     
+    # Tag lectures with the topics they cover (quiz_topics follows question_topics)
+    print("Assigning topics to lectures...")
+    lecture_topics = [
+        (1, 1), (1, 2),          # arrays_and_linked_lists.pdf: Arrays, Linked Lists
+        (2, 3), (2, 4),          # trees_and_graphs.pdf: Trees, Graphs
+        (3, 6), (3, 7),          # html_css_basics.pdf: HTML Basics, CSS Styling
+        (4, 8),                  # javascript_fundamentals.pdf
+        (5, 10), (5, 11),        # intro_to_ml.pdf: ML Basics, Classification
+    ]
+    cursor.executemany('INSERT INTO lecture_topics (lecture_id, topic_id) VALUES (?, ?)', lecture_topics)
+    
+    db.commit()
+    print(f"[OK] Assigned topics to {len(set(l for l, _ in lecture_topics))} lectures")
+    
     # Calculate and insert student metrics
     print("Calculating student metrics...")
     
@@ -381,9 +396,11 @@ def seed_database():
             
             cursor.execute('''
                 INSERT INTO student_metrics
-                (user_id, class_id, score_avg, avg_time, pace_score, rating)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (student_id, class_id, round(accuracy * 100, 1), round(avg_time, 1), pace_score, rating))
+                (user_id, class_id, score_avg, avg_time, pace_score, rating,
+                 total_score, total_possible, total_duration, submission_count, chat_count)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (student_id, class_id, round(accuracy * 100, 1), round(avg_time, 1), pace_score, rating,
+                  total_score, total_possible, sum(s[2] for s in submissions), len(submissions), chat_count))
     
     db.commit()
     print(f"[OK] Calculated metrics for {len(student_class_pairs)} student-class pairs")
@@ -26,7 +26,7 @@ cursor = db.cursor()
 # Test 1: Check New Tables
 print("\n[TEST 1] Checking Adaptive Learning Tables...")
 new_tables = [
-    'topics', 'question_topics', 'knowledge_gaps', 
+    'topics', 'question_topics', 'quiz_answers', 'knowledge_gaps', 
     'recommendations', 'learning_paths', 'topic_mastery',
     'teacher_interventions', 'ai_context_sessions'
 ]
@@ -243,6 +243,172 @@ else:
     print("   [WARNING] No AI API key found")
     print("   Chatbot will show setup message")
 
+# Tests 9-14 check the numerical code directly against a scratch database,
+# so they don't depend on the demo data
+print("\n[TEST 9] Loading app against a scratch database...")
+
+import tempfile
+import numpy as np
+
+scratch_dir = tempfile.mkdtemp(prefix='learnvault-test-')
+os.environ['DATABASE_PATH'] = os.path.join(scratch_dir, 'test.db')
+import app as learnvault
+learnvault.init_db()
+print(f"   [OK] {os.environ['DATABASE_PATH']}")
+
+failed_checks = []
+
+def check(label, ok, detail=''):
+    if ok:
+        print(f"   [OK] {label} {detail}")
+    else:
+        print(f"   [FAIL] {label} {detail}")
+        failed_checks.append(label)
+
+rng = np.random.default_rng(7)
+
+# Test 10: BKT
+print("\n[TEST 10] Testing BKT grid fit...")
+
+true_params = (0.3, 0.2, 0.1, 0.2)  # prior, learn, slip, guess: a BKT_GRID point
+students, steps = 3000, 20
+known = rng.random(students) < true_params[0]
+bkt_correct = np.zeros((students, steps), dtype=bool)
+for step in range(steps):
+    bkt_correct[:, step] = np.where(known, rng.random(students) > true_params[2],
+                                    rng.random(students) < true_params[3])
+    known |= rng.random(students) < true_params[1]
+bkt_mask = np.ones_like(bkt_correct)
+bkt_mask[:500, 10:] = False  # some students stop early
+
+_, log_likelihood = learnvault.bkt_trace(bkt_correct, bkt_mask, *learnvault.BKT_GRID.T)
+fitted = learnvault.BKT_GRID[int(np.argmax(log_likelihood))]
+check("grid fit recovers the simulated parameters",
+      np.allclose(fitted, true_params), f"(fitted {fitted.tolist()})")
+
+p_known = true_params[0]
+for answer in bkt_correct[0, :10]:  # the first student stops after 10 answers
+    p_known = learnvault.bkt_step(p_known, answer, *true_params[1:])
+traced, _ = learnvault.bkt_trace(bkt_correct[:1], bkt_mask[:1], *true_params)
+check("bkt_trace matches step-by-step bkt_step", abs(traced[0, 0] - p_known) < 1e-9)
+
+# Test 11: IRT
+print("\n[TEST 11] Testing 2PL calibration...")
+
+attempts, items = 2000, 30
+a_true = rng.uniform(0.6, 2.2, items)
+b_true = rng.normal(0, 1, items)
+theta_true = rng.normal(0, 1, attempts)
+irt_correct = rng.random((attempts, items)) < learnvault.irt_probability(
+    theta_true[:, None], a_true, b_true)
+irt_mask = np.ones_like(irt_correct)
+
+a_est, b_est = learnvault.calibrate_items(irt_correct, irt_mask)
+iterations = learnvault.IRT_FIT_ITERATIONS
+learnvault.IRT_FIT_ITERATIONS = iterations * 2
+a_longer, b_longer = learnvault.calibrate_items(irt_correct, irt_mask)
+learnvault.IRT_FIT_ITERATIONS = iterations
+
+check("calibration converges",
+      np.abs(a_longer - a_est).max() < 0.05 and np.abs(b_longer - b_est).max() < 0.05,
+      f"(max change with twice the iterations: {max(np.abs(a_longer - a_est).max(), np.abs(b_longer - b_est).max()):.4f})")
+check("difficulties recovered", np.corrcoef(b_est, b_true)[0, 1] > 0.95,
+      f"(r = {np.corrcoef(b_est, b_true)[0, 1]:.3f})")
+check("discriminations recovered", np.corrcoef(a_est, a_true)[0, 1] > 0.8,
+      f"(r = {np.corrcoef(a_est, a_true)[0, 1]:.3f})")
+
+bank = learnvault.ItemBank(list(range(1, items + 1)), [0] * items, a_est, b_est)
+theta, se = bank.estimate([(i + 1, bool(irt_correct[0, i])) for i in range(items)])
+check("EAP ability estimate", abs(theta - theta_true[0]) < 3 * se,
+      f"(theta {theta:.2f} +/- {se:.2f}, true {theta_true[0]:.2f})")
+
+# Test 12: item analysis
+print("\n[TEST 12] Testing item analysis against a hand-computed matrix...")
+
+# 5 students x 3 items; totals 3, 2, 1, 1, 0
+responses = [[1, 1, 1], [1, 1, 0], [1, 0, 0], [0, 1, 0], [0, 0, 0]]
+questions = [{'id': q, 'question_text': f'Q{q}', 'options': '["right", "wrong"]',
+              'correct_option_index': 0} for q in (1, 2, 3)]
+stats = learnvault.ItemStatistics(1, questions)
+stats.merge(np.array([(student + 1, item + 1, 0 if right else 1, right)
+                      for student, row in enumerate(responses)
+                      for item, right in enumerate(row)]), 5)
+report = stats.report()
+# p = .6, .6, .2; sum pq = .64; score variance = 1.04
+# KR-20 = 3/2 * (1 - .64 / 1.04); item 1: cov = .36, rest variance = .56
+check("KR-20", report['kr20'] == 0.577, f"({report['kr20']})")
+check("point-biserial", report['items'][0]['point_biserial'] == 0.721,
+      f"({report['items'][0]['point_biserial']})")
+check("corrected point-biserial", report['items'][0]['corrected_point_biserial'] == 0.327,
+      f"({report['items'][0]['corrected_point_biserial']})")
+check("p-values", [item['p_value'] for item in report['items']] == [0.6, 0.6, 0.2])
+
+# Test 13: SM-2
+print("\n[TEST 13] Testing SM-2 review scheduling...")
+
+review = learnvault.sm2_review(5, 0, 0, 2.5)
+check("first pass: 1 day", review == (1, 1, 2.6), f"{review}")
+review = learnvault.sm2_review(5, 1, 1, 2.6)
+check("second pass: 6 days", review == (2, 6, 2.7), f"{review}")
+repetitions, interval, ease = learnvault.sm2_review(4, 2, 6, 2.7)
+check("third pass: interval x ease", (repetitions, round(interval, 6), round(ease, 6)) == (3, 16.2, 2.7),
+      f"{(repetitions, interval, ease)}")
+repetitions, interval, ease = learnvault.sm2_review(2, 3, 16.2, 2.7)
+check("lapse resets the interval", (repetitions, interval, round(ease, 6)) == (0, 1, 2.38),
+      f"{(repetitions, interval, ease)}")
+review = learnvault.sm2_review(0, 0, 1, learnvault.SM2_MIN_EASE)
+check("ease floor", review[2] == learnvault.SM2_MIN_EASE, f"{review}")
+
+# Test 14: quiz submission -> mastery matrix through the API
+print("\n[TEST 14] Testing quiz submission and mastery matrix round trip...")
+
+with learnvault.get_db_context() as scratch:
+    scratch.execute("INSERT INTO users (id, name, email, password_hash, role) VALUES (1, 'T', 't@test', 'x', 'teacher')")
+    scratch.executemany("INSERT INTO users (id, name, email, password_hash, role) VALUES (?, ?, ?, 'x', 'student')",
+                        [(2, 'S2', 's2@test'), (3, 'S3', 's3@test')])
+    scratch.execute("INSERT INTO classes (id, title, teacher_id) VALUES (1, 'C', 1)")
+    scratch.executemany("INSERT INTO enrollments (student_id, class_id) VALUES (?, 1)", [(2,), (3,)])
+    scratch.executemany("INSERT INTO topics (id, class_id, topic_name) VALUES (?, 1, ?)", [(1, 'A'), (2, 'B')])
+    scratch.execute("INSERT INTO quizzes (id, class_id, title) VALUES (1, 1, 'Q')")
+    scratch.executemany("INSERT INTO quiz_questions (id, quiz_id, question_text, options, correct_option_index) VALUES (?, 1, ?, '[\"a\", \"b\"]', 0)",
+                        [(q, f'Q{q}') for q in (1, 2, 3, 4)])
+    scratch.executemany("INSERT INTO question_topics (question_id, topic_id) VALUES (?, ?)",
+                        [(1, 1), (2, 1), (3, 2), (4, 2)])
+
+teacher = learnvault.app.test_client()
+student = learnvault.app.test_client()
+with teacher.session_transaction() as s:
+    s.update({'user_id': 1, 'role': 'teacher', 'name': 'T'})
+with student.session_transaction() as s:
+    s.update({'user_id': 2, 'role': 'student', 'name': 'S2'})
+
+def mastery_row(student_id):
+    matrix = teacher.get('/api/teacher/class/1/mastery-matrix?include=matrix').get_json()
+    return matrix['matrix']['values'][matrix['matrix']['student_ids'].index(student_id)]
+
+check("empty class", mastery_row(2) == [None, None])
+
+# Topic A: 2/2 right, topic B: 1/2 right
+result = student.post('/api/submit_quiz', json={
+    'quiz_id': 1, 'answers': {'1': 0, '2': 0, '3': 0, '4': 1}, 'duration': 30
+})
+check("submission accepted", result.status_code == 200 and result.get_json()['score'] == 3,
+      f"({result.status_code})")
+check("cached matrix picks up the submission", mastery_row(2) == [1.0, 0.5], f"{mastery_row(2)}")
+
+student.post('/api/submit_quiz', json={
+    'quiz_id': 1, 'answers': {'1': 1, '2': 1, '3': 0, '4': 0}, 'duration': 30
+})
+check("second submission accumulates", mastery_row(2) == [0.5, 0.75], f"{mastery_row(2)}")
+learnvault.class_mastery_cache.invalidate()
+check("matches a fresh load", mastery_row(2) == [0.5, 0.75])
+
+result = student.post('/api/submit_quiz', json={'quiz_id': 1, 'answers': {}, 'mode': 'adaptive'})
+check("adaptive submit without a finished session is rejected", result.status_code == 400)
+with learnvault.get_db_context() as scratch:
+    submissions = scratch.execute("SELECT COUNT(*) FROM quiz_submissions").fetchone()[0]
+check("rejected submission wrote nothing", submissions == 2, f"({submissions} submissions)")
+
 # Final Summary
 print("\n" + "="*60)
 print("SUMMARY")
@@ -258,6 +424,8 @@ if topic_count == 0:
     issues.append("No topics for adaptive learning")
 if not ai_configured:
     issues.append("No AI API key (optional)")
+if failed_checks:
+    issues.append(f"Numerical checks failed: {', '.join(failed_checks)}")
 
 if not issues:
     print("\n[SUCCESS] ALL TESTS PASSED!")